@@ -0,0 +1,66 @@
+from collections import deque
+import asyncio
+
+
+def estimate_tokens(text):
+    # About four characters per token for English text, without pulling in
+    # a tokenizer for every model the AI room might be pointed at
+    return max(1, (len(text) + 3) // 4)
+
+
+class ConversationWindow:
+    """
+    The recent turns of one AI room with a running token count, plus a
+    summary of the turns that no longer fit. `cursor` is the
+    (timestamp, _id) of the newest message in the window, so later messages
+    can be appended without re-reading the ones already counted.
+    """
+
+    def __init__(self, summary: str = "", cursor=None):
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(summary) if summary else 0
+        self.turns = deque()
+        self.turn_tokens = 0
+        self.cursor = cursor
+        self.lock = asyncio.Lock()
+
+    @property
+    def tokens(self):
+        return self.summary_tokens + self.turn_tokens
+
+    @property
+    def has_history(self):
+        """Whether anything came before the newest turn."""
+        return len(self.turns) > 1 or bool(self.summary)
+
+    def append(self, role, content, cursor=None):
+        tokens = estimate_tokens(content)
+        self.turns.append((role, content, tokens, cursor))
+        self.turn_tokens += tokens
+        if cursor is not None:
+            self.cursor = cursor
+
+    def overflow(self, budget, target):
+        """
+        Once over `budget` tokens, pop the oldest turns until at most
+        `target` remain (always keeping the newest) and return them.
+        """
+        dropped = []
+        if self.tokens <= budget:
+            return dropped
+        while len(self.turns) > 1 and self.tokens > target:
+            turn = self.turns.popleft()
+            self.turn_tokens -= turn[2]
+            dropped.append(turn)
+        return dropped
+
+    def set_summary(self, summary):
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(summary) if summary else 0
+
+    def messages(self, system_message):
+        messages = [{"role": "system", "content": system_message}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        messages += [{"role": role, "content": content} for role, content, _, _ in self.turns]
+        return messages
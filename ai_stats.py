@@ -0,0 +1,69 @@
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+import math
+from histogram import DEFAULT_BUCKETS, bucket_percentile
+
+
+def bucket_key(bound):
+    # Field names can't contain dots
+    return str(bound).replace(".", "_")
+
+
+class AIStatsBuffer:
+    """
+    AI stats accumulated in-process since the last flush: plain counters and
+    latency histograms (count, sum, sum of squares, bucket counts). drain()
+    turns them into one $inc-only update, so workers flushing concurrently
+    add to the stats document instead of overwriting each other.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        self._inc = Counter()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._inc[name] += n
+
+    def observe(self, name, seconds):
+        i = bisect_left(self.buckets, seconds)
+        bucket = bucket_key(self.buckets[i]) if i < len(self.buckets) else "inf"
+        with self._lock:
+            self._inc[f"{name}.count"] += 1
+            self._inc[f"{name}.sum"] += seconds
+            self._inc[f"{name}.sum_squares"] += seconds * seconds
+            self._inc[f"{name}.buckets.{bucket}"] += 1
+
+    def drain(self):
+        with self._lock:
+            inc, self._inc = dict(self._inc), Counter()
+        return inc
+
+    def restore(self, inc):
+        # Put back an update that failed to flush so its samples aren't lost
+        with self._lock:
+            self._inc.update(inc)
+
+
+def latency_summary(section, buckets=DEFAULT_BUCKETS):
+    """
+    Average, standard deviation and p50/p95/p99 of a latency histogram as
+    stored by AIStatsBuffer.
+    """
+    count = section.get("count", 0)
+    if not count:
+        return {"count": 0, "average": 0.0, "stddev": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    mean = section.get("sum", 0.0) / count
+    variance = max(0.0, section.get("sum_squares", 0.0) / count - mean * mean)
+    stored = section.get("buckets", {})
+    counts = [stored.get(bucket_key(b), 0) for b in buckets] + [stored.get("inf", 0)]
+    return {
+        "count": count,
+        "average": mean,
+        "stddev": math.sqrt(variance),
+        "p50": bucket_percentile(buckets, counts, 0.5),
+        "p95": bucket_percentile(buckets, counts, 0.95),
+        "p99": bucket_percentile(buckets, counts, 0.99),
+    }
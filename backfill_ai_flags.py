@@ -0,0 +1,13 @@
+"""
+Set the is_ai flag on messages stored before it existed, so AI-room
+messages drop out of the admin message search.
+
+    python backfill_ai_flags.py
+
+Safe to re-run; only needed once per database.
+"""
+from mongo_test import Rooms
+
+if __name__ == "__main__":
+    Rooms.backfill_message_ai_flags()
+    print("Flagged AI-room messages.")
@@ -0,0 +1,16 @@
+"""
+Set message_count on rooms created before MAINTAIN_MESSAGE_COUNTS was
+turned on, so the admin room list stops counting their messages.
+
+    python backfill_message_counts.py
+
+Safe to re-run. A room whose counter moves while it is counted is counted
+again, but a message stored between its insert and its counter $inc can
+still be counted twice, so run it while message writes are stopped (or
+re-run it once they are) for exact counts.
+"""
+from mongo_test import Rooms
+
+if __name__ == "__main__":
+    updated = Rooms.backfill_message_counts()
+    print(f"Set message counts on {updated} rooms.")
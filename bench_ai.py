@@ -0,0 +1,46 @@
+"""
+Load test for the AI scheduler.
+
+    python bench_ai.py [users] [prompts_per_user] [llm_url]
+
+Every user sends its prompts back to back through an LLMScheduler sized like
+the server's and streams the replies from `llm_url`. The default is the
+in-process fake model; use openai+http://localhost:8001/v1#fake to go
+through fake_llm_server.py. Prints queue-wait and service-time percentiles
+and how many prompts were rejected or timed out.
+"""
+import asyncio
+import json
+import sys
+from llm import create_model
+from llm_scheduler import LLMScheduler, QueueFullError
+
+
+async def ask(scheduler, model, user, prompt):
+    try:
+        async with scheduler.slot(user):
+            async for _ in model.stream([{"role": "user", "content": prompt}], 1.0, 256):
+                pass
+    except (QueueFullError, asyncio.TimeoutError):
+        pass
+
+
+async def user_session(scheduler, model, user, prompts):
+    for i in range(prompts):
+        await ask(scheduler, model, user, f"question {i} from {user}")
+
+
+async def main(users: int, prompts: int, url: str):
+    model = create_model(url)
+    scheduler = LLMScheduler(max_concurrency=8, max_queue=100, max_per_user=2)
+    await asyncio.gather(*(user_session(scheduler, model, f"user{u}", prompts) for u in range(users)))
+    print(json.dumps(scheduler.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(
+        int(args[0]) if len(args) > 0 else 50,
+        int(args[1]) if len(args) > 1 else 5,
+        args[2] if len(args) > 2 else "fake://",
+    ))
@@ -0,0 +1,56 @@
+"""
+Cross-node broadcast latency over the loopback broker.
+
+    python bench_fanout.py [nodes] [messages]
+
+Starts `nodes` AsyncServer instances in one process, each with its own
+AsyncLoopbackManager, emits `messages` room broadcasts from node 0 and
+reports how long each took to reach every node's manager.
+"""
+import asyncio
+import statistics
+import sys
+import time
+import socketio
+from pubsub import AsyncLoopbackManager, LoopbackBroker
+
+
+class TimedManager(AsyncLoopbackManager):
+    def __init__(self, latencies, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = latencies
+
+    async def _handle_emit(self, message):
+        self.latencies.append(time.perf_counter() - message["data"]["sent_at"])
+        await super()._handle_emit(message)
+
+
+async def main(nodes: int, messages: int):
+    broker = LoopbackBroker()
+    latencies = []
+    servers = []
+    for _ in range(nodes):
+        server = socketio.AsyncServer(async_mode="asgi", client_manager=TimedManager(latencies, broker=broker))
+        server.manager.initialize()
+        servers.append(server)
+    await asyncio.sleep(0.1)
+
+    started = time.perf_counter()
+    for i in range(messages):
+        await servers[0].emit("message", {"seq": i, "sent_at": time.perf_counter()}, room="bench")
+    while len(latencies) < nodes * messages:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = [l * 1000 for l in latencies]
+    print(f"nodes={nodes} messages={messages} deliveries={len(ms)}")
+    print(f"throughput: {len(ms) / elapsed:.0f} deliveries/s")
+    print(f"latency ms: mean={statistics.mean(ms):.3f} p50={ms[len(ms) // 2]:.3f} "
+          f"p95={ms[int(len(ms) * 0.95)]:.3f} p99={ms[int(len(ms) * 0.99)]:.3f}")
+
+
+if __name__ == "__main__":
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    asyncio.run(main(nodes, messages))
@@ -0,0 +1,85 @@
+"""
+Admin message search latency against collection size.
+
+    MONGO_URI=mongodb://localhost:27017 python bench_search.py [size ...]
+
+Seeds a scratch database per size and times the previous $regex + $lookup
+pipeline against messages_search_pipeline (text index, is_ai flag, page-only
+lookup). Drops the scratch database afterwards.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+import pymongo
+from bson import ObjectId
+from mongo_test import messages_search_pipeline
+
+WORDS = "hello world chat room message python mongo index search latency token socket admin".split()
+QUERIES = ["hello", "latency", "socket admin", "zzz"]
+
+
+def regex_pipeline(search, skip, limit):
+    regex = {"$regex": search, "$options": "i"}
+    return [
+        {"$match": {"$or": [{"message": regex}, {"user": regex}]}},
+        {"$match": {"room_id": {"$type": "string", "$regex": "^[a-fA-F0-9]{24}$"}}},
+        {"$addFields": {"room_id_obj": {"$toObjectId": "$room_id"}}},
+        {"$lookup": {"from": "rooms", "localField": "room_id_obj", "foreignField": "_id", "as": "room_docs"}},
+        {"$unwind": "$room_docs"},
+        {"$match": {"room_docs.room_name": {"$ne": "AI Room"}}},
+        {"$sort": {"timestamp": -1}},
+        {"$facet": {"data": [{"$skip": skip}, {"$limit": limit}], "total": [{"$count": "count"}]}},
+    ]
+
+
+def seed(db, size):
+    rooms = [{"_id": ObjectId(), "room_name": f"room{i}", "is_ai": i % 10 == 0} for i in range(100)]
+    db.rooms.insert_many(rooms)
+    start = datetime.now() - timedelta(days=30)
+    batch = []
+    for i in range(size):
+        room = random.choice(rooms)
+        batch.append({
+            "room_id": str(room["_id"]),
+            "user": f"user{random.randrange(1000)}",
+            "message": " ".join(random.choices(WORDS, k=8)),
+            "timestamp": start + timedelta(seconds=i),
+            "is_ai": room["is_ai"],
+        })
+        if len(batch) == 10000:
+            db.messages.insert_many(batch)
+            batch = []
+    if batch:
+        db.messages.insert_many(batch)
+    db.messages.create_index([("message", pymongo.TEXT), ("user", pymongo.TEXT)])
+    db.messages.create_index([("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+
+
+def timed(collection, pipeline, runs=5):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        list(collection.aggregate(pipeline))
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main(sizes):
+    client = pymongo.MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017"))
+    print(f"{'size':>10} {'query':>14} {'regex ms':>10} {'text ms':>10}")
+    for size in sizes:
+        db = client[f"bench_search_{size}"]
+        client.drop_database(db.name)
+        seed(db, size)
+        for query in QUERIES:
+            old = timed(db.messages, regex_pipeline(query, 0, 5))
+            new = timed(db.messages, messages_search_pipeline(query, "timestamp", pymongo.DESCENDING, 0, 5))
+            print(f"{size:>10} {query:>14} {old:>10.1f} {new:>10.1f}")
+        client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    It holds at most `maxsize` entries and, when `weigh` is given, at most
+    `maxweight` in total of weigh(value) over its entries. Either bound may
+    be None.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60, maxweight: int = None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at, _ = item
+            if expires_at < time.monotonic():
+                self._pop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        weight = self.weigh(value) if self.weigh else 0
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (value, time.monotonic() + self.ttl, weight)
+            self.weight += weight
+            while self._data and self._over():
+                self._pop(next(iter(self._data)))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def _over(self):
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            return True
+        return self.maxweight is not None and self.weight > self.maxweight
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.weight -= item[2]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "weight": self.weight,
+                "maxweight": self.maxweight,
+                "ttl": self.ttl,
+            }
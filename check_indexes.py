@@ -0,0 +1,20 @@
+"""
+Create the indexes core.py relies on, then explain every query shape it
+runs and fail if any of them would scan a whole collection.
+
+    python check_indexes.py
+
+Exits non-zero on a collection scan, so it can run against a local mongod
+in CI.
+"""
+import sys
+from mongo_test import ensure_indexes, verify_query_plans
+
+if __name__ == "__main__":
+    ensure_indexes()
+    failures = verify_query_plans()
+    for label in failures:
+        print(f"COLLSCAN: {label}")
+    if failures:
+        sys.exit(1)
+    print("Every query shape uses an index.")
@@ -1,4 +1,4 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
 import pymongo
 from pymongo import ReturnDocument
 from datetime import datetime, timedelta, timezone
@@ -13,8 +13,31 @@ import string, random
 import validators
 import re
 import time
+import threading
+import base64
+import bson
+from cache import TTLCache
+from hashing import HashPool, ServiceBusyError
+import identity_cache
+import indexes
+from write_behind import BatchWriter
+from llm import create_model
+from ai_context import ConversationWindow
+from response_cache import ResponseCache
+from ai_stats import AIStatsBuffer, latency_summary
+from metrics import registry, instrument, MongoCommandMetrics, FAST_BUCKETS
+from llm_scheduler import LLMScheduler, QueueFullError
+from collections import Counter
+import logging
+
+log = logging.getLogger(__name__)
 
 # CONFIGURATION
+# MongoDB command timings for /admin/metrics; the listener has to be
+# registered before any client is created.
+MONGO_COMMAND_SECONDS = registry.histogram("mongodb_command_seconds", "MongoDB command duration.", ["command", "outcome"], FAST_BUCKETS)
+pymongo.monitoring.register(MongoCommandMetrics(MONGO_COMMAND_SECONDS))
+
 ph = PasswordHasher(
     time_cost=3,
     memory_cost=65536,
@@ -28,6 +51,144 @@ policy = PasswordPolicy.from_names(
     special=1,
 )
 
+# Settings are re-read at most every CONFIG_CACHE_TTL seconds per worker;
+# the refresher keeps workers converged when another worker updates them.
+CONFIG_CACHE_TTL = 30
+CONFIG_REFRESH_INTERVAL = 10
+config_cache = TTLCache(maxsize=1, ttl=CONFIG_CACHE_TTL)
+
+# argon2 runs on a bounded pool: at most HASH_POOL_WORKERS hashes in flight
+# and HASH_POOL_MAX_QUEUE waiting before requests are shed with a 503.
+HASH_POOL_WORKERS = 4
+HASH_POOL_MAX_QUEUE = 32
+hash_pool = HashPool(max_workers=HASH_POOL_WORKERS, max_queue=HASH_POOL_MAX_QUEUE)
+
+# Message history pages are keyset-paginated on (timestamp, _id).
+MESSAGES_PAGE_SIZE = 15
+MESSAGES_PAGE_MAX = 100
+MESSAGES_PAGE_SORT = [("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+MESSAGES_PAGE_SORT_INDEX = [("room_id", pymongo.ASCENDING)] + MESSAGES_PAGE_SORT
+
+# Admin lists page with keyset cursors on (sort field, _id); their totals
+# are counted at most once per ADMIN_TOTAL_TTL seconds for each filter.
+# Unsearched totals come from the collection's document count minus an
+# indexed count of the documents the list leaves out, never from a scan.
+ADMIN_TOTAL_TTL = 60
+admin_total_cache = TTLCache(maxsize=256, ttl=ADMIN_TOTAL_TTL)
+
+# Keep a message_count counter on each room document so the admin room list
+# doesn't have to count messages. Counters are only incremented on rooms that
+# already have one (new rooms start at 0), so rooms created before it was
+# turned on are still counted on the fly until backfill_message_counts.py
+# has run.
+MAINTAIN_MESSAGE_COUNTS = True
+
+# Shared user/room document caches (see identity_cache.py), bounded by the
+# approximate size of the documents they hold since rooms carry their
+# members arrays
+USER_CACHE_BYTES = 16 * 1024 * 1024
+USER_CACHE_TTL = 30
+ROOM_CACHE_BYTES = 64 * 1024 * 1024
+ROOM_CACHE_TTL = 30
+identity_cache.configure("user", max_bytes=USER_CACHE_BYTES, ttl=USER_CACHE_TTL)
+identity_cache.configure("room", max_bytes=ROOM_CACHE_BYTES, ttl=ROOM_CACHE_TTL)
+
+# Store room membership in its own collection instead of the embedded
+# members/banned arrays, with a members_count counter on the room. Run
+# migrate_memberships.py before turning it on for an existing database.
+MEMBERSHIP_COLLECTION = False
+MEMBERSHIP_COLLECTION_NAME = "room_members"
+
+# Chat messages from the async layer are buffered and written with
+# insert_many. MESSAGE_DURABILITY is "ack" to wait for the write before
+# add_message returns (and the message is broadcast), or "broadcast" to
+# return as soon as the message is queued.
+MESSAGE_BATCH_SIZE = 500
+MESSAGE_FLUSH_INTERVAL = 0.05
+MESSAGE_QUEUE_SIZE = 10000
+MESSAGE_DURABILITY = "ack"
+# A failed batch write is retried MESSAGE_FLUSH_RETRIES times with
+# exponential backoff from MESSAGE_RETRY_DELAY seconds before it is dropped
+# (and counted in the writer stats).
+MESSAGE_FLUSH_RETRIES = 3
+MESSAGE_RETRY_DELAY = 0.5
+
+# Deleting a user or room only tombstones it (deleted_at) and queues a job;
+# the deletion worker then removes the dependent documents
+# DELETION_BATCH_SIZE at a time, sleeping DELETION_THROTTLE seconds between
+# batches. Jobs hold a DELETION_LEASE second lease renewed every batch, so a
+# job whose worker died is picked up again and carries on where it stopped.
+# A job that fails is retried after DELETION_RETRY_DELAY seconds, doubling
+# with every attempt, and marked failed after DELETION_MAX_ATTEMPTS; failed
+# jobs are requeued from the admin API.
+DELETION_JOB_COLLECTION_NAME = "deletion_jobs"
+DELETION_BATCH_SIZE = 1000
+DELETION_THROTTLE = 0.1
+DELETION_LEASE = 60
+DELETION_POLL_INTERVAL = 5
+DELETION_MAX_ATTEMPTS = 5
+DELETION_RETRY_DELAY = 30
+
+# AI replies are admitted by ai_scheduler: AI_MAX_CONCURRENCY upstream calls
+# at a time per worker, fair per-user queues of at most AI_MAX_QUEUE_PER_USER,
+# and prompts rejected once AI_MAX_QUEUE are waiting.
+AI_MAX_CONCURRENCY = 8
+AI_MAX_QUEUE = 100
+AI_MAX_QUEUE_PER_USER = 2
+AI_QUEUE_TIMEOUT = 30
+AI_TIMEOUT = 120
+ai_scheduler = LLMScheduler(
+    max_concurrency=AI_MAX_CONCURRENCY,
+    max_queue=AI_MAX_QUEUE,
+    max_per_user=AI_MAX_QUEUE_PER_USER,
+    queue_timeout=AI_QUEUE_TIMEOUT,
+    timeout=AI_TIMEOUT,
+)
+
+# Each AI room keeps a ConversationWindow (ai_context.py) of its recent turns
+# per worker, under the max_tokens AI setting. When it overflows, the oldest
+# turns are summarized until AI_CONTEXT_TARGET of the budget is left, and the
+# summary is stored so a fresh worker starts from it plus at most
+# AI_CONTEXT_LOAD_LIMIT newer messages.
+AI_CONTEXT_COLLECTION_NAME = "ai_contexts"
+AI_CONTEXT_CACHE_SIZE = 1000
+AI_CONTEXT_CACHE_TTL = 3600
+AI_CONTEXT_TARGET = 0.75
+AI_CONTEXT_LOAD_LIMIT = 50
+ai_contexts = TTLCache(maxsize=AI_CONTEXT_CACHE_SIZE, ttl=AI_CONTEXT_CACHE_TTL)
+
+# Optional cache of AI replies for repeated prompts (greetings, FAQ), keyed
+# on the normalized prompt, the system message, temperature and max_tokens.
+# Near-identical prompts match by trigram similarity of at least
+# AI_RESPONSE_CACHE_SIMILARITY, and only when their numbers and content
+# words are the same. Only prompts up to AI_RESPONSE_CACHE_MAX_PROMPT
+# characters are cached. Replies are shared by every user, so they are
+# only stored and served in rooms without earlier conversation.
+AI_RESPONSE_CACHE = False
+AI_RESPONSE_CACHE_SIZE = 1000
+AI_RESPONSE_CACHE_TTL = 3600
+AI_RESPONSE_CACHE_SIMILARITY = 0.8
+AI_RESPONSE_CACHE_MAX_PROMPT = 100
+ai_response_cache = ResponseCache(
+    maxsize=AI_RESPONSE_CACHE_SIZE,
+    ttl=AI_RESPONSE_CACHE_TTL,
+    threshold=AI_RESPONSE_CACHE_SIMILARITY,
+)
+
+# AI stats are counted in-process and added to the stats document with one
+# $inc every AI_STATS_FLUSH_INTERVAL seconds; averages, rates and
+# percentiles are worked out when the stats are read.
+AI_STATS_FLUSH_INTERVAL = 5
+ai_stats = AIStatsBuffer()
+
+# temperature and max_tokens for replies are re-read at most every
+# AI_SETTINGS_CACHE_TTL seconds per worker.
+AI_SETTINGS_CACHE_TTL = 30
+ai_settings_cache = TTLCache(maxsize=1, ttl=AI_SETTINGS_CACHE_TTL)
+
+# Connection pool size of the async client used by the Async* classes.
+MONGO_POOL_SIZE = 100
+
 def get_system_message():
     config = Admin.get_config()
     return config.get("system_message")
@@ -48,10 +209,476 @@ def get_ai_status():
     config = Admin.get_config()
     return config.get("ai_feature", True)
 
-def hash_password(p): return ph.hash(p)
-def check_password(p1, p2): return ph.verify(p1, p2)
+def get_socketio_manager_url():
+    config = Admin.get_config()
+    return config.get("socketio_manager_url")
+
+def get_rate_limit_url():
+    config = Admin.get_config()
+    return config.get("rate_limit_url")
+
+def get_trusted_proxies():
+    config = Admin.get_config()
+    return config.get("trusted_proxies", [])
+
+def get_llm_url():
+    config = Admin.get_config()
+    return config.get("llm_url")
+
+def get_llm_api_key():
+    config = Admin.get_config()
+    return config.get("llm_api_key")
+
+# Variants for the event loop, reading the config through the async client
+async def get_register_status_async():
+    config = await AsyncAdmin.get_config()
+    return config.get("register_feature", True)
+
+async def get_ai_status_async():
+    config = await AsyncAdmin.get_config()
+    return config.get("ai_feature", True)
+
+async def get_secret_key_async():
+    config = await AsyncAdmin.get_config()
+    return config.get("secret_key")
+
+def hash_password(p): return hash_pool.run(ph.hash, p)
+def check_password(p1, p2): return hash_pool.run(ph.verify, p1, p2)
+async def hash_password_async(p): return await hash_pool.run_async(ph.hash, p)
+async def check_password_async(p1, p2): return await hash_pool.run_async(ph.verify, p1, p2)
+def password_needs_rehash(h): return ph.check_needs_rehash(h)
 def validate_password(p): return not policy.test(p) 
 
+def normalize_email(email):
+    try:
+        result = validate_email(email, check_deliverability=False)
+        return result.normalized
+    except EmailNotValidError as e:
+        raise ValueError(f"Invalid email!")
+
+def validate_registration(username, password):
+    if not validate_password(password):
+        raise ValueError("Weak password!")
+    if not re.fullmatch(r'^[a-z0-9_]+$', username):
+        raise ValueError("Username must contain only lowercase letters, numbers, and underscores.")
+    if username.lower() == 'ai' or len(username) < 3 or len(username) > 16:
+        raise ValueError("Invalid username!")
+
+def new_user_document(username, email, hashed_password):
+    return {
+        "username": username,
+        "email": email,
+        "password": hashed_password,
+        "profile_picture": "".join(random.choices(string.ascii_letters + string.digits, k=16)),
+        "status": "active",
+        "created_at": datetime.now(),
+        "last_login": datetime.now(),
+        "role": "user",
+        "is_admin": False
+    }
+
+def new_room_document(room_name, room_picture, owner, join_code=None, is_ai=False, is_system=False):
+    if not is_system:
+        if not room_name or len(room_name) < 4 or len(room_name) > 16: 
+            raise ValueError("Room name must be at least 4 characters long and not exceed 16 characters!")
+        if room_name == 'AI' or room_name == 'AI Room':
+            raise ValueError("Invalid name!")
+    if not is_ai:
+        if not room_picture:
+            room_picture = f'https://api.dicebear.com/7.x/avataaars/svg?seed={"".join(random.choices(string.ascii_letters + string.digits, k=16))}'
+        if not validators.url(room_picture):
+            raise ValueError("Invalid room picture URL!")
+    return {
+        "room_name": room_name,
+        "room_picture": room_picture,
+        "room_join_code": join_code if not is_ai and join_code else "".join(random.choices(string.ascii_letters + string.digits, k=8)),
+        "created_at": datetime.now(),
+        "modified_at": datetime.now(),
+        "owner": owner,
+        "members": [] if MEMBERSHIP_COLLECTION else [owner],
+        "banned": [],
+        "is_ai": is_ai,
+        "message_count": 0,
+        **({"members_count": 1} if MEMBERSHIP_COLLECTION else {})
+    }
+
+def members_count(room):
+    if MEMBERSHIP_COLLECTION:
+        return room.get("members_count", 0)
+    return len(room.get("members", []))
+
+def serialize_user(user):
+    user = dict(user)
+    user["_id"] = str(user["_id"])
+    user["created_at"] = user["created_at"].isoformat()
+    user["last_login"] = user["last_login"].isoformat()
+    user.pop("password", None)
+    return user
+
+def serialize_room(room):
+    room = dict(room)
+    room.pop("banned", None)
+    room["_id"] = str(room["_id"])
+    room["created_at"] = room["created_at"].isoformat()
+    room["modified_at"] = room["modified_at"].isoformat()
+    room["members"] = members_count(room)
+    room.pop("members_count", None)
+    return room
+
+def serialize_message(m):
+    m = dict(m)
+    m['_id'] = str(m['_id'])
+    m['timestamp'] = m['timestamp'].isoformat() if isinstance(m['timestamp'], datetime) else m['timestamp']
+    return m
+
+def encode_message_cursor(m):
+    raw = f"{m['timestamp'].isoformat()}|{m['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_message_cursor(cursor):
+    try:
+        timestamp, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), ObjectId(id)
+    except Exception:
+        raise ValueError("Invalid cursor!")
+
+def messages_page_query(room_id, before, limit):
+    if limit < 1 or limit > MESSAGES_PAGE_MAX:
+        raise ValueError(f"Limit must be between 1 and {MESSAGES_PAGE_MAX}!")
+    query = {"room_id": room_id}
+    if before:
+        timestamp, id = decode_message_cursor(before)
+        query["timestamp"] = {"$lte": timestamp}
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"_id": {"$lt": id}}
+        ]
+    return query
+
+def membership_collection():
+    return room_collection.database[MEMBERSHIP_COLLECTION_NAME]
+
+def membership_lookup_stage():
+    # Rooms a user belongs to, reduced to room_name and owner
+    project = {"$project": {"_id": 0, "room_name": 1, "owner": 1}}
+    if not MEMBERSHIP_COLLECTION:
+        return {"$lookup": {
+            "from": room_collection.name,
+            "localField": "username",
+            "foreignField": "members",
+            "pipeline": [project],
+            "as": "joined_rooms"
+        }}
+    return {"$lookup": {
+        "from": MEMBERSHIP_COLLECTION_NAME,
+        "localField": "username",
+        "foreignField": "username",
+        "pipeline": [
+            {"$match": {"status": "member"}},
+            {"$lookup": {
+                "from": room_collection.name,
+                "let": {"room_id": {"$toObjectId": "$room_id"}},
+                "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$room_id"]}}}, project],
+                "as": "room"
+            }},
+            {"$unwind": "$room"},
+            {"$replaceRoot": {"newRoot": "$room"}}
+        ],
+        "as": "joined_rooms"
+    }}
+
+def members_count_decrements(room_ids):
+    return [pymongo.UpdateOne({"_id": ObjectId(r)}, {"$inc": {"members_count": -1}}) for r in room_ids]
+
+# Matches documents that haven't been tombstoned for deletion, and the others
+NOT_DELETED = {"deleted_at": None}
+DELETED = {"deleted_at": {"$exists": True}}
+
+# What the unsearched admin lists leave out, for cached_total
+ADMIN_ROOMS_EXCLUDED = {"$or": [{"is_ai": True}, {"_id": ObjectId("685a64dcd94f6bbc0088f911")}, DELETED]}
+ADMIN_MESSAGES_EXCLUDED = {"is_ai": True}
+
+def claimable_deletion_jobs(now):
+    # Pending jobs past their retry backoff and running jobs whose lease expired
+    return {"state": {"$in": ["pending", "running"]}, "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]}
+
+def deletion_job_collection():
+    return room_collection.database[DELETION_JOB_COLLECTION_NAME]
+
+def new_deletion_job(kind, target_id, **fields):
+    now = datetime.now()
+    return {
+        "kind": kind,
+        "target_id": target_id,
+        "state": "pending",
+        "step": None,
+        "progress": {},
+        "attempts": 0,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "lease_until": None,
+        **fields
+    }
+
+def serialize_deletion_job(job):
+    job = dict(job)
+    job["_id"] = str(job["_id"])
+    for field in ("created_at", "updated_at", "lease_until", "finished_at"):
+        if isinstance(job.get(field), datetime):
+            job[field] = job[field].isoformat()
+    return job
+
+def ai_context_collection():
+    return room_collection.database[AI_CONTEXT_COLLECTION_NAME]
+
+def messages_after_query(room_id, cursor):
+    query = {"room_id": room_id}
+    if cursor:
+        timestamp, id = cursor
+        query["$or"] = [
+            {"timestamp": {"$gt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$gt": id}}
+        ]
+    return query
+
+def message_turn(m):
+    return ("assistant" if m["user"] == "AI" else "user", m["message"], (m["timestamp"], m["_id"]))
+
+def derive_ai_stats(stats):
+    response_time = latency_summary(stats.get("response_time", {}))
+    first_token_time = latency_summary(stats.get("first_token_time", {}))
+    if response_time["count"]:
+        stats["average_response_time"] = response_time["average"]
+    if first_token_time["count"]:
+        stats["average_first_token_time"] = first_token_time["average"]
+    if stats.get("total_requests"):
+        stats["ai_response_rate"] = stats.get("total_ai_responses", 0) / stats["total_requests"] * 100
+    stats["response_time"] = response_time
+    stats["first_token_time"] = first_token_time
+    return stats
+
+def ai_response_cacheable(prompt):
+    return AI_RESPONSE_CACHE and len(prompt) <= AI_RESPONSE_CACHE_MAX_PROMPT
+
+def message_count_pipeline(match):
+    return [
+        {"$match": match},
+        {"$group": {"_id": "$room_id", "count": {"$sum": 1}}}
+    ]
+
+def counted_room(room_id):
+    # Rooms without a message_count are left for the backfill, since a first
+    # $inc would create a counter that misses the older messages
+    return {"_id": ObjectId(room_id), "message_count": {"$exists": True}}
+
+def message_count_decrements(counts):
+    return [
+        pymongo.UpdateOne(counted_room(c["_id"]), {"$inc": {"message_count": -c["count"]}})
+        for c in counts if ObjectId.is_valid(c["_id"])
+    ]
+
+def encode_keyset_cursor(value, id):
+    return base64.urlsafe_b64encode(bson.encode({"v": value, "id": id})).decode()
+
+def decode_keyset_cursor(cursor):
+    try:
+        doc = bson.decode(base64.urlsafe_b64decode(cursor.encode()))
+        return doc["v"], doc["id"]
+    except Exception:
+        raise ValueError("Invalid cursor!")
+
+def keyset_query(query, sort_field, direction, cursor):
+    """
+    Narrow `query` to the rows after `cursor` in (sort_field, _id) order.
+    """
+    if not cursor:
+        return query
+    value, id = decode_keyset_cursor(cursor)
+    op = "$gt" if direction == pymongo.ASCENDING else "$lt"
+    after = {"$or": [
+        {sort_field: {op: value}},
+        {sort_field: value, "_id": {op: id}}
+    ]}
+    return {"$and": [query, after]} if query else after
+
+def keyset_page(docs, limit, sort_field):
+    # Pages are fetched with limit + 1 rows to know whether another follows
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_keyset_cursor(docs[-1].get(sort_field), docs[-1]["_id"]) if has_more else None
+    return docs, next_cursor
+
+def cached_total(collection, query, excluded=None):
+    """
+    Number of documents matching `query`. `excluded`, when given, must match
+    exactly the documents `query` leaves out, using indexes.
+    """
+    key = (collection.name, repr(query))
+    total = admin_total_cache.get(key)
+    if total is None:
+        if excluded is not None:
+            total = collection.estimated_document_count() - collection.count_documents(excluded)
+        elif query:
+            total = collection.count_documents(query)
+        else:
+            total = collection.estimated_document_count()
+        admin_total_cache.set(key, total)
+    return total
+
+def messages_search_match(search):
+    match = {"is_ai": {"$ne": True}}
+    if search:
+        match["$text"] = {"$search": search}
+    return match
+
+def messages_search_pipeline(search, sort_field, direction, skip, limit, cursor=None):
+    """
+    Admin message listing. Searching uses the text index on message/user,
+    AI-room messages are dropped by their denormalized is_ai flag, and the
+    room lookup only runs for the rows on the page. cursor_value/cursor_id
+    carry the raw sort key for the next keyset cursor.
+    """
+    match = keyset_query(messages_search_match(search), sort_field, direction, cursor)
+    return [
+        {"$match": match},
+        {"$sort": {sort_field: direction, "_id": direction}},
+        {"$skip": skip},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": room_collection.name,
+            "let": {"room_id": {"$convert": {"input": "$room_id", "to": "objectId", "onError": None, "onNull": None}}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$room_id"]}}},
+                {"$project": {"_id": 0, "room_name": 1}}
+            ],
+            "as": "room_docs"
+        }},
+        {"$unwind": {"path": "$room_docs", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "_id": {"$toString": "$_id"},
+            "cursor_value": f"${sort_field}",
+            "cursor_id": "$_id",
+            "user": 1,
+            "message": 1,
+            "timestamp": {"$dateToString": {"format": "%Y-%m-%dT%H:%M:%S.%LZ", "date": "$timestamp"}},
+            "room_id": 1,
+            "room_name": "$room_docs.room_name"
+        }}
+    ]
+
+ASC, DESC = pymongo.ASCENDING, pymongo.DESCENDING
+
+MEMBERSHIP_INDEXES = [
+    ([("room_id", ASC), ("username", ASC), ("status", ASC)], {"unique": True}),
+    ([("username", ASC), ("room_id", ASC)], {}),
+]
+
+def required_indexes():
+    """
+    (collection, specs) for every index the queries in this module rely on;
+    specs are (keys, options) pairs as taken by indexes.ensure().
+    """
+    required = [
+        (user_collection, [
+            ([("username", ASC)], {"unique": True}),
+            ([("email", ASC)], {"unique": True}),
+            ([("created_at", ASC), ("_id", ASC)], {}),
+            ([("deleted_at", ASC)], {"sparse": True}),
+        ]),
+        (room_collection, [
+            ([("room_join_code", ASC)], {}),
+            ([("members", ASC)], {}),
+            ([("owner", ASC)], {}),
+            ([("created_at", ASC), ("_id", ASC)], {}),
+            ([("deleted_at", ASC)], {"sparse": True}),
+            ([("is_ai", ASC)], {"partialFilterExpression": {"is_ai": True}}),
+        ]),
+        (messages_collection, [
+            (MESSAGES_PAGE_SORT_INDEX, {}),
+            ([("message", pymongo.TEXT), ("user", pymongo.TEXT)], {}),
+            ([("timestamp", DESC), ("_id", DESC)], {}),
+            ([("user", ASC), ("_id", ASC)], {}),
+            ([("is_ai", ASC)], {"partialFilterExpression": {"is_ai": True}}),
+        ]),
+    ]
+    if MEMBERSHIP_COLLECTION:
+        required.append((membership_collection(), MEMBERSHIP_INDEXES))
+    required.append((deletion_job_collection(), [([("state", ASC), ("created_at", ASC)], {})]))
+    return required
+
+def ensure_indexes():
+    for collection, specs in required_indexes():
+        indexes.ensure(collection, specs)
+
+def query_shapes():
+    """
+    (label, collection, command) for the queries this module runs on request
+    paths, in the form taken by indexes.explain(). One-off maintenance
+    queries (backfills, migrations) and the regex searches of the admin
+    lists are left out. Counts are explained as finds with their filter.
+    """
+    probe = "probe"
+    page = {"limit": 6}
+    shapes = [
+        ("user by email", user_collection, {"find": {"email": probe, **NOT_DELETED}}),
+        ("admin user list", user_collection, {
+            "find": {"deleted_at": None},
+            "sort": {"created_at": DESC, "_id": DESC}, **page
+        }),
+        ("admin user total", user_collection, {"find": DELETED}),
+        ("room by join code", room_collection, {"find": {"room_join_code": probe, **NOT_DELETED}}),
+        ("rooms of member", room_collection, {"find": {"members": probe, **NOT_DELETED}}),
+        ("rooms of owner", room_collection, {"find": {"owner": probe, **NOT_DELETED}}),
+        ("admin room list", room_collection, {
+            "find": {"is_ai": {"$ne": True}, "_id": {"$ne": ObjectId("685a64dcd94f6bbc0088f911")}, "deleted_at": None},
+            "sort": {"created_at": DESC, "_id": DESC}, **page
+        }),
+        ("admin room total", room_collection, {"find": ADMIN_ROOMS_EXCLUDED}),
+        ("room messages", messages_collection, {"find": {"room_id": probe}, "sort": {"timestamp": ASC}, "limit": 15}),
+        ("room messages before", messages_collection, {
+            "find": {"room_id": probe, "timestamp": {"$lt": datetime.now()}},
+            "sort": {"timestamp": DESC}, "limit": 15
+        }),
+        ("room message page", messages_collection, {
+            "find": messages_page_query(probe, encode_message_cursor({"timestamp": datetime.now(), "_id": ObjectId()}), 15),
+            "sort": dict(MESSAGES_PAGE_SORT), "limit": 16
+        }),
+        ("messages of user", messages_collection, {"find": {"user": probe}}),
+        ("AI context catch-up", messages_collection, {
+            "find": messages_after_query(probe, (datetime.now(), ObjectId())),
+            "sort": {"timestamp": ASC, "_id": ASC}
+        }),
+        ("room message counts", messages_collection, {"aggregate": message_count_pipeline({"room_id": {"$in": [probe]}})}),
+        ("admin message list", messages_collection, {"aggregate": messages_search_pipeline("", "timestamp", DESC, 0, 6)}),
+        ("admin message list by sender", messages_collection, {"aggregate": messages_search_pipeline("", "user", ASC, 0, 6)}),
+        ("admin message search", messages_collection, {"aggregate": messages_search_pipeline(probe, "timestamp", DESC, 0, 6)}),
+        ("admin message total", messages_collection, {"find": ADMIN_MESSAGES_EXCLUDED}),
+        ("admin message search total", messages_collection, {"find": messages_search_match(probe)}),
+    ]
+    shapes.append(("pending deletion jobs", deletion_job_collection(), {
+        "find": claimable_deletion_jobs(datetime.now()),
+        "sort": {"created_at": ASC}, "limit": 1
+    }))
+    if MEMBERSHIP_COLLECTION:
+        shapes += [
+            ("membership status", membership_collection(), {"find": {"room_id": probe, "username": probe, "status": "member"}}),
+            ("memberships of user", membership_collection(), {"find": {"username": probe, "status": "member"}}),
+            ("members of room", membership_collection(), {"find": {"room_id": probe, "status": "member"}}),
+        ]
+    return shapes
+
+def verify_query_plans():
+    """Labels of the query shapes that would scan a whole collection."""
+    return indexes.verify(query_shapes())
+
+def messages_page(docs, limit):
+    # docs are newest first and hold one extra row to detect the next page
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_message_cursor(docs[-1]) if has_more else None
+    return [serialize_message(m) for m in reversed(docs)], next_cursor
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     raise NotImplementedError("Access token function logic has been removed from the public version.")
 
@@ -65,12 +692,8 @@ class Authentication:
 
     @staticmethod
     def login(email: str, password: str):
-        try:
-            result = validate_email(email, check_deliverability=False)
-            normalized_email = result.normalized
-        except EmailNotValidError as e:
-            raise ValueError(f"Invalid email!")
-        user = user_collection.find_one({"email": normalized_email})
+        normalized_email = normalize_email(email)
+        user = user_collection.find_one({"email": normalized_email, **NOT_DELETED})
         if not user:
             raise ValueError("Invalid email or password!")
         try:
@@ -80,7 +703,11 @@ class Authentication:
         if user["status"] == "locked":
             raise ValueError("Your account is locked!")
         user["last_login"] = datetime.now()
-        user_collection.update_one({"_id": user["_id"]}, {"$set": {"last_login": user["last_login"]}})
+        updates = {"last_login": user["last_login"]}
+        if password_needs_rehash(user["password"]):
+            updates["password"] = hash_password(password)
+        user_collection.update_one({"_id": user["_id"]}, {"$set": updates})
+        identity_cache.invalidate("user", user["_id"])
         return create_access_token(data={"sub": str(user["_id"])})
 
 
@@ -88,28 +715,9 @@ class Authentication:
     def register(email: str, username: str, password: str):
         if not get_register_status():
             raise ValueError("This feature is currently disabled by an admin!")
-        try:
-            result = validate_email(email, check_deliverability=False)
-            normalized_email = result.normalized
-        except EmailNotValidError as e:
-            raise ValueError(f"Invalid email!")
-        if not validate_password(password):
-            raise ValueError("Weak password!")
-        if not re.fullmatch(r'^[a-z0-9_]+$', username):
-            raise ValueError("Username must contain only lowercase letters, numbers, and underscores.")
-        if username.lower() == 'ai' or len(username) < 3 or len(username) > 16:
-            raise ValueError("Invalid username!")
-        new_user = {
-            "username": username,
-            "email": normalized_email,
-            "password": hash_password(password),
-            "profile_picture": "".join(random.choices(string.ascii_letters + string.digits, k=16)),
-            "status": "active",
-            "created_at": datetime.now(),
-            "last_login": datetime.now(),
-            "role": "user",
-            "is_admin": False
-        }
+        normalized_email = normalize_email(email)
+        validate_registration(username, password)
+        new_user = new_user_document(username, normalized_email, hash_password(password))
         try:
             result = user_collection.insert_one(new_user)
             Rooms.create_room("AI Room", None, str(result.inserted_id), None, True, is_system=True)
@@ -123,26 +731,22 @@ class Users:
 
     @staticmethod
     def get_user(id: str):
-        user = user_collection.find_one({"_id": ObjectId(id)})
+        return identity_cache.load("user", id, lambda: Users.load_user(id))
+
+    @staticmethod
+    def load_user(id: str):
+        user = user_collection.find_one({"_id": ObjectId(id), **NOT_DELETED})
         if not user:
             raise ValueError("User not found!")
-        user = dict(user)
-        user["_id"] = str(user["_id"])
-        user["created_at"] = user["created_at"].isoformat()
-        user["last_login"] = user["last_login"].isoformat()
-        user.pop("password", None)
-        return user
+        return serialize_user(user)
     
     @staticmethod
     def change_user_email(id: str, new_email: str):
-        try:
-            result = validate_email(new_email, check_deliverability=False)
-            normalized_email = result.normalized
-        except EmailNotValidError as e:
-            raise ValueError(f"Invalid email!")
+        normalized_email = normalize_email(new_email)
         if user_collection.find_one({"email": normalized_email}):
             raise ValueError("Email already in use!")
         user_collection.update_one({"_id": ObjectId(id)}, {"$set": {"email": normalized_email}})
+        identity_cache.invalidate("user", id)
 
     @staticmethod
     def change_user_password(id: str, old_password: str, new_password: str):
@@ -156,10 +760,12 @@ class Users:
         if not validate_password(new_password):
             raise ValueError("Weak password!")
         user_collection.update_one({"_id": ObjectId(id)}, {"$set": {"password": hash_password(new_password)}})
+        identity_cache.invalidate("user", id)
 
     @staticmethod
     def change_user_pfp(id: str, new_pfp: str):
         user_collection.update_one({"_id": ObjectId(id)}, {"$set": {"profile_picture": new_pfp}})
+        identity_cache.invalidate("user", id)
 
     @staticmethod
     def update_user(id: str, email, old_p, new_p, pfp):
@@ -178,6 +784,8 @@ class Users:
         user = Users.get_user(id)
         if user["is_admin"]:
             return True
+        if MEMBERSHIP_COLLECTION:
+            return Memberships.status(room_id, user["username"], "member")
         return user["username"] in room["members"]
 
     @staticmethod
@@ -194,6 +802,8 @@ class Users:
         user = Users.get_user(id)
         if user["is_admin"]:
             return False
+        if MEMBERSHIP_COLLECTION:
+            return Memberships.status(room_id, user["username"], "banned")
         return user["username"] in room.get("banned", [])
 
     @staticmethod
@@ -212,29 +822,11 @@ class Rooms:
 
     @staticmethod
     def create_room(room_name: str, room_picture: str, id: str, join_code: str = None, is_ai: bool = False, is_system: bool = False):
-        if not is_system:
-            if not room_name or len(room_name) < 4 or len(room_name) > 16: 
-                raise ValueError("Room name must be at least 4 characters long and not exceed 16 characters!")
-            if room_name == 'AI' or room_name == 'AI Room':
-                raise ValueError("Invalid name!")
-        if not is_ai:
-            if not room_picture:
-                room_picture = f'https://api.dicebear.com/7.x/avataaars/svg?seed={"".join(random.choices(string.ascii_letters + string.digits, k=16))}'
-            if not validators.url(room_picture):
-                raise ValueError("Invalid room picture URL!")
         user = Users.get_user(id)
-        new_room = {
-            "room_name": room_name,
-            "room_picture": room_picture,
-            "room_join_code": join_code if not is_ai and join_code else "".join(random.choices(string.ascii_letters + string.digits, k=8)),
-            "created_at": datetime.now(),
-            "modified_at": datetime.now(),
-            "owner": user["username"],
-            "members": [user["username"]],
-            "banned": [],
-            "is_ai": is_ai
-        }
+        new_room = new_room_document(room_name, room_picture, user["username"], join_code, is_ai, is_system)
         result = room_collection.insert_one(new_room)
+        if MEMBERSHIP_COLLECTION:
+            Memberships.add(str(result.inserted_id), user["username"])
         return str(result.inserted_id), new_room["room_join_code"]
     
     @staticmethod
@@ -242,16 +834,16 @@ class Rooms:
         room = Rooms.get_room(room_id)
         if not new_name or len(new_name) < 3:
             raise ValueError("Room name must be at least 3 characters long!")
-        room_collection.update_one({"_id": room["_id"]}, {"$set": {"room_name": new_name}})
-        room_collection.update_one({"_id": room["_id"]}, {"$set": {"modified_at": datetime.now()}})
+        room_collection.update_one({"_id": room["_id"]}, {"$set": {"room_name": new_name, "modified_at": datetime.now()}})
+        identity_cache.invalidate("room", room_id)
 
     @staticmethod
     def change_room_picture(room_id: str, new_picture: str):
         room = Rooms.get_room(room_id)
         if not validators.url(new_picture):
             raise ValueError("Invalid room picture URL!")
-        room_collection.update_one({"_id": room["_id"]}, {"$set": {"room_picture": new_picture}})
-        room_collection.update_one({"_id": room["_id"]}, {"$set": {"modified_at": datetime.now()}})
+        room_collection.update_one({"_id": room["_id"]}, {"$set": {"room_picture": new_picture, "modified_at": datetime.now()}})
+        identity_cache.invalidate("room", room_id)
         
     @staticmethod
     def update_room(room_id: str, room_name: str, room_picture: str, id: str):
@@ -264,7 +856,11 @@ class Rooms:
 
     @staticmethod
     def get_room(id: str):
-        room = room_collection.find_one({"_id": ObjectId(id)})
+        return identity_cache.load("room", id, lambda: Rooms.load_room(id))
+
+    @staticmethod
+    def load_room(id: str):
+        room = room_collection.find_one({"_id": ObjectId(id), **NOT_DELETED})
         if not room:
             raise ValueError("Room not found!")
         return room
@@ -272,7 +868,11 @@ class Rooms:
     @staticmethod
     def get_user_rooms(id: str):
         user = Users.get_user(id)
-        rooms = room_collection.find({"members": user["username"]})
+        if MEMBERSHIP_COLLECTION:
+            room_ids = [ObjectId(r) for r in Memberships.room_ids(user["username"])]
+            rooms = room_collection.find({"_id": {"$in": room_ids}, **NOT_DELETED})
+        else:
+            rooms = room_collection.find({"members": user["username"], **NOT_DELETED})
         serialized_rooms = []
         for room in list(rooms):
             room = dict(room)
@@ -286,68 +886,116 @@ class Rooms:
         room = room_collection.find_one({"_id": ObjectId(room_id)})
         if not room:
             raise ValueError("Room not found!")
-        room.pop("banned", None)
-        room["_id"] = str(room["_id"])
-        room["created_at"] = room["created_at"].isoformat()
-        room["modified_at"] = room["modified_at"].isoformat()
-        room["members"] = len(room["members"])
-        return room
+        return serialize_room(room)
 
     @staticmethod
     def get_room_by_join_code(join_code: str):
-        room = room_collection.find_one({"room_join_code": join_code})
+        room = room_collection.find_one({"room_join_code": join_code, **NOT_DELETED})
         if not room:
             raise ValueError("Room not found!")
         return room
 
     @staticmethod
     def add_user_to_room(id: str, room_id: str):
-        room = Rooms.get_room(room_id)
         user = Users.get_user(id)
-        if user["username"] not in room["members"]:
-            room["members"].append(user["username"])
-            room_collection.update_one({"_id": room["_id"]}, {"$set": {"members": room["members"]}})
+        if MEMBERSHIP_COLLECTION:
+            Rooms.get_room(room_id)
+            if not Memberships.add(room_id, user["username"]):
+                raise ValueError("User is already a member of this room!")
+            room_collection.update_one({"_id": ObjectId(room_id)}, {"$inc": {"members_count": 1}})
+            identity_cache.invalidate("room", room_id)
             return
-        raise ValueError("User is already a member of this room!")
+        result = room_collection.update_one(
+            {"_id": ObjectId(room_id), "members": {"$ne": user["username"]}},
+            {"$addToSet": {"members": user["username"]}}
+        )
+        identity_cache.invalidate("room", room_id)
+        if result.matched_count == 0:
+            Rooms.load_room(room_id)
+            raise ValueError("User is already a member of this room!")
 
     @staticmethod
     def remove_user_from_room(id: str, room_id: str):
-        room = Rooms.get_room(room_id)
         user = Users.get_user(id)
-        if user["username"] == room["owner"]:
-            raise ValueError("You cannot leave the room you own!")
-        if user["username"] in room["members"]:
-            room["members"].remove(user["username"])
-            room_collection.update_one({"_id": room["_id"]}, {"$set": {"members": room["members"]}})
+        if MEMBERSHIP_COLLECTION:
+            room = Rooms.get_room(room_id)
+            if user["username"] == room["owner"]:
+                raise ValueError("You cannot leave the room you own!")
+            if not Memberships.remove(room_id, user["username"]):
+                raise ValueError("User is not a member of this room!")
+            room_collection.update_one({"_id": ObjectId(room_id)}, {"$inc": {"members_count": -1}})
+            identity_cache.invalidate("room", room_id, removed=id)
             return
-        raise ValueError("User is not a member of this room!")
+        result = room_collection.update_one(
+            {"_id": ObjectId(room_id), "owner": {"$ne": user["username"]}, "members": user["username"]},
+            {"$pull": {"members": user["username"]}}
+        )
+        identity_cache.invalidate("room", room_id, removed=id)
+        if result.matched_count == 0:
+            room = Rooms.load_room(room_id)
+            if user["username"] == room["owner"]:
+                raise ValueError("You cannot leave the room you own!")
+            raise ValueError("User is not a member of this room!")
 
     @staticmethod
-    def add_message(room_id: str, message: str, id: str = None, pfp: str = None, user: str = None):
+    def add_message(room_id: str, message: str, id: str = None, pfp: str = None, user: str = None, is_ai: bool = None):
         user_obj = None
         if id:
             user_obj = Users.get_user(id)
+        if is_ai is None:
+            is_ai = Rooms.get_room(room_id).get("is_ai", False)
         new_message = {
             "room_id": room_id,
             "pfp": pfp if pfp else (user_obj["profile_picture"] if user_obj else None),
             "user": user if user else (user_obj["username"] if user_obj else None),
             "message": message,
-            "timestamp": datetime.now()
+            "timestamp": datetime.now(),
+            "is_ai": is_ai
         }
         messages_collection.insert_one(new_message)
+        if MAINTAIN_MESSAGE_COUNTS and ObjectId.is_valid(room_id):
+            room_collection.update_one(counted_room(room_id), {"$inc": {"message_count": 1}})
+
+    @staticmethod
+    def count_messages(room_ids: list):
+        counts = messages_collection.aggregate(message_count_pipeline({"room_id": {"$in": room_ids}}))
+        return {c["_id"]: c["count"] for c in counts}
+
+    @staticmethod
+    def backfill_message_ai_flags():
+        # Run once through backfill_ai_flags.py after upgrading
+        ai_rooms = [str(room["_id"]) for room in room_collection.find({"is_ai": True}, {"_id": 1})]
+        messages_collection.update_many({"room_id": {"$in": ai_rooms}}, {"$set": {"is_ai": True}})
+        messages_collection.update_many({"is_ai": {"$exists": False}}, {"$set": {"is_ai": False}})
+
+    @staticmethod
+    def backfill_message_counts():
+        """
+        Set message_count on every room from its stored messages. A room's
+        counter is only replaced if it still holds the value read before
+        counting; otherwise the room is counted again. Returns the number of
+        rooms updated.
+        """
+        updated = 0
+        for room in room_collection.find({}, {"message_count": 1}):
+            while room is not None:
+                current = room["message_count"] if "message_count" in room else {"$exists": False}
+                count = messages_collection.count_documents({"room_id": str(room["_id"])})
+                result = room_collection.update_one(
+                    {"_id": room["_id"], "message_count": current},
+                    {"$set": {"message_count": count}}
+                )
+                if result.matched_count:
+                    updated += 1
+                    break
+                room = room_collection.find_one({"_id": room["_id"]}, {"message_count": 1})
+        return updated
 
     @staticmethod
     def get_messages(room_id: str, limit: int = 15, descending: bool = False):
         sort_order = pymongo.DESCENDING if descending else pymongo.ASCENDING
         messages = messages_collection.find({"room_id": room_id}).sort("timestamp", sort_order).limit(limit)
-        serialize_messages = []
-        for m in messages:
-            m = dict(m)
-            if '_id' in m:
-                m['_id'] = str(m['_id'])
-                m['timestamp'] = m['timestamp'].isoformat() if isinstance(m['timestamp'], datetime) else m['timestamp']
-                serialize_messages.append(m)
-        return serialize_messages
+        return [serialize_message(m) for m in messages]
 
     @staticmethod
     def get_message_before(room_id: str, before: datetime, limit: int = 15):
@@ -355,17 +1003,272 @@ class Rooms:
             "room_id": room_id,
             "timestamp": {"$lt": before}
         }).sort("timestamp", pymongo.DESCENDING).limit(limit)
-        return list(messages)
+        return [serialize_message(m) for m in messages]
+
+    @staticmethod
+    def get_messages_page(room_id: str, before: str = None, limit: int = MESSAGES_PAGE_SIZE):
+        """
+        Return one page of history (oldest first) ending just before the
+        `before` cursor, plus the cursor of the next older page or None.
+        """
+        query = messages_page_query(room_id, before, limit)
+        docs = messages_collection.find(query).sort(MESSAGES_PAGE_SORT).limit(limit + 1)
+        return messages_page(list(docs), limit)
+
+class Memberships:
+
+    @staticmethod
+    def ensure_indexes():
+        indexes.ensure(membership_collection(), MEMBERSHIP_INDEXES)
+
+    @staticmethod
+    def add(room_id: str, username: str, status: str = "member"):
+        try:
+            membership_collection().insert_one({
+                "room_id": room_id,
+                "username": username,
+                "status": status,
+                "created_at": datetime.now()
+            })
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            return False
+
+    @staticmethod
+    def remove(room_id: str, username: str, status: str = "member"):
+        result = membership_collection().delete_one({"room_id": room_id, "username": username, "status": status})
+        return result.deleted_count > 0
+
+    @staticmethod
+    def status(room_id: str, username: str, status: str):
+        return membership_collection().find_one(
+            {"room_id": room_id, "username": username, "status": status},
+            {"_id": 1}
+        ) is not None
+
+    @staticmethod
+    def room_ids(username: str, status: str = "member"):
+        memberships = membership_collection().find({"username": username, "status": status}, {"_id": 0, "room_id": 1})
+        return [m["room_id"] for m in memberships]
+
+    @staticmethod
+    def remove_user(username: str):
+        # Returns the rooms the user was a member of, for members_count upkeep
+        room_ids = Memberships.room_ids(username)
+        membership_collection().delete_many({"username": username})
+        return room_ids
+
+    @staticmethod
+    def remove_room(room_id: str):
+        membership_collection().delete_many({"room_id": room_id})
+
+    @staticmethod
+    def migrate(drop_arrays: bool = False):
+        """
+        Copy the embedded members/banned arrays of every room into the
+        membership collection and set members_count. Safe to re-run.
+        """
+        Memberships.ensure_indexes()
+        migrated = 0
+        for room in room_collection.find({}, {"members": 1, "banned": 1, "created_at": 1}):
+            room_id = str(room["_id"])
+            ops = [
+                pymongo.UpdateOne(
+                    {"room_id": room_id, "username": username, "status": status},
+                    {"$setOnInsert": {"created_at": room.get("created_at", datetime.now())}},
+                    upsert=True
+                )
+                for status, usernames in (("member", room.get("members", [])), ("banned", room.get("banned", [])))
+                for username in usernames
+            ]
+            if ops:
+                membership_collection().bulk_write(ops, ordered=False)
+            count = membership_collection().count_documents({"room_id": room_id, "status": "member"})
+            update = {"$set": {"members_count": count}}
+            if drop_arrays:
+                update["$set"].update({"members": [], "banned": []})
+            room_collection.update_one({"_id": room["_id"]}, update)
+            identity_cache.invalidate("room", room_id)
+            migrated += 1
+        return migrated
+
+class Deletions:
+    """
+    Cascade deletion jobs for tombstoned users and rooms. Every step is a
+    query for what is left to delete, so re-running a job after a crash
+    just continues with the remaining documents.
+    """
+
+    wakeup = threading.Event()
+
+    @staticmethod
+    def enqueue(kind: str, target_id: str, **fields):
+        result = deletion_job_collection().insert_one(new_deletion_job(kind, target_id, **fields))
+        Deletions.wakeup.set()
+        return str(result.inserted_id)
+
+    @staticmethod
+    def claim():
+        now = datetime.now()
+        return deletion_job_collection().find_one_and_update(
+            claimable_deletion_jobs(now),
+            {
+                "$set": {"state": "running", "lease_until": now + timedelta(seconds=DELETION_LEASE), "updated_at": now},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", pymongo.ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    @staticmethod
+    def update(job, fields, inc=None):
+        now = datetime.now()
+        update = {"$set": {"updated_at": now, "lease_until": now + timedelta(seconds=DELETION_LEASE), **fields}}
+        if inc:
+            update["$inc"] = inc
+        deletion_job_collection().update_one({"_id": job["_id"]}, update)
+
+    @staticmethod
+    def in_batches(job, step, collection, query, apply, projection=None):
+        """
+        Call apply(docs) on DELETION_BATCH_SIZE documents matching `query`
+        until none are left; apply must make them stop matching and returns
+        how many it handled.
+        """
+        while True:
+            docs = list(collection.find(query, projection or {"_id": 1}).limit(DELETION_BATCH_SIZE))
+            if not docs:
+                return
+            Deletions.update(job, {}, inc={f"progress.{step}": apply(docs)})
+            time.sleep(DELETION_THROTTLE)
+
+    @staticmethod
+    def delete_docs(collection):
+        return lambda docs: collection.delete_many({"_id": {"$in": [d["_id"] for d in docs]}}).deleted_count
+
+    @staticmethod
+    def user_steps(job):
+        username = job["username"]
+
+        def pull_members(rooms):
+            room_collection.update_many({"_id": {"$in": [r["_id"] for r in rooms]}}, {"$pull": {"members": username}})
+            for room in rooms:
+                identity_cache.invalidate("room", str(room["_id"]))
+            return len(rooms)
+
+        def remove_memberships(memberships):
+            deleted = Deletions.delete_docs(membership_collection())(memberships)
+            room_ids = [m["room_id"] for m in memberships if m["status"] == "member"]
+            if room_ids:
+                room_collection.bulk_write(members_count_decrements(room_ids), ordered=False)
+            for room_id in {m["room_id"] for m in memberships}:
+                identity_cache.invalidate("room", room_id)
+            return deleted
+
+        def delete_messages(messages):
+            deleted = Deletions.delete_docs(messages_collection)(messages)
+            if MAINTAIN_MESSAGE_COUNTS:
+                counts = Counter(m["room_id"] for m in messages)
+                decrements = message_count_decrements([{"_id": r, "count": n} for r, n in counts.items()])
+                if decrements:
+                    room_collection.bulk_write(decrements, ordered=False)
+            return deleted
+
+        def delete_user():
+            user_collection.delete_one({"_id": ObjectId(job["target_id"])})
+            identity_cache.invalidate("user", job["target_id"])
+
+        if MEMBERSHIP_COLLECTION:
+            memberships = lambda: Deletions.in_batches(
+                job, "memberships", membership_collection(), {"username": username}, remove_memberships,
+                {"_id": 1, "room_id": 1, "status": 1}
+            )
+        else:
+            memberships = lambda: Deletions.in_batches(
+                job, "memberships", room_collection, {"members": username}, pull_members
+            )
+        return [
+            ("memberships", memberships),
+            ("messages", lambda: Deletions.in_batches(
+                job, "messages", messages_collection, {"user": username}, delete_messages, {"_id": 1, "room_id": 1}
+            )),
+            ("user", delete_user),
+        ]
+
+    @staticmethod
+    def room_steps(job):
+        room_id = job["target_id"]
+
+        def delete_room():
+            room_collection.delete_one({"_id": ObjectId(room_id)})
+            identity_cache.invalidate("room", room_id)
+            ai_contexts.invalidate(room_id)
+
+        steps = [
+            ("messages", lambda: Deletions.in_batches(
+                job, "messages", messages_collection, {"room_id": room_id}, Deletions.delete_docs(messages_collection)
+            )),
+        ]
+        if MEMBERSHIP_COLLECTION:
+            steps.append(("memberships", lambda: Deletions.in_batches(
+                job, "memberships", membership_collection(), {"room_id": room_id}, Deletions.delete_docs(membership_collection())
+            )))
+        steps.append(("context", lambda: ai_context_collection().delete_one({"_id": room_id})))
+        steps.append(("room", delete_room))
+        return steps
+
+    @staticmethod
+    def run(job):
+        steps = Deletions.user_steps(job) if job["kind"] == "user" else Deletions.room_steps(job)
+        try:
+            for step, run_step in steps:
+                Deletions.update(job, {"step": step})
+                run_step()
+            Deletions.update(job, {"state": "done", "step": None, "error": None, "finished_at": datetime.now()})
+        except Exception as e:
+            log.exception("Deletion job %s failed", job["_id"])
+            if job["attempts"] >= DELETION_MAX_ATTEMPTS:
+                Deletions.update(job, {"state": "failed", "error": str(e), "lease_until": None})
+            else:
+                delay = DELETION_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+                Deletions.update(job, {
+                    "state": "pending", "error": str(e),
+                    "lease_until": datetime.now() + timedelta(seconds=delay)
+                })
+
+    @staticmethod
+    def start_worker(poll_interval: float = DELETION_POLL_INTERVAL):
+        """
+        Run queued deletion jobs in the background, one at a time. Several
+        workers can share the queue; each job is claimed by one of them.
+        """
+        def work():
+            while True:
+                try:
+                    job = Deletions.claim()
+                    if job is not None:
+                        Deletions.run(job)
+                except Exception:
+                    log.exception("Deletion worker failed")
+                    job = None
+                if job is None:
+                    Deletions.wakeup.wait(poll_interval)
+                    Deletions.wakeup.clear()
+
+        thread = threading.Thread(target=work, name="deletion-worker", daemon=True)
+        thread.start()
+        return thread
 
 class Admin:
     def __init__(self):
         self.collection = user_collection
 
     @staticmethod
-    def get_all_users(pagination: int = 0, limit: int = 5, search: str = "h", sort_by: str = "created_at", sort_order: str = "asc"):
+    def get_all_users(pagination: int = 0, limit: int = 5, search: str = "h", sort_by: str = "created_at", sort_order: str = "asc", cursor: str = None):
         if sort_by not in USERS_ALLOWED_SORT_FIELDS or sort_order not in USERS_ALLOWED_SORT_ORDERS:
             raise ValueError("Invalid sort field or order!")
-        skip = pagination * limit
+        # A cursor replaces the page number; skip is kept for old clients
+        skip = 0 if cursor else pagination * limit
         pymongo_order = pymongo.DESCENDING if sort_order == "desc" else pymongo.ASCENDING
         query = {}
         if search:
@@ -373,35 +1276,45 @@ class Admin:
                 {"username": {"$regex": search, "$options": "i"}},
                 {"email": {"$regex": search, "$options": "i"}}
             ]}
-        total = user_collection.count_documents(query)
-        users = user_collection.find(query).sort(sort_by, pymongo_order).skip(skip).limit(limit)
+        query["deleted_at"] = None
+        pipeline = [
+            {"$match": keyset_query(query, sort_by, pymongo_order, cursor)},
+            {"$sort": {sort_by: pymongo_order, "_id": pymongo_order}},
+            {"$skip": skip},
+            {"$limit": limit + 1},
+            {"$project": {"password": 0}},
+            membership_lookup_stage()
+        ]
+        users, next_cursor = keyset_page(list(user_collection.aggregate(pipeline)), limit, sort_by)
         serialized_users = []
         for user in users:
-            user = dict(user)
-            user["_id"] = str(user["_id"])
-            user["created_at"] = user["created_at"].isoformat()
-            user["last_login"] = user["last_login"].isoformat()
-            joined_rooms = Rooms.get_user_rooms(user["_id"])
+            joined_rooms = user.pop("joined_rooms")
+            user = serialize_user(user)
             user["room_membership"] = [
                 {"room_name": room["room_name"], "role": "owner" if user["username"] == room["owner"] else "member"}
                 for room in joined_rooms
             ]
-            user.pop("password", None)
             serialized_users.append(user)
-        return serialized_users, total
+        return serialized_users, cached_total(user_collection, query, None if search else DELETED), next_cursor
 
     @staticmethod
     def delete_user(id: str):
         user = Users.get_user(id)
         if user["is_admin"]:
             raise ValueError("You cannot delete an admin user!")
-        user_collection.delete_one({"_id": ObjectId(id)})
-        room_collection.update_many(
-            {"members": user["username"]},
-            {"$pull": {"members": user["username"]}}
-        )
-        room_collection.delete_many({"owner": user["username"]})
-        messages_collection.delete_many({"user": user["username"]})
+        # Jobs are queued before the tombstones so a crash in between still
+        # ends with everything deleted
+        owned = [str(room["_id"]) for room in room_collection.find({"owner": user["username"], **NOT_DELETED}, {"_id": 1})]
+        job_id = Deletions.enqueue("user", id, username=user["username"])
+        for room_id in owned:
+            Deletions.enqueue("room", room_id)
+        now = datetime.now()
+        user_collection.update_one({"_id": ObjectId(id)}, {"$set": {"deleted_at": now}})
+        room_collection.update_many({"_id": {"$in": [ObjectId(r) for r in owned]}}, {"$set": {"deleted_at": now}})
+        identity_cache.invalidate("user", id)
+        for room_id in owned:
+            identity_cache.invalidate("room", room_id, removed=identity_cache.EVERYONE)
+        return job_id
 
     @staticmethod
     def lock_unlock_user(id: str, action: str):
@@ -412,6 +1325,7 @@ class Admin:
             user_collection.update_one({"_id": ObjectId(id)}, {"$set": {"status": "locked"}})
         elif action == 'unlock':
             user_collection.update_one({"_id": ObjectId(id)}, {"$set": {"status": "active"}})
+        identity_cache.invalidate("user", id)
 
     @staticmethod
     def reset_user_password(id: str, new_password: str, confirm_password: str):
@@ -423,14 +1337,15 @@ class Admin:
         if user["is_admin"]:
             raise ValueError("You cannot reset an admin user!")
         user_collection.update_one({"_id": ObjectId(id)}, {"$set": {"password": hash_password(new_password)}})
+        identity_cache.invalidate("user", id)
 
     ##############################################################
 
     @staticmethod
-    def get_all_rooms(pagination: int = 0, limit: int = 5, search: str = "", sort_by: str = "created_at", sort_order: str = "members_count"):
+    def get_all_rooms(pagination: int = 0, limit: int = 5, search: str = "", sort_by: str = "created_at", sort_order: str = "members_count", cursor: str = None):
         if sort_by not in ROOMS_ALLOWED_SORT_FIELDS or sort_order not in ROOMS_ALLOWED_SORT_ORDERS:
             raise ValueError("Invalid sort field or order!")
-        skip = pagination * limit
+        skip = 0 if cursor else pagination * limit
         pymongo_order = pymongo.DESCENDING if sort_order == "desc" else pymongo.ASCENDING
         query = {
             "is_ai": {"$ne": True},
@@ -442,35 +1357,47 @@ class Admin:
                 {"room_join_code": {"$regex": search, "$options": "i"}},
                 {"owner": {"$regex": search, "$options": "i"}}
             ]}
-        total = room_collection.count_documents(query)
-        rooms = room_collection.find(query).sort(sort_by, pymongo_order).skip(skip).limit(limit)
+        query["deleted_at"] = None
+        pipeline = [
+            {"$match": keyset_query(query, sort_by, pymongo_order, cursor)},
+            {"$sort": {sort_by: pymongo_order, "_id": pymongo_order}},
+            {"$skip": skip},
+            {"$limit": limit + 1}
+        ]
+        rooms, next_cursor = keyset_page(list(room_collection.aggregate(pipeline)), limit, sort_by)
+        # Rooms without a maintained counter get counted in one grouped query
+        uncounted = [
+            str(room["_id"]) for room in rooms
+            if not MAINTAIN_MESSAGE_COUNTS or "message_count" not in room
+        ]
+        counts = Rooms.count_messages(uncounted) if uncounted else {}
         serialized_rooms = []
         for room in rooms:
-            room = dict(room)
-            if "_id" in room:
-                room["_id"] = str(room["_id"])
+            room["_id"] = str(room["_id"])
             room["created_at"] = room["created_at"].isoformat()
             room["modified_at"] = room["modified_at"].isoformat()
-            room["members_count"] = len(room.get("members", []))
-            room["total_messages"] = messages_collection.count_documents({"room_id": room["_id"]})
+            room["members_count"] = members_count(room)
+            room["total_messages"] = counts.get(room["_id"], room.get("message_count", 0))
+            room.pop("message_count", None)
             room.pop("banned", None)
             room.pop("is_ai", None)
             serialized_rooms.append(room)
-        return serialized_rooms, total
+        return serialized_rooms, cached_total(room_collection, query, None if search else ADMIN_ROOMS_EXCLUDED), next_cursor
 
     @staticmethod
     def delete_room(room_id: str):
         room = Rooms.get_room(room_id)
         if room["is_ai"]:
             raise ValueError("You cannot delete an AI room!")
-        room_collection.delete_one({"_id": ObjectId(room_id)})
-        messages_collection.delete_many({"room_id": room_id})
-        return {"message": "Room deleted successfully!"}
+        job_id = Deletions.enqueue("room", room_id)
+        room_collection.update_one({"_id": ObjectId(room_id)}, {"$set": {"deleted_at": datetime.now()}})
+        identity_cache.invalidate("room", room_id, removed=identity_cache.EVERYONE)
+        return job_id
 
     ##############################################################
 
     @staticmethod
-    def get_all_messages(pagination: int = 0, limit: int = 5, search: str = "", sort_by: str = "created_at", sort_order: str = "desc"):
+    def get_all_messages(pagination: int = 0, limit: int = 5, search: str = "", sort_by: str = "created_at", sort_order: str = "desc", cursor: str = None):
         if sort_by not in MESSAGES_ALLOWED_SORT_FIELDS \
            or sort_order not in MESSAGES_ALLOWED_SORT_ORDERS:
             raise ValueError("Invalid sort field or order!")
@@ -482,64 +1409,27 @@ class Admin:
         }
         sort_field = sort_field_map.get(sort_by, "timestamp")
 
-        match_stage = {}
-        if search:
-            regex = {"$regex": search, "$options": "i"}
-            match_stage["$or"] = [
-                {"message": regex},
-                {"user":    regex},
-            ]
-
-        skip = pagination * limit
+        skip = 0 if cursor else pagination * limit
         direction = pymongo.DESCENDING if sort_order == "desc" else pymongo.ASCENDING
-        pipeline = []
-
-        if match_stage:
-            pipeline.append({"$match": match_stage})
-
-        pipeline.append({"$match": {"room_id": {"$type": "string", "$regex": "^[a-fA-F0-9]{24}$"}}})
-        pipeline.append({"$addFields": {"room_id_obj": {"$toObjectId": "$room_id"}}})
-        pipeline.append({
-            "$lookup": {
-                "from": "rooms",
-                "localField": "room_id_obj",
-                "foreignField": "_id",
-                "as": "room_docs"
-            }
-        })
-        pipeline.append({"$unwind": "$room_docs"})
-        pipeline.append({"$match": {"room_docs.room_name": {"$ne": "AI Room"}}})
-        pipeline.append({"$sort": {sort_field: direction}})
-        pipeline.append({
-            "$facet": {
-                "data": [
-                    {"$skip": skip},
-                    {"$limit": limit},
-                    {"$project": {
-                        "_id": {"$toString": "$_id"},
-                        "user": 1,
-                        "message": 1,
-                        "timestamp": {"$dateToString": {"format": "%Y-%m-%dT%H:%M:%S.%LZ", "date": "$timestamp"}},
-                        "room_id": 1,
-                        "room_name": "$room_docs.room_name"
-                    }}
-                ],
-                "total": [
-                    {"$count": "count"}
-                ]
-            }
-        })
-        result = list(messages_collection.aggregate(pipeline))[0]
-        serialized_messages = result["data"]
-        total = result["total"][0]["count"] if result["total"] else 0
-        return serialized_messages, total
+        pipeline = messages_search_pipeline(search, sort_field, direction, skip, limit + 1, cursor)
+        messages = list(messages_collection.aggregate(pipeline))
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        next_cursor = encode_keyset_cursor(messages[-1]["cursor_value"], messages[-1]["cursor_id"]) if has_more else None
+        for message in messages:
+            message.pop("cursor_value", None)
+            message.pop("cursor_id", None)
+        total = cached_total(messages_collection, messages_search_match(search), None if search else ADMIN_MESSAGES_EXCLUDED)
+        return messages, total, next_cursor
 
     @staticmethod
     def delete_message(message_id: str):
         message = messages_collection.find_one({"_id": ObjectId(message_id)})
         if not message:
             raise ValueError("Message not found!")
-        messages_collection.delete_one({"_id": ObjectId(message_id)})
+        result = messages_collection.delete_one({"_id": ObjectId(message_id)})
+        if MAINTAIN_MESSAGE_COUNTS and result.deleted_count and ObjectId.is_valid(message["room_id"]):
+            room_collection.update_one(counted_room(message["room_id"]), {"$inc": {"message_count": -1}})
 
     ##############################################################
 
@@ -547,6 +1437,9 @@ class Admin:
     def get_ai_settings():
         stats = stats_collection.find_one({"_id": ObjectId(STAT_DOC_ID)})
         stats["_id"] = str(stats["_id"])
+        derive_ai_stats(stats)
+        stats["scheduler"] = ai_scheduler.stats()
+        stats["response_cache"] = ai_response_cache.stats()
         return stats
 
     @staticmethod
@@ -557,22 +1450,154 @@ class Admin:
             AI.change_ai_temperature(temperature)
         if max_tokens:
             AI.change_max_tokens(max_tokens)
+        ai_response_cache.clear()
 
     ############################################################## 
 
     @staticmethod
     def get_config():
+        config = config_cache.get(SETTING_DOC_ID)
+        if config is None:
+            config = Admin.load_config()
+        return dict(config)
+
+    @staticmethod
+    def load_config():
         config = settings_collection.find_one({"_id": ObjectId(SETTING_DOC_ID)})
         if not config:
             raise ValueError("Config not found!")
         config["_id"] = str(config["_id"])
+        config_cache.set(SETTING_DOC_ID, config)
         return config
-        
+
+    @staticmethod
     def update_config(updates: dict):
         result = settings_collection.update_one({"_id": ObjectId(SETTING_DOC_ID)}, {"$set": updates})
+        config_cache.invalidate(SETTING_DOC_ID)
+        if "system_message" in updates:
+            ai_response_cache.clear()
         if result.matched_count == 0:
             raise ValueError("Config not found!")
 
+    @staticmethod
+    def get_message_writer_stats():
+        return message_writer.stats()
+
+    @staticmethod
+    def get_hash_pool_stats():
+        return hash_pool.stats()
+
+    @staticmethod
+    def get_deletion_jobs(state: str = None, limit: int = 20):
+        query = {"state": state} if state else {}
+        jobs = deletion_job_collection().find(query).sort("created_at", pymongo.DESCENDING).limit(limit)
+        return [serialize_deletion_job(job) for job in jobs]
+
+    @staticmethod
+    def get_deletion_job(job_id: str):
+        if not ObjectId.is_valid(job_id):
+            raise ValueError("Deletion job not found!")
+        job = deletion_job_collection().find_one({"_id": ObjectId(job_id)})
+        if not job:
+            raise ValueError("Deletion job not found!")
+        return serialize_deletion_job(job)
+
+    @staticmethod
+    def retry_deletion_job(job_id: str):
+        if not ObjectId.is_valid(job_id):
+            raise ValueError("Deletion job not found!")
+        result = deletion_job_collection().update_one(
+            {"_id": ObjectId(job_id), "state": "failed"},
+            {"$set": {"state": "pending", "attempts": 0, "lease_until": None, "error": None, "updated_at": datetime.now()}}
+        )
+        if result.matched_count == 0:
+            raise ValueError("Deletion job not found or not failed!")
+        Deletions.wakeup.set()
+
+    @staticmethod
+    def get_cache_stats():
+        stats = identity_cache.stats()
+        stats["config"] = config_cache.stats()
+        return stats
+
+    @staticmethod
+    def start_config_refresher(interval: float = CONFIG_REFRESH_INTERVAL):
+        """
+        Keep the cached config fresh in the background. Uses a change stream
+        when the deployment supports it and falls back to polling otherwise.
+        """
+        def watch():
+            try:
+                with settings_collection.watch([{"$match": {"documentKey._id": ObjectId(SETTING_DOC_ID)}}]) as stream:
+                    for _ in stream:
+                        config_cache.invalidate(SETTING_DOC_ID)
+            except pymongo.errors.PyMongoError:
+                poll()
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    Admin.load_config()
+                except (ValueError, pymongo.errors.PyMongoError):
+                    config_cache.invalidate(SETTING_DOC_ID)
+
+        thread = threading.Thread(target=watch, name="config-refresher", daemon=True)
+        thread.start()
+        return thread
+
+class AIContexts:
+    """
+    Per-room conversation windows for the AI. A window is built once per
+    worker from the stored summary and recent messages, then only the
+    messages stored after its cursor are appended.
+    """
+
+    @staticmethod
+    async def get(room_id: str):
+        window = ai_contexts.get(room_id)
+        if window is None:
+            window = await AIContexts.load(room_id)
+            ai_contexts.set(room_id, window)
+        return window
+
+    @staticmethod
+    async def load(room_id: str):
+        doc = await async_collection(ai_context_collection()).find_one({"_id": room_id}) or {}
+        cursor = (doc["cursor_timestamp"], doc["cursor_id"]) if doc.get("cursor_id") else None
+        window = ConversationWindow(doc.get("summary", ""), cursor)
+        recent = async_collection(messages_collection).find(messages_after_query(room_id, cursor))
+        recent = await recent.sort(MESSAGES_PAGE_SORT).limit(AI_CONTEXT_LOAD_LIMIT).to_list(length=None)
+        for m in reversed(recent):
+            window.append(*message_turn(m))
+        return window
+
+    @staticmethod
+    async def sync(room_id: str, window, prompt):
+        """
+        Append the messages stored since the window's cursor, and `prompt`
+        if it isn't stored yet (write-behind).
+        """
+        new = async_collection(messages_collection).find(messages_after_query(room_id, window.cursor))
+        async for m in new.sort([("timestamp", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]):
+            window.append(*message_turn(m))
+        if window.cursor is None or str(window.cursor[1]) != prompt["_id"]:
+            cursor = (datetime.fromisoformat(prompt["timestamp"]), ObjectId(prompt["_id"]))
+            window.append("user", prompt["message"], cursor)
+
+    @staticmethod
+    async def compact(room_id: str, window, budget: int):
+        dropped = window.overflow(budget, int(budget * AI_CONTEXT_TARGET))
+        if not dropped:
+            return
+        window.set_summary(await AI.summarize(window.summary, dropped, budget // 4))
+        timestamp, id = dropped[-1][3]
+        await async_collection(ai_context_collection()).update_one(
+            {"_id": room_id},
+            {"$set": {"summary": window.summary, "cursor_timestamp": timestamp, "cursor_id": id, "updated_at": datetime.now()}},
+            upsert=True
+        )
+
 class AI:
 
     @staticmethod
@@ -588,33 +1613,659 @@ class AI:
         elapsed = time.time() - start_time
 
         if llm.response:
-            old_n = stat.get("total_ai_responses", 0)
-            old_avg = stat.get("average_response_time", 0.0)
-            total_reqs = stat["total_requests"]
-            new_n = old_n + 1
-            new_avg = (old_avg * old_n + elapsed) / new_n
-            new_rate = (new_n / total_reqs) * 100
-            stats_collection.update_one(
-                {"_id": ObjectId(STAT_DOC_ID)},
-                {
-                    "$inc": {"total_ai_responses": 1},
-                    "$set": {
-                        "average_response_time": new_avg,
-                        "ai_response_rate": new_rate
-                    }
-                }
-            )
+            ai_stats.count("total_ai_responses")
+            ai_stats.observe("response_time", elapsed)
 
         return llm.response.text
 
+    @staticmethod
+    async def stream_llm(room_id, prompt):
+        """
+        Stream the reply to `prompt`, the stored message, chunk by chunk with
+        the room's conversation window as context. Response time and time to
+        first token are recorded in the AI stats once the reply is done.
+        """
+        model = await get_llm_model()
+        if model is None:
+            raise ValueError("The AI is not configured!")
+        ai_stats.count("total_requests")
+        scope = await AI.generation_settings()
+        system_message, temperature, max_tokens = scope
+        window = await AIContexts.get(room_id)
+        async with window.lock:
+            await AIContexts.sync(room_id, window, prompt)
+            await AIContexts.compact(room_id, window, max_tokens)
+            messages = window.messages(system_message)
+            # Only the prompt itself: nothing from this room's history
+            context_free = not window.has_history
+
+        start_time = time.time()
+        first_token = None
+        chunks = []
+        async for chunk in model.stream(messages, temperature, max_tokens):
+            if first_token is None:
+                first_token = time.time() - start_time
+            chunks.append(chunk)
+            yield chunk
+        elapsed = time.time() - start_time
+        if first_token is None:
+            return
+        ai_stats.count("total_ai_responses")
+        ai_stats.observe("response_time", elapsed)
+        ai_stats.observe("first_token_time", first_token)
+        if context_free and ai_response_cacheable(prompt["message"]):
+            ai_response_cache.set(prompt["message"], scope, "".join(chunks))
+
+    @staticmethod
+    async def cached_reply(room_id: str, prompt):
+        """
+        A cached reply to `prompt` (the stored message), or None when it has
+        to be generated. Rooms with conversation history always generate,
+        since a cached reply knows nothing of it.
+        """
+        if not ai_response_cacheable(prompt["message"]):
+            return None
+        window = await AIContexts.get(room_id)
+        async with window.lock:
+            await AIContexts.sync(room_id, window, prompt)
+            if window.has_history:
+                return None
+        reply = ai_response_cache.get(prompt["message"], await AI.generation_settings())
+        if reply is not None:
+            ai_stats.count("total_requests")
+            ai_stats.count("total_ai_responses")
+        return reply
+
+    @staticmethod
+    async def generation_settings():
+        """
+        (system message, temperature, max_tokens) for generating a reply;
+        also the scope of cached replies.
+        """
+        settings = ai_settings_cache.get(STAT_DOC_ID)
+        if settings is None:
+            settings = await async_collection(stats_collection).find_one(
+                {"_id": ObjectId(STAT_DOC_ID)},
+                {"_id": 0, "temperature": 1, "max_tokens": 1}
+            ) or {}
+            ai_settings_cache.set(STAT_DOC_ID, settings)
+        config = await AsyncAdmin.get_config()
+        return config.get("system_message") or "", settings.get("temperature", 1.0), settings.get("max_tokens", 1024)
+
+    @staticmethod
+    async def summarize(summary, turns, max_tokens):
+        """
+        Fold `turns` into `summary`. Keeps the old summary, so the turns are
+        simply dropped, when the model fails.
+        """
+        transcript = "\n".join(f"{role}: {content}" for role, content, _, _ in turns)
+        if summary:
+            transcript = f"Summary so far: {summary}\n\n{transcript}"
+        messages = [
+            {"role": "system", "content": "Summarize this conversation between a user and an assistant in a few sentences. Keep names, facts and decisions the assistant may need later."},
+            {"role": "user", "content": transcript}
+        ]
+        try:
+            return "".join([chunk async for chunk in (await get_llm_model()).stream(messages, 0.2, max_tokens)])
+        except ValueError:
+            return summary
+
+    @staticmethod
+    def flush_stats():
+        inc = ai_stats.drain()
+        if not inc:
+            return
+        try:
+            stats_collection.update_one({"_id": ObjectId(STAT_DOC_ID)}, {"$inc": inc})
+        except pymongo.errors.PyMongoError:
+            ai_stats.restore(inc)
+
+    @staticmethod
+    def start_stats_flusher(interval: float = AI_STATS_FLUSH_INTERVAL):
+        def flush():
+            while True:
+                time.sleep(interval)
+                AI.flush_stats()
+
+        thread = threading.Thread(target=flush, name="ai-stats-flusher", daemon=True)
+        thread.start()
+        return thread
+
     @staticmethod
     def change_ai_temperature(temperature):
         if temperature > 1.5 or temperature < 0:
             raise ValueError("Invalid temperature value!")
         stats_collection.update_one({"_id": ObjectId(STAT_DOC_ID)}, {"$set": {"temperature": temperature}})
+        ai_settings_cache.invalidate(STAT_DOC_ID)
 
     @staticmethod
     def change_max_tokens(max_tokens):
         if max_tokens < 128 or max_tokens > 4096:
             raise ValueError("Invalid max_tokens value!")
         stats_collection.update_one({"_id": ObjectId(STAT_DOC_ID)}, {"$set": {"max_tokens": max_tokens}})
+        ai_settings_cache.invalidate(STAT_DOC_ID)
+
+##############################################################
+# Async data layer
+#
+# Mirrors Authentication/Users/Rooms/Admin on top of PyMongo's native
+# asyncio client so Socket.IO handlers and async routes never block the
+# event loop on a database round trip. Validation and error messages are
+# shared with the sync classes above.
+##############################################################
+
+_async_client = None
+# (settings, model) for the llm_url and llm_api_key the model was built from
+_llm_model = (None, None)
+
+async def get_llm_model():
+    global _llm_model
+    config = await AsyncAdmin.get_config()
+    settings = (config.get("llm_url"), config.get("llm_api_key"))
+    if _llm_model[0] != settings:
+        _llm_model = (settings, create_model(*settings))
+    return _llm_model[1]
+
+def get_async_db():
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncMongoClient(get_db_uri(), maxPoolSize=MONGO_POOL_SIZE)
+    return _async_client[get_db_name()]
+
+def async_collection(collection):
+    return get_async_db()[collection.name]
+
+def only_duplicates(error):
+    return all(e.get("code") == 11000 for e in error.details.get("writeErrors", [])) \
+        and not error.details.get("writeConcernErrors")
+
+async def persist_messages(docs):
+    try:
+        await async_collection(messages_collection).insert_many(docs, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        # A retried batch: messages written by the failed attempt keep their _id
+        if not only_duplicates(e):
+            raise
+    counts = Counter(d["room_id"] for d in docs if ObjectId.is_valid(d["room_id"]))
+    if MAINTAIN_MESSAGE_COUNTS and counts:
+        await async_collection(room_collection).bulk_write([
+            pymongo.UpdateOne(counted_room(room_id), {"$inc": {"message_count": n}})
+            for room_id, n in counts.items()
+        ], ordered=False)
+
+message_writer = BatchWriter(
+    persist_messages,
+    max_batch=MESSAGE_BATCH_SIZE,
+    flush_interval=MESSAGE_FLUSH_INTERVAL,
+    max_queue=MESSAGE_QUEUE_SIZE,
+    max_retries=MESSAGE_FLUSH_RETRIES,
+    retry_delay=MESSAGE_RETRY_DELAY
+)
+
+class AsyncAuthentication:
+
+    @staticmethod
+    async def login(email: str, password: str):
+        normalized_email = normalize_email(email)
+        users = async_collection(user_collection)
+        user = await users.find_one({"email": normalized_email, **NOT_DELETED})
+        if not user:
+            raise ValueError("Invalid email or password!")
+        try:
+            await check_password_async(user["password"], password)
+        except VerifyMismatchError:
+            raise ValueError("Invalid email or password!")
+        if user["status"] == "locked":
+            raise ValueError("Your account is locked!")
+        updates = {"last_login": datetime.now()}
+        if password_needs_rehash(user["password"]):
+            updates["password"] = await hash_password_async(password)
+        await users.update_one({"_id": user["_id"]}, {"$set": updates})
+        identity_cache.invalidate("user", user["_id"])
+        return create_access_token(data={"sub": str(user["_id"])})
+
+    @staticmethod
+    async def register(email: str, username: str, password: str):
+        if not await get_register_status_async():
+            raise ValueError("This feature is currently disabled by an admin!")
+        normalized_email = normalize_email(email)
+        validate_registration(username, password)
+        new_user = new_user_document(username, normalized_email, await hash_password_async(password))
+        try:
+            result = await async_collection(user_collection).insert_one(new_user)
+            await AsyncRooms.create_room("AI Room", None, str(result.inserted_id), None, True, is_system=True)
+            return create_access_token(data={"sub": str(result.inserted_id)})
+        except pymongo.errors.DuplicateKeyError:
+            raise ValueError("Username or email already exists!")
+
+class AsyncUsers:
+
+    @staticmethod
+    async def get_user(id: str):
+        return await identity_cache.load_async("user", id, lambda: AsyncUsers.load_user(id))
+
+    @staticmethod
+    async def load_user(id: str):
+        user = await async_collection(user_collection).find_one({"_id": ObjectId(id), **NOT_DELETED})
+        if not user:
+            raise ValueError("User not found!")
+        return serialize_user(user)
+
+    @staticmethod
+    async def load_users(ids: list):
+        """Fresh, uncached copies of the users in `ids` that still exist, by id."""
+        cursor = async_collection(user_collection).find({"_id": {"$in": [ObjectId(i) for i in ids]}, **NOT_DELETED})
+        return {str(user["_id"]): serialize_user(user) async for user in cursor}
+
+    @staticmethod
+    async def change_user_email(id: str, new_email: str):
+        normalized_email = normalize_email(new_email)
+        users = async_collection(user_collection)
+        if await users.find_one({"email": normalized_email}):
+            raise ValueError("Email already in use!")
+        await users.update_one({"_id": ObjectId(id)}, {"$set": {"email": normalized_email}})
+        identity_cache.invalidate("user", id)
+
+    @staticmethod
+    async def change_user_password(id: str, old_password: str, new_password: str):
+        users = async_collection(user_collection)
+        user = await users.find_one({"_id": ObjectId(id)})
+        if not user:
+            raise ValueError("User not found!")
+        try:
+            await check_password_async(user["password"], old_password)
+        except VerifyMismatchError:
+            raise ValueError("Invalid password!")
+        if not validate_password(new_password):
+            raise ValueError("Weak password!")
+        hashed = await hash_password_async(new_password)
+        await users.update_one({"_id": ObjectId(id)}, {"$set": {"password": hashed}})
+        identity_cache.invalidate("user", id)
+
+    @staticmethod
+    async def change_user_pfp(id: str, new_pfp: str):
+        await async_collection(user_collection).update_one({"_id": ObjectId(id)}, {"$set": {"profile_picture": new_pfp}})
+        identity_cache.invalidate("user", id)
+
+    @staticmethod
+    async def update_user(id: str, email, old_p, new_p, pfp):
+        if email:
+            await AsyncUsers.change_user_email(id, email)
+        if old_p and new_p:
+            await AsyncUsers.change_user_password(id, old_p, new_p)
+        if pfp:
+            await AsyncUsers.change_user_pfp(id, pfp)
+
+    @staticmethod
+    async def is_user_in_room(id: str, room_id: str):
+        room = await AsyncRooms.get_room(room_id)
+        if str(room["_id"]) == '685a64dcd94f6bbc0088f911':
+            return True
+        user = await AsyncUsers.get_user(id)
+        if user["is_admin"]:
+            return True
+        if MEMBERSHIP_COLLECTION:
+            return await AsyncMemberships.status(room_id, user["username"], "member")
+        return user["username"] in room["members"]
+
+    @staticmethod
+    async def is_user_owner(id: str, room_id: str):
+        room = await AsyncRooms.get_room(room_id)
+        user = await AsyncUsers.get_user(id)
+        if user["is_admin"]:
+            return True
+        return user["username"] == room["owner"]
+
+    @staticmethod
+    async def is_user_banned(id: str, room_id: str):
+        room = await AsyncRooms.get_room(room_id)
+        user = await AsyncUsers.get_user(id)
+        if user["is_admin"]:
+            return False
+        if MEMBERSHIP_COLLECTION:
+            return await AsyncMemberships.status(room_id, user["username"], "banned")
+        return user["username"] in room.get("banned", [])
+
+    @staticmethod
+    async def is_user_admin(id: str):
+        user = await AsyncUsers.get_user(id)
+        return user.get("is_admin", False)
+
+    @staticmethod
+    async def check_ai_access(id: str, room_id: str):
+        user = await AsyncUsers.get_user(id)
+        return user["ai_room"] == room_id
+
+class AsyncRooms:
+
+    @staticmethod
+    async def create_room(room_name: str, room_picture: str, id: str, join_code: str = None, is_ai: bool = False, is_system: bool = False):
+        user = await AsyncUsers.get_user(id)
+        new_room = new_room_document(room_name, room_picture, user["username"], join_code, is_ai, is_system)
+        result = await async_collection(room_collection).insert_one(new_room)
+        if MEMBERSHIP_COLLECTION:
+            await AsyncMemberships.add(str(result.inserted_id), user["username"])
+        return str(result.inserted_id), new_room["room_join_code"]
+
+    @staticmethod
+    async def change_room_name(room_id: str, new_name: str):
+        room = await AsyncRooms.get_room(room_id)
+        if not new_name or len(new_name) < 3:
+            raise ValueError("Room name must be at least 3 characters long!")
+        await async_collection(room_collection).update_one(
+            {"_id": room["_id"]},
+            {"$set": {"room_name": new_name, "modified_at": datetime.now()}}
+        )
+        identity_cache.invalidate("room", room_id)
+
+    @staticmethod
+    async def change_room_picture(room_id: str, new_picture: str):
+        room = await AsyncRooms.get_room(room_id)
+        if not validators.url(new_picture):
+            raise ValueError("Invalid room picture URL!")
+        await async_collection(room_collection).update_one(
+            {"_id": room["_id"]},
+            {"$set": {"room_picture": new_picture, "modified_at": datetime.now()}}
+        )
+        identity_cache.invalidate("room", room_id)
+
+    @staticmethod
+    async def update_room(room_id: str, room_name: str, room_picture: str, id: str):
+        if not await AsyncUsers.is_user_owner(id, room_id):
+            raise ValueError("You are not the owner of this room!")
+        if room_name:
+            await AsyncRooms.change_room_name(room_id, room_name)
+        if room_picture:
+            await AsyncRooms.change_room_picture(room_id, room_picture)
+
+    @staticmethod
+    async def get_room(id: str):
+        return await identity_cache.load_async("room", id, lambda: AsyncRooms.load_room(id))
+
+    @staticmethod
+    async def load_room(id: str):
+        room = await async_collection(room_collection).find_one({"_id": ObjectId(id), **NOT_DELETED})
+        if not room:
+            raise ValueError("Room not found!")
+        return room
+
+    @staticmethod
+    async def get_user_rooms(id: str):
+        user = await AsyncUsers.get_user(id)
+        if MEMBERSHIP_COLLECTION:
+            room_ids = [ObjectId(r) for r in await AsyncMemberships.room_ids(user["username"])]
+            query = {"_id": {"$in": room_ids}, **NOT_DELETED}
+        else:
+            query = {"members": user["username"], **NOT_DELETED}
+        serialized_rooms = []
+        async for room in async_collection(room_collection).find(query):
+            room["_id"] = str(room["_id"])
+            serialized_rooms.append(room)
+        return serialized_rooms
+
+    @staticmethod
+    async def get_room_by_id(room_id: str):
+        room = await async_collection(room_collection).find_one({"_id": ObjectId(room_id)})
+        if not room:
+            raise ValueError("Room not found!")
+        return serialize_room(room)
+
+    @staticmethod
+    async def get_room_by_join_code(join_code: str):
+        room = await async_collection(room_collection).find_one({"room_join_code": join_code, **NOT_DELETED})
+        if not room:
+            raise ValueError("Room not found!")
+        return room
+
+    @staticmethod
+    async def add_user_to_room(id: str, room_id: str):
+        user = await AsyncUsers.get_user(id)
+        if MEMBERSHIP_COLLECTION:
+            await AsyncRooms.get_room(room_id)
+            if not await AsyncMemberships.add(room_id, user["username"]):
+                raise ValueError("User is already a member of this room!")
+            await async_collection(room_collection).update_one({"_id": ObjectId(room_id)}, {"$inc": {"members_count": 1}})
+            identity_cache.invalidate("room", room_id)
+            return
+        result = await async_collection(room_collection).update_one(
+            {"_id": ObjectId(room_id), "members": {"$ne": user["username"]}},
+            {"$addToSet": {"members": user["username"]}}
+        )
+        identity_cache.invalidate("room", room_id)
+        if result.matched_count == 0:
+            await AsyncRooms.load_room(room_id)
+            raise ValueError("User is already a member of this room!")
+
+    @staticmethod
+    async def remove_user_from_room(id: str, room_id: str):
+        user = await AsyncUsers.get_user(id)
+        if MEMBERSHIP_COLLECTION:
+            room = await AsyncRooms.get_room(room_id)
+            if user["username"] == room["owner"]:
+                raise ValueError("You cannot leave the room you own!")
+            if not await AsyncMemberships.remove(room_id, user["username"]):
+                raise ValueError("User is not a member of this room!")
+            await async_collection(room_collection).update_one({"_id": ObjectId(room_id)}, {"$inc": {"members_count": -1}})
+            identity_cache.invalidate("room", room_id, removed=id)
+            return
+        result = await async_collection(room_collection).update_one(
+            {"_id": ObjectId(room_id), "owner": {"$ne": user["username"]}, "members": user["username"]},
+            {"$pull": {"members": user["username"]}}
+        )
+        identity_cache.invalidate("room", room_id, removed=id)
+        if result.matched_count == 0:
+            room = await AsyncRooms.load_room(room_id)
+            if user["username"] == room["owner"]:
+                raise ValueError("You cannot leave the room you own!")
+            raise ValueError("User is not a member of this room!")
+
+    @staticmethod
+    async def add_message(room_id: str, message: str, id: str = None, pfp: str = None, user: str = None, is_ai: bool = None):
+        user_obj = None
+        if id:
+            user_obj = await AsyncUsers.get_user(id)
+        if is_ai is None:
+            is_ai = (await AsyncRooms.get_room(room_id)).get("is_ai", False)
+        new_message = {
+            "room_id": room_id,
+            "pfp": pfp if pfp else (user_obj["profile_picture"] if user_obj else None),
+            "user": user if user else (user_obj["username"] if user_obj else None),
+            "message": message,
+            "timestamp": datetime.now(),
+            "is_ai": is_ai,
+            "_id": ObjectId()
+        }
+        if message_writer.running:
+            await message_writer.submit(new_message, wait=MESSAGE_DURABILITY == "ack")
+        else:
+            await persist_messages([new_message])
+        return serialize_message(new_message)
+
+    @staticmethod
+    async def get_messages(room_id: str, limit: int = 15, descending: bool = False):
+        sort_order = pymongo.DESCENDING if descending else pymongo.ASCENDING
+        cursor = async_collection(messages_collection).find({"room_id": room_id}).sort("timestamp", sort_order).limit(limit)
+        return [serialize_message(m) async for m in cursor]
+
+    @staticmethod
+    async def get_message_before(room_id: str, before: datetime, limit: int = 15):
+        cursor = async_collection(messages_collection).find({
+            "room_id": room_id,
+            "timestamp": {"$lt": before}
+        }).sort("timestamp", pymongo.DESCENDING).limit(limit)
+        return [serialize_message(m) async for m in cursor]
+
+    @staticmethod
+    async def get_messages_page(room_id: str, before: str = None, limit: int = MESSAGES_PAGE_SIZE):
+        query = messages_page_query(room_id, before, limit)
+        cursor = async_collection(messages_collection).find(query).sort(MESSAGES_PAGE_SORT).limit(limit + 1)
+        return messages_page(await cursor.to_list(length=limit + 1), limit)
+
+class AsyncMemberships:
+
+    @staticmethod
+    def collection():
+        return get_async_db()[MEMBERSHIP_COLLECTION_NAME]
+
+    @staticmethod
+    async def add(room_id: str, username: str, status: str = "member"):
+        try:
+            await AsyncMemberships.collection().insert_one({
+                "room_id": room_id,
+                "username": username,
+                "status": status,
+                "created_at": datetime.now()
+            })
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            return False
+
+    @staticmethod
+    async def remove(room_id: str, username: str, status: str = "member"):
+        result = await AsyncMemberships.collection().delete_one({"room_id": room_id, "username": username, "status": status})
+        return result.deleted_count > 0
+
+    @staticmethod
+    async def status(room_id: str, username: str, status: str):
+        return await AsyncMemberships.collection().find_one(
+            {"room_id": room_id, "username": username, "status": status},
+            {"_id": 1}
+        ) is not None
+
+    @staticmethod
+    async def room_ids(username: str, status: str = "member"):
+        cursor = AsyncMemberships.collection().find({"username": username, "status": status}, {"_id": 0, "room_id": 1})
+        return [m["room_id"] async for m in cursor]
+
+    @staticmethod
+    async def remove_user(username: str):
+        room_ids = await AsyncMemberships.room_ids(username)
+        await AsyncMemberships.collection().delete_many({"username": username})
+        return room_ids
+
+    @staticmethod
+    async def remove_room(room_id: str):
+        await AsyncMemberships.collection().delete_many({"room_id": room_id})
+
+class AsyncAdmin:
+
+    @staticmethod
+    async def delete_user(id: str):
+        user = await AsyncUsers.get_user(id)
+        if user["is_admin"]:
+            raise ValueError("You cannot delete an admin user!")
+        rooms = async_collection(room_collection)
+        owned = [str(room["_id"]) async for room in rooms.find({"owner": user["username"], **NOT_DELETED}, {"_id": 1})]
+        job_id = await AsyncAdmin.enqueue_deletion("user", id, username=user["username"])
+        for room_id in owned:
+            await AsyncAdmin.enqueue_deletion("room", room_id)
+        now = datetime.now()
+        await async_collection(user_collection).update_one({"_id": ObjectId(id)}, {"$set": {"deleted_at": now}})
+        await rooms.update_many({"_id": {"$in": [ObjectId(r) for r in owned]}}, {"$set": {"deleted_at": now}})
+        identity_cache.invalidate("user", id)
+        for room_id in owned:
+            identity_cache.invalidate("room", room_id, removed=identity_cache.EVERYONE)
+        return job_id
+
+    @staticmethod
+    async def enqueue_deletion(kind: str, target_id: str, **fields):
+        result = await async_collection(deletion_job_collection()).insert_one(new_deletion_job(kind, target_id, **fields))
+        Deletions.wakeup.set()
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def lock_unlock_user(id: str, action: str):
+        user = await AsyncUsers.get_user(id)
+        if user["is_admin"]:
+            raise ValueError("You cannot lock an admin user!")
+        if action == 'lock':
+            await async_collection(user_collection).update_one({"_id": ObjectId(id)}, {"$set": {"status": "locked"}})
+        elif action == 'unlock':
+            await async_collection(user_collection).update_one({"_id": ObjectId(id)}, {"$set": {"status": "active"}})
+        identity_cache.invalidate("user", id)
+
+    @staticmethod
+    async def reset_user_password(id: str, new_password: str, confirm_password: str):
+        user = await AsyncUsers.get_user(id)
+        if new_password != confirm_password:
+            raise ValueError("New password and confirm password don't match!")
+        if not validate_password(new_password):
+            raise ValueError("Weak password!")
+        if user["is_admin"]:
+            raise ValueError("You cannot reset an admin user!")
+        hashed = await hash_password_async(new_password)
+        await async_collection(user_collection).update_one({"_id": ObjectId(id)}, {"$set": {"password": hashed}})
+        identity_cache.invalidate("user", id)
+
+    @staticmethod
+    async def delete_room(room_id: str):
+        room = await AsyncRooms.get_room(room_id)
+        if room["is_ai"]:
+            raise ValueError("You cannot delete an AI room!")
+        job_id = await AsyncAdmin.enqueue_deletion("room", room_id)
+        await async_collection(room_collection).update_one({"_id": ObjectId(room_id)}, {"$set": {"deleted_at": datetime.now()}})
+        identity_cache.invalidate("room", room_id, removed=identity_cache.EVERYONE)
+        return job_id
+
+    @staticmethod
+    async def delete_message(message_id: str):
+        messages = async_collection(messages_collection)
+        message = await messages.find_one({"_id": ObjectId(message_id)})
+        if not message:
+            raise ValueError("Message not found!")
+        result = await messages.delete_one({"_id": ObjectId(message_id)})
+        if MAINTAIN_MESSAGE_COUNTS and result.deleted_count and ObjectId.is_valid(message["room_id"]):
+            await async_collection(room_collection).update_one(counted_room(message["room_id"]), {"$inc": {"message_count": -1}})
+
+    @staticmethod
+    async def get_ai_settings():
+        stats = await async_collection(stats_collection).find_one({"_id": ObjectId(STAT_DOC_ID)})
+        stats["_id"] = str(stats["_id"])
+        derive_ai_stats(stats)
+        stats["scheduler"] = ai_scheduler.stats()
+        stats["response_cache"] = ai_response_cache.stats()
+        return stats
+
+    @staticmethod
+    async def get_config():
+        config = config_cache.get(SETTING_DOC_ID)
+        if config is None:
+            config = await async_collection(settings_collection).find_one({"_id": ObjectId(SETTING_DOC_ID)})
+            if not config:
+                raise ValueError("Config not found!")
+            config["_id"] = str(config["_id"])
+            config_cache.set(SETTING_DOC_ID, config)
+        return dict(config)
+
+    @staticmethod
+    async def update_config(updates: dict):
+        result = await async_collection(settings_collection).update_one({"_id": ObjectId(SETTING_DOC_ID)}, {"$set": updates})
+        config_cache.invalidate(SETTING_DOC_ID)
+        if "system_message" in updates:
+            ai_response_cache.clear()
+        if result.matched_count == 0:
+            raise ValueError("Config not found!")
+
+##############################################################
+# Metrics
+##############################################################
+
+CORE_METHOD_SECONDS = registry.histogram("core_method_seconds", "Duration of core class methods.", ["method"], FAST_BUCKETS)
+for cls in (Authentication, Users, Rooms, Memberships, Deletions, Admin, AIContexts, AI,
+            AsyncAuthentication, AsyncUsers, AsyncRooms, AsyncMemberships, AsyncAdmin):
+    instrument(cls, CORE_METHOD_SECONDS)
+
+registry.callback("argon2_pool_running", "Password hashes running on the argon2 pool.",
+                  lambda: [((), hash_pool.stats()["running"])])
+registry.callback("argon2_pool_queue_depth", "Password hashes waiting for the argon2 pool.",
+                  lambda: [((), hash_pool.stats()["queued"])])
+registry.callback("argon2_pool_rejected_total", "Password hashes shed because the argon2 queue was full.",
+                  lambda: [((), hash_pool.stats()["rejected"])], type="counter")
+registry.callback("message_writer_queue_depth", "Chat messages waiting to be written.",
+                  lambda: [((), message_writer.stats()["queued"])])
+registry.callback("message_writer_dropped_total", "Chat messages dropped after their batch write kept failing.",
+                  lambda: [((), message_writer.dropped)], type="counter")
+registry.callback("ai_scheduler_active", "LLM calls in flight.", lambda: [((), ai_scheduler.stats()["active"])])
+registry.callback("ai_scheduler_queue_depth", "AI prompts waiting for an LLM slot.", lambda: [((), ai_scheduler.stats()["queued"])])
+registry.histogram("ai_scheduler_wait_seconds", "Time AI prompts waited for an LLM slot.").attach(ai_scheduler.wait_times)
+registry.histogram("ai_scheduler_service_seconds", "Time AI replies held an LLM slot.").attach(ai_scheduler.service_times)
@@ -0,0 +1,50 @@
+"""
+OpenAI-compatible chat completions server that streams a canned reply, for
+load-testing the AI room without calling a real model.
+
+    uvicorn fake_llm_server:app --port 8001
+
+then point llm_url at openai+http://localhost:8001/v1#fake. FAKE_LLM_FIRST_TOKEN
+and FAKE_LLM_TOKEN_DELAY (seconds) shape the latency.
+"""
+import asyncio
+import json
+import os
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+FIRST_TOKEN_DELAY = float(os.environ.get("FAKE_LLM_FIRST_TOKEN", 0.3))
+TOKEN_DELAY = float(os.environ.get("FAKE_LLM_TOKEN_DELAY", 0.02))
+REPLY = "This is a canned answer from the fake model, streamed one word at a time."
+
+app = FastAPI()
+
+
+def chunk(model, content=None, finish_reason=None):
+    delta = {"content": content} if content is not None else {}
+    return "data: " + json.dumps({
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }) + "\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    words = REPLY.split(" ")[:body.get("max_tokens") or None]
+
+    async def stream():
+        await asyncio.sleep(FIRST_TOKEN_DELAY)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(TOKEN_DELAY)
+            yield chunk(model, word if i == 0 else " " + word)
+        yield chunk(model, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
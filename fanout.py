@@ -0,0 +1,102 @@
+from collections import Counter
+from time import perf_counter
+import asyncio
+from histogram import Histogram, FAST_BUCKETS
+
+
+class RoomBroadcaster:
+    """
+    Room broadcasts with optional coalescing and slow-consumer protection.
+
+    Payloads always go out on `event` as a list, which is what the chat
+    panel expects. With `window` > 0, payloads published to a room within
+    `window` seconds (or until `max_batch` accumulate) share one list, so
+    the packet is encoded once per batch instead of once per message.
+    Before each send, sockets whose outbound queue already holds
+    `max_queue` packets are skipped for that send; after `max_strikes`
+    consecutive skips they are disconnected.
+
+    Per-room message and send counts are kept for at most `max_rooms`
+    rooms; a new room past that replaces the least busy one.
+    """
+
+    def __init__(self, sio, window: float = 0.0, max_batch: int = 50, max_queue: int = 100,
+                 max_strikes: int = 3, event: str = "message", max_rooms: int = 1000):
+        self.sio = sio
+        self.window = window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.max_strikes = max_strikes
+        self.event = event
+        self.max_rooms = max_rooms
+        self._pending = {}
+        self._timers = {}
+        self._strikes = {}
+        self.sends = 0
+        self.messages = 0
+        self.skipped = 0
+        self.disconnected = 0
+        self.room_messages = Counter()
+        self.room_sends = Counter()
+        self.send_times = Histogram(FAST_BUCKETS)
+
+    async def publish(self, room, payload):
+        self.messages += 1
+        self._tally(self.room_messages, room)
+        if self.window <= 0:
+            await self._send(room, [payload])
+            return
+        batch = self._pending.setdefault(room, [])
+        batch.append(payload)
+        if len(batch) >= self.max_batch:
+            await self.flush(room)
+        elif room not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[room] = loop.call_later(self.window, lambda: loop.create_task(self.flush(room)))
+
+    async def flush(self, room):
+        timer = self._timers.pop(room, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(room, None)
+        if batch:
+            await self._send(room, batch)
+
+    async def _send(self, room, data):
+        slow = []
+        for sid, eio_sid in list(self.sio.manager.get_participants("/", room)):
+            socket = self.sio.eio.sockets.get(eio_sid)
+            if socket is None or socket.queue.qsize() < self.max_queue:
+                self._strikes.pop(sid, None)
+                continue
+            slow.append(sid)
+            self._strikes[sid] = self._strikes.get(sid, 0) + 1
+            if self._strikes[sid] >= self.max_strikes:
+                self.forget(sid)
+                self.disconnected += 1
+                asyncio.get_running_loop().create_task(self.sio.disconnect(sid))
+        self.skipped += len(slow)
+        self.sends += 1
+        self._tally(self.room_sends, room)
+        start = perf_counter()
+        await self.sio.emit(self.event, data, room=room, skip_sid=slow or None)
+        self.send_times.observe(perf_counter() - start)
+
+    def _tally(self, counts, room):
+        if room not in counts and len(counts) >= self.max_rooms:
+            del counts[min(counts, key=counts.get)]
+        counts[room] += 1
+
+    def forget(self, sid):
+        self._strikes.pop(sid, None)
+
+    def stats(self):
+        return {
+            "window": self.window,
+            "messages": self.messages,
+            "sends": self.sends,
+            "messages_per_send": self.messages / self.sends if self.sends else 0.0,
+            "pending_rooms": len(self._pending),
+            "skipped": self.skipped,
+            "disconnected": self.disconnected,
+        }
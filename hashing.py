@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+import asyncio
+import time
+
+
+class ServiceBusyError(Exception):
+    pass
+
+
+class HashPool:
+    """
+    Bounded worker pool for argon2 work. argon2-cffi releases the GIL while
+    hashing, so threads run in parallel; `max_workers` caps CPU and memory
+    (one memory_cost block per worker) and `max_queue` caps how many callers
+    may wait before new work is rejected with ServiceBusyError.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 32):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="argon2")
+        self._slots = BoundedSemaphore(max_workers + max_queue)
+        self._lock = Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._service_total = 0.0
+        self._service_max = 0.0
+
+    def submit(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise ServiceBusyError("Server is busy, please try again later.")
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._executor.submit(self._timed, time.perf_counter(), func, *args)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+        # Also runs when the job is cancelled before it starts (the awaiting
+        # coroutine was cancelled), which _timed would never see
+        future.add_done_callback(self._done)
+        return future
+
+    def run(self, func, *args):
+        return self.submit(func, *args).result()
+
+    async def run_async(self, func, *args):
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def _timed(self, queued_at, func, *args):
+        started_at = time.perf_counter()
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        try:
+            return func(*args)
+        finally:
+            finished_at = time.perf_counter()
+            service = finished_at - started_at
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._wait_total += started_at - queued_at
+                self._service_total += service
+                self._service_max = max(self._service_max, service)
+
+    def _done(self, future):
+        if future.cancelled():
+            with self._lock:
+                self._pending -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            done = self._completed
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending,
+                "completed": done,
+                "rejected": self._rejected,
+                "average_wait_time": self._wait_total / done if done else 0.0,
+                "average_service_time": self._service_total / done if done else 0.0,
+                "max_service_time": self._service_max,
+            }
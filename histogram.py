@@ -0,0 +1,69 @@
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds in seconds, from 5 ms to 2 minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# From 0.5 ms to 10 s, for work that usually takes well under 5 ms:
+# database commands, core methods, HTTP requests and emits
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def bucket_percentile(buckets, counts, q):
+    """
+    Interpolated q-quantile of a histogram with upper bounds `buckets` and
+    `counts` holding one more entry for values above the last bound.
+    """
+    count = sum(counts)
+    if not count:
+        return 0.0
+    rank = q * count
+    seen = 0
+    for i, n in enumerate(counts):
+        if n and seen + n >= rank:
+            low = buckets[i - 1] if i else 0.0
+            high = buckets[i] if i < len(buckets) else buckets[-1]
+            return low + (high - low) * (rank - seen) / n
+        seen += n
+    return buckets[-1]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with count, sum and sum of squares. Percentiles
+    are interpolated inside the bucket they fall in.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.sum_squares += value * value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    def percentile(self, q):
+        with self._lock:
+            counts = list(self.counts)
+        return bucket_percentile(self.buckets, counts, q)
+
+    def stats(self):
+        mean = self.sum / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "average": mean,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
+import sys
+from cache import TTLCache
+
+_scope = ContextVar("identity_scope", default=None)
+
+
+def freeze(value):
+    # Lists become tuples and nested documents read-only mappings, so a
+    # cached document can be handed out with a shallow copy of its top level
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def doc_size(value):
+    """Approximate memory held by a document, in bytes."""
+    if isinstance(value, MappingProxyType):
+        value = value.copy()
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(doc_size(k) + doc_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(doc_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+# Process-wide LRU+TTL caches shared by all requests, keyed by document id
+# and bounded by the total size of the documents they hold. Writers
+# invalidate their entries; the TTL bounds staleness for writes made by
+# other workers.
+shared = {
+    "user": TTLCache(maxsize=None, ttl=30, maxweight=16 * 1024 * 1024, weigh=doc_size),
+    "room": TTLCache(maxsize=None, ttl=30, maxweight=64 * 1024 * 1024, weigh=doc_size),
+}
+
+
+class IdentityScope:
+    """
+    Unit of work for one HTTP request or socket event: every user and room
+    document is loaded at most once while the scope is active.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.queries = 0
+        self.hits = 0
+
+
+@contextmanager
+def request_scope():
+    scope = IdentityScope()
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+# Callbacks run as listener(kind, id, removed) after every invalidation.
+# `removed` is the id of a user who lost access to the room being
+# invalidated (left, was kicked or banned), EVERYONE when the room itself is
+# gone, and None for any other change.
+listeners = []
+EVERYONE = "*"
+
+
+def subscribe(listener):
+    listeners.append(listener)
+
+
+def configure(kind, max_bytes, ttl):
+    shared[kind] = TTLCache(maxsize=None, ttl=ttl, maxweight=max_bytes, weigh=doc_size)
+
+
+def copy(doc):
+    # Top-level fields may be reassigned by the caller; everything below is
+    # immutable and shared with the cache
+    return dict(doc)
+
+
+def load(kind, id, loader):
+    scope = _scope.get()
+    key = str(id)
+    if scope is not None and (kind, key) in scope.docs:
+        scope.hits += 1
+        return copy(scope.docs[(kind, key)])
+    doc = shared[kind].get(key)
+    if doc is None:
+        if scope is not None:
+            scope.queries += 1
+        doc = freeze(loader())
+        shared[kind].set(key, doc)
+    if scope is not None:
+        scope.docs[(kind, key)] = doc
+    return copy(doc)
+
+
+async def load_async(kind, id, loader):
+    scope = _scope.get()
+    key = str(id)
+    if scope is not None and (kind, key) in scope.docs:
+        scope.hits += 1
+        return copy(scope.docs[(kind, key)])
+    doc = shared[kind].get(key)
+    if doc is None:
+        if scope is not None:
+            scope.queries += 1
+        doc = freeze(await loader())
+        shared[kind].set(key, doc)
+    if scope is not None:
+        scope.docs[(kind, key)] = doc
+    return copy(doc)
+
+
+def invalidate(kind, id, removed=None):
+    key = str(id)
+    shared[kind].invalidate(key)
+    scope = _scope.get()
+    if scope is not None:
+        scope.docs.pop((kind, key), None)
+    for listener in listeners:
+        listener(kind, key, removed)
+
+
+def stats():
+    return {kind: cache.stats() for kind, cache in shared.items()}
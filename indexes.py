@@ -0,0 +1,94 @@
+"""
+Index bootstrap and query-plan checks.
+
+Each collection's indexes are declared as (keys, options) pairs. ensure()
+creates the missing ones and leaves existing ones alone, so it is safe to
+run on every startup. verify() explains query shapes and reports every
+shape whose winning plan is a collection scan.
+"""
+import logging
+from pymongo.errors import OperationFailure
+
+log = logging.getLogger(__name__)
+
+# Server error codes for an index that can't be built as declared: same
+# name or keys with other options, or duplicates under a unique index.
+INDEX_CONFLICT_CODES = {85, 86, 11000}
+
+
+def index_name(keys):
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def ensure(collection, specs):
+    """
+    Create every (keys, options) index in `specs` that `collection` lacks.
+    Indexes that conflict with existing ones or with the data are logged and
+    skipped rather than failing startup; returns their names.
+    """
+    existing = {index["name"] for index in collection.list_indexes()}
+    skipped = []
+    for keys, options in specs:
+        name = options.get("name") or index_name(keys)
+        if name in existing:
+            continue
+        try:
+            collection.create_index(keys, name=name, **{k: v for k, v in options.items() if k != "name"})
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+            log.warning("Skipped index %s on %s: %s", name, collection.name, e)
+            skipped.append(name)
+    return skipped
+
+
+def winning_plans(explain):
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from winning_plans(value)
+
+
+def plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+
+def explain(collection, command):
+    """
+    Explain a find or aggregate command given without its collection name,
+    e.g. {"find": {"room_id": "..."}, "sort": {...}} or {"aggregate": [...]}.
+    """
+    command = dict(command)
+    if "aggregate" in command:
+        body = {"aggregate": collection.name, "pipeline": command.pop("aggregate"), "cursor": {}}
+    else:
+        body = {"find": collection.name, "filter": command.pop("find")}
+    body.update(command)
+    return collection.database.command("explain", body, verbosity="queryPlanner")
+
+
+def verify(shapes):
+    """
+    Explain each (label, collection, command) shape and return the labels
+    of those whose winning plan contains a COLLSCAN stage.
+    """
+    failures = []
+    for label, collection, command in shapes:
+        result = explain(collection, command)
+        for plan in winning_plans(result):
+            if "COLLSCAN" in plan_stages(plan):
+                failures.append(label)
+                break
+    return failures
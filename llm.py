@@ -0,0 +1,77 @@
+import asyncio
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+
+class FakeStreamingModel:
+    """
+    Local stand-in for the LLM. Streams `reply` (or an echo of the last
+    message) word by word, waiting `first_token_delay` before the first word
+    and `token_delay` between the others.
+    """
+
+    def __init__(self, reply=None, first_token_delay: float = 0.2, token_delay: float = 0.02):
+        self.reply = reply
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    async def stream(self, messages, temperature, max_tokens):
+        await asyncio.sleep(self.first_token_delay)
+        text = self.reply or f"You said: {messages[-1]['content']}"
+        for i, word in enumerate(text.split(" ")[:max_tokens]):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+
+class OpenAIStreamingModel:
+    """
+    Chat completions streamed from the OpenAI API, or any server speaking
+    the same protocol when `base_url` is given. Without `api_key` the
+    client reads OPENAI_API_KEY.
+    """
+
+    def __init__(self, model, base_url=None, api_key=None):
+        if openai is None:
+            raise RuntimeError("The openai package is required for the AI room.")
+        self.model = model
+        try:
+            self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
+        except openai.OpenAIError:
+            raise ValueError("The AI is not configured!")
+
+    async def stream(self, messages, temperature, max_tokens):
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except openai.OpenAIError:
+            raise ValueError("The AI failed to answer, please try again!")
+
+
+def create_model(url, api_key=None):
+    """
+    Build the streaming model for `url`: fake:// for the local fake model,
+    openai://<model> for the OpenAI API, or openai+http(s)://<host>/<path>#<model>
+    for an OpenAI-compatible server. Returns None when no URL is configured.
+    """
+    if not url:
+        return None
+    if url.startswith("fake://"):
+        return FakeStreamingModel(reply=url[len("fake://"):] or None)
+    if url.startswith("openai://"):
+        return OpenAIStreamingModel(url[len("openai://"):], api_key=api_key)
+    if url.startswith(("openai+http://", "openai+https://")):
+        base_url, _, model = url[len("openai+"):].partition("#")
+        return OpenAIStreamingModel(model, base_url=base_url, api_key=api_key)
+    raise ValueError("Unsupported LLM URL!")
@@ -0,0 +1,118 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import asyncio
+import time
+from histogram import Histogram
+
+
+class QueueFullError(Exception):
+    def __init__(self):
+        super().__init__("The AI is busy right now, please try again later!")
+
+
+class LLMScheduler:
+    """
+    Admission control for LLM calls. At most `max_concurrency` calls run at
+    once; the rest wait in per-user queues that are served round robin, so
+    one user's burst can't starve everyone else. Requests are rejected up
+    front once `max_queue` are waiting overall or `max_per_user` for one
+    user. A request waiting longer than `queue_timeout`, or running longer
+    than `timeout`, fails with TimeoutError.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 100, max_per_user: int = 2,
+                 queue_timeout: float = 30, timeout: float = 120):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._active = 0
+        self.wait_times = Histogram()
+        self.service_times = Histogram()
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+
+    @asynccontextmanager
+    async def slot(self, user):
+        queue = self._queues.get(user)
+        if self._queued >= self.max_queue or (queue is not None and len(queue) >= self.max_per_user):
+            self.rejected += 1
+            raise QueueFullError()
+        turn = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(turn)
+        self._queued += 1
+        self._dispatch()
+
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(turn), self.queue_timeout)
+        except BaseException as e:
+            if turn.done() and not turn.cancelled():
+                # Granted just as we gave up: hand the slot on
+                self._release()
+            else:
+                turn.cancel()
+                self._dequeue(user, turn)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+            elif isinstance(e, asyncio.CancelledError):
+                self.cancelled += 1
+            raise
+        started_at = time.monotonic()
+        self.wait_times.observe(started_at - queued_at)
+        try:
+            async with asyncio.timeout(self.timeout):
+                yield
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.service_times.observe(time.monotonic() - started_at)
+            self._release()
+
+    def _dequeue(self, user, turn):
+        queue = self._queues.get(user)
+        if queue is not None and turn in queue:
+            queue.remove(turn)
+            self._queued -= 1
+            if not queue:
+                del self._queues[user]
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency and self._queues:
+            user, queue = next(iter(self._queues.items()))
+            turn = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if turn.cancelled():
+                continue
+            self._active += 1
+            turn.set_result(None)
+
+    def stats(self):
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "queued_users": len(self._queues),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "queue_wait": self.wait_times.stats(),
+            "service_time": self.service_times.stats(),
+        }
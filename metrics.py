@@ -0,0 +1,190 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Families are created on `registry` and rendered by /admin/metrics. Each
+worker reports its own numbers, so scrape every worker (or sum them).
+Callback families are read at scrape time, which keeps gauges such as queue
+depths free on the hot path.
+"""
+from threading import Lock
+from time import perf_counter
+import functools
+import inspect
+from pymongo import monitoring
+from histogram import DEFAULT_BUCKETS, FAST_BUCKETS, Histogram
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_bound(bound):
+    return repr(float(bound))
+
+
+class CounterFamily:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, *values, n=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + n
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{format_labels(self.label_names, labels)} {value}" for labels, value in values]
+
+
+class HistogramFamily:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._children = {}
+        self._lock = Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, Histogram(self.buckets))
+        return child
+
+    def observe(self, value, *values):
+        self.labels(*values).observe(value)
+
+    def attach(self, histogram, *values):
+        # Export a histogram some other component already keeps
+        self._children[values] = histogram
+
+    def render(self):
+        lines = []
+        for labels, histogram in list(self._children.items()):
+            counts, count, total = histogram.snapshot()
+            cumulative = 0
+            for bound, n in zip(histogram.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, [('le', format_bound(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class CallbackFamily:
+    """
+    Values computed at scrape time: `collect()` returns (label values,
+    value) pairs.
+    """
+
+    def __init__(self, name, help, collect, labels=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.label_names = tuple(labels)
+        self.type = type
+
+    def render(self):
+        return [f"{self.name}{format_labels(self.label_names, labels)} {value}" for labels, value in self.collect()]
+
+
+class Registry:
+
+    def __init__(self):
+        self.families = {}
+
+    def _add(self, family):
+        if family.name in self.families:
+            raise ValueError(f"Metric {family.name} is already registered!")
+        self.families[family.name] = family
+        return family
+
+    def counter(self, name, help, labels=()):
+        return self._add(CounterFamily(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(HistogramFamily(name, help, labels, buckets))
+
+    def callback(self, name, help, collect, labels=(), type="gauge"):
+        return self._add(CallbackFamily(name, help, collect, labels, type))
+
+    def render(self):
+        lines = []
+        for family in list(self.families.values()):
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def timed(func, family, *labels):
+    # The child is looked up per call, so it only exists (and is rendered)
+    # once the function has run
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                family.observe(perf_counter() - start, *labels)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            family.observe(perf_counter() - start, *labels)
+    return wrapper
+
+
+def instrument(cls, family):
+    """
+    Time every static method of `cls` into `family`, labelled
+    "<Class>.<method>"; methods that never ran are not rendered. Async
+    generators are left alone since their duration is up to the consumer.
+    """
+    for name, attr in list(vars(cls).items()):
+        if not isinstance(attr, staticmethod) or inspect.isasyncgenfunction(attr.__func__):
+            continue
+        setattr(cls, name, staticmethod(timed(attr.__func__, family, f"{cls.__name__}.{name}")))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Duration of every MongoDB command by command name and outcome."""
+
+    def __init__(self, family):
+        self.family = family
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.family.observe(event.duration_micros / 1e6, event.command_name, "ok")
+
+    def failed(self, event):
+        self.family.observe(event.duration_micros / 1e6, event.command_name, "error")
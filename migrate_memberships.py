@@ -0,0 +1,15 @@
+"""
+Copy embedded room members/banned arrays into the membership collection.
+
+    python migrate_memberships.py              # copy, keep the arrays
+    python migrate_memberships.py --drop-arrays
+
+Turn on MEMBERSHIP_COLLECTION once the copy has run; only drop the arrays
+after every worker reads from the membership collection.
+"""
+import sys
+from mongo_test import Memberships
+
+if __name__ == "__main__":
+    migrated = Memberships.migrate(drop_arrays="--drop-arrays" in sys.argv)
+    print(f"Migrated memberships for {migrated} rooms.")
@@ -0,0 +1,68 @@
+import asyncio
+import pickle
+import socketio
+# Not re-exported at the package top level
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+
+class LoopbackBroker:
+    """
+    In-process stand-in for Redis/AMQP pub/sub. Every subscriber of a
+    channel gets its own queue, so several AsyncServer instances in one
+    process behave like separate nodes sharing a broker.
+    """
+
+    def __init__(self):
+        self.channels = {}
+
+    def subscribe(self, channel):
+        queue = asyncio.Queue()
+        self.channels.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        self.channels.get(channel, set()).discard(queue)
+
+    async def publish(self, channel, data):
+        for queue in list(self.channels.get(channel, ())):
+            queue.put_nowait(data)
+
+
+broker = LoopbackBroker()
+
+
+class AsyncLoopbackManager(AsyncPubSubManager):
+    name = "loopback"
+
+    def __init__(self, channel="socketio", write_only=False, logger=None, broker=broker):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker = broker
+
+    async def _publish(self, data):
+        # Pickle like the Redis manager does so nodes never share objects
+        await self.broker.publish(self.channel, pickle.dumps(data))
+
+    async def _listen(self):
+        queue = self.broker.subscribe(self.channel)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.broker.unsubscribe(self.channel, queue)
+
+
+def create_manager(url):
+    """
+    Build the Socket.IO client manager for `url`:
+    loopback://<channel>, redis:// or rediss://, amqp:// or amqps://.
+    Returns None (single-process manager) when no URL is configured.
+    """
+    if not url:
+        return None
+    if url.startswith("loopback://"):
+        return AsyncLoopbackManager(channel=url[len("loopback://"):] or "socketio")
+    if url.startswith(("redis://", "rediss://")):
+        return socketio.AsyncRedisManager(url)
+    if url.startswith(("amqp://", "amqps://")):
+        return socketio.AsyncAioPikaManager(url)
+    raise ValueError("Unsupported Socket.IO manager URL!")
@@ -0,0 +1,205 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+import functools
+import ipaddress
+import time
+from fastapi import HTTPException, Request, status
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    name: str
+    rate: float   # tokens refilled per second
+    burst: int    # bucket capacity
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, limit: RateLimit, retry_after: float):
+        super().__init__("Too many requests, please slow down!")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class MemoryStore:
+    """
+    Per-process token buckets. A bucket that has been idle long enough to
+    refill completely is the same as no bucket, so buckets are kept in
+    least-recently-used order in one OrderedDict per (rate, burst): every
+    bucket in it expires the same time after its last use, and sweeping
+    only pops expired entries off the front.
+    """
+
+    def __init__(self):
+        self._limits = {}
+        self._lock = Lock()
+
+    async def take(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            buckets = self._limits.setdefault((rate, burst), OrderedDict())
+            tokens, updated_at = buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            buckets[key] = (tokens, now)
+            return allowed, tokens
+
+    def _sweep(self, now):
+        for (rate, burst), buckets in self._limits.items():
+            idle = burst / rate
+            while buckets:
+                _, (_, updated_at) = next(iter(buckets.items()))
+                if now - updated_at < idle:
+                    break
+                buckets.popitem(last=False)
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self._limits.values())
+
+
+class RedisStore:
+    """
+    Token buckets shared by every worker, updated atomically by a Lua script.
+    """
+
+    SCRIPT = """
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url, prefix="ratelimit:"):
+        if aioredis is None:
+            raise RuntimeError("The redis package is required for a shared rate limit store.")
+        self.client = aioredis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    async def take(self, key, rate, burst, cost=1):
+        allowed, tokens = await self._script(keys=[self.prefix + key], args=[rate, burst, time.time(), cost])
+        return bool(allowed), float(tokens)
+
+
+def create_store(url):
+    if not url:
+        return MemoryStore()
+    if url.startswith(("redis://", "rediss://")):
+        return RedisStore(url)
+    raise ValueError("Unsupported rate limit store URL!")
+
+
+class RateLimiter:
+
+    def __init__(self, store=None, trusted_proxies=()):
+        # An empty MemoryStore is falsy (__len__)
+        self.store = store if store is not None else MemoryStore()
+        self.trusted_proxies = trusted_proxies
+        self.allowed = {}
+        self.rejected = {}
+
+    async def hit(self, limit: RateLimit, key: str, cost: int = 1):
+        allowed, tokens = await self.store.take(f"{limit.name}:{key}", limit.rate, limit.burst, cost)
+        if allowed:
+            self.allowed[limit.name] = self.allowed.get(limit.name, 0) + 1
+            return
+        self.rejected[limit.name] = self.rejected.get(limit.name, 0) + 1
+        raise RateLimitExceeded(limit, (cost - tokens) / limit.rate)
+
+    def stats(self):
+        return {
+            name: {
+                "allowed": self.allowed.get(name, 0),
+                "rejected": self.rejected.get(name, 0),
+            }
+            for name in set(self.allowed) | set(self.rejected)
+        }
+
+
+limiter = RateLimiter()
+
+
+def proxy_networks(proxies):
+    """Parse trusted proxy addresses or CIDR ranges."""
+    try:
+        return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies or ())
+    except ValueError:
+        raise ValueError("Invalid trusted proxy address!")
+
+
+def is_trusted(address, networks):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_ip(request: Request, trusted_proxies=()):
+    """
+    The peer address, unless the peer is one of `trusted_proxies`. Then the
+    X-Forwarded-For hops are read from the right, skipping trusted proxies,
+    so a client can't pick its own address by sending the header itself.
+    """
+    host = request.client.host if request.client else "unknown"
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or not is_trusted(host, trusted_proxies):
+        return host
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted(hop, trusted_proxies):
+            return hop
+    return hops[0] if hops else host
+
+
+def rate_limit(*limits: RateLimit):
+    """
+    FastAPI dependency applying `limits` per client IP; rejects with 429.
+    """
+    async def dependency(request: Request):
+        ip = client_ip(request, limiter.trusted_proxies)
+        try:
+            for limit in limits:
+                await limiter.hit(limit, ip)
+        except RateLimitExceeded as e:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(e),
+                headers={"Retry-After": str(max(1, int(e.retry_after + 0.999)))},
+            )
+    return dependency
+
+
+def limit_event(limit: RateLimit, key, on_reject):
+    """
+    Socket.IO handler decorator. `key(sid, data)` is awaited to get the
+    bucket key; `on_reject(sid, error)` is awaited instead of the handler
+    when the bucket is empty.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(sid, *args):
+            try:
+                await limiter.hit(limit, await key(sid, *args))
+            except RateLimitExceeded as e:
+                return await on_reject(sid, e)
+            return await handler(sid, *args)
+        return wrapper
+    return decorator
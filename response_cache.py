@@ -0,0 +1,134 @@
+from collections import Counter, OrderedDict
+from threading import Lock
+import math
+import re
+import time
+
+# Numbers (with decimals), words and arithmetic operators; other
+# punctuation is dropped so "Hello there!" and "hello there" share a key
+_TOKEN = re.compile(r"\d+(?:\.\d+)*|[a-z0-9']+|[-+*/=<>%^()]")
+
+# Words a similar prompt may add, drop or reorder
+STOPWORDS = frozenset("""
+    a an the is are was were be am do does did what whats what's who whos who's
+    how hows how's which when where why can could would should will please
+    i me my you your yours it its it's this that of to in on for and or
+    tell give
+""".split())
+
+
+def normalize_prompt(prompt):
+    return " ".join(_TOKEN.findall(prompt.lower()))
+
+
+def signature(normalized):
+    """
+    The numbers, operators and content words of a normalized prompt, in
+    order; a similar prompt only reuses a reply when these match exactly.
+    """
+    return tuple(token for token in normalized.split() if token not in STOPWORDS)
+
+
+def trigram_vector(text):
+    """
+    Sparse, L2-normalized character-trigram counts: a local embedding that
+    scores small rewordings ("what is your name" / "whats your name") above
+    0.8 without calling an embedding model.
+    """
+    padded = f"  {text} "
+    counts = Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+    norm = math.sqrt(sum(n * n for n in counts.values())) or 1.0
+    return {gram: n / norm for gram, n in counts.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+
+
+class ResponseCache:
+    """
+    LRU+TTL cache of AI replies. Entries are scoped (system message and
+    generation settings) and looked up first by exact normalized prompt,
+    then by similarity: candidates with the same signature(), found through
+    an index on it, are compared with `embed` vectors and the closest one at
+    or above `threshold` wins.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 3600, threshold: float = 0.8, embed=trigram_vector):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.embed = embed
+        self._entries = OrderedDict()
+        self._signatures = {}
+        self._lock = Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def get(self, prompt, scope):
+        normalized = normalize_prompt(prompt)
+        now = time.monotonic()
+        with self._lock:
+            key = (scope, normalized)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[2]
+            if entry is not None:
+                self._remove(key)
+            best, best_score = None, self.threshold
+            vector = self.embed(normalized)
+            for candidate in self._signatures.get((scope, signature(normalized)), ()):
+                expires_at, candidate_vector, reply = self._entries[candidate]
+                if expires_at <= now:
+                    continue
+                score = cosine(vector, candidate_vector)
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.similar_hits += 1
+            return self._entries[best][2]
+
+    def set(self, prompt, scope, reply):
+        normalized = normalize_prompt(prompt)
+        key = (scope, normalized)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, self.embed(normalized), reply)
+            self._signatures.setdefault((scope, signature(normalized)), set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._signatures.clear()
+
+    def _remove(self, key):
+        if self._entries.pop(key, None) is None:
+            return
+        scope, normalized = key
+        index = (scope, signature(normalized))
+        keys = self._signatures.get(index)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._signatures[index]
+
+    def stats(self):
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+        }
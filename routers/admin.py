@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Body
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import BaseModel
 from typing import Optional, Union
-from mongo_test import Rooms, Users, Admin
+from mongo_test import Rooms, Users, Admin, ServiceBusyError
+from ratelimit import limiter
+from metrics import registry, CONTENT_TYPE
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
@@ -67,11 +69,12 @@ def get_users(
     search: str = "",
     sort_by: str = "created_at",
     sort_order: str = "desc",
+    cursor: Optional[str] = None,
     current_user: str = Depends(get_current_admin)
 ):
     try:
-        users, total = Admin.get_all_users(pagination, limit, search, sort_by, sort_order)
-        return {"message": "Users retrieved successfully!", "users": users, "total": total}
+        users, total, next_cursor = Admin.get_all_users(pagination, limit, search, sort_by, sort_order, cursor)
+        return {"message": "Users retrieved successfully!", "users": users, "total": total, "next_cursor": next_cursor}
         pass
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
@@ -93,8 +96,8 @@ def delete_user(
     current_user: str = Depends(get_current_admin)
 ):
     try:
-        Admin.delete_user(user_id)
-        return {"message": "User deleted successfully!"}
+        job_id = Admin.delete_user(user_id)
+        return {"message": "User deleted successfully!", "job_id": job_id}
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
     
@@ -123,6 +126,8 @@ def reset_user_password(
         return {"message": "User password reset successfully!"}
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
+    except ServiceBusyError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
 
 ##################################################
 
@@ -133,11 +138,12 @@ def get_rooms(
     search: str = "",
     sort_by: str = "created_at",
     sort_order: str = "members_count",
+    cursor: Optional[str] = None,
     current_user: str = Depends(get_current_admin)
 ):
     try:
-        rooms, total = Admin.get_all_rooms(pagination, limit, search, sort_by, sort_order)
-        return {"message": "Rooms retrieved successfully!", "rooms": rooms, "total": total}
+        rooms, total, next_cursor = Admin.get_all_rooms(pagination, limit, search, sort_by, sort_order, cursor)
+        return {"message": "Rooms retrieved successfully!", "rooms": rooms, "total": total, "next_cursor": next_cursor}
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
     
@@ -159,8 +165,8 @@ def delete_room(
     current_user: str = Depends(get_current_admin)
 ):
     try:
-        Admin.delete_room(room_id)
-        return {"message": "Room deleted successfully!"}
+        job_id = Admin.delete_room(room_id)
+        return {"message": "Room deleted successfully!", "job_id": job_id}
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
 
@@ -173,14 +179,22 @@ def get_messages(
     search: str = "",
     sort_by: str = "created_at",
     sort_order: str = "desc",
+    cursor: Optional[str] = None,
     current_user: str = Depends(get_current_admin)
 ):
     try:
-        messages, total = Admin.get_all_messages(pagination, limit, search, sort_by, sort_order)
-        return {"message": "Messages retrieved successfully!", "messages": messages, "total": total}
+        messages, total, next_cursor = Admin.get_all_messages(pagination, limit, search, sort_by, sort_order, cursor)
+        return {"message": "Messages retrieved successfully!", "messages": messages, "total": total, "next_cursor": next_cursor}
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
 
+@router.get("/messages/writer")
+def get_message_writer_stats(
+    current_user: str = Depends(get_current_admin)
+):
+    stats = Admin.get_message_writer_stats()
+    return {"message": "Message writer stats retrieved successfully!", "stats": stats}
+
 @router.delete("/message/{message_id}")
 def delete_message(
     message_id: str,
@@ -227,6 +241,64 @@ def get_config(
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
 
+@router.get("/hashing")
+def get_hashing_stats(
+    current_user: str = Depends(get_current_admin)
+):
+    stats = Admin.get_hash_pool_stats()
+    return {"message": "Password hashing stats retrieved successfully!", "stats": stats}
+
+@router.get("/ratelimits")
+def get_rate_limit_stats(
+    current_user: str = Depends(get_current_admin)
+):
+    return {"message": "Rate limit stats retrieved successfully!", "stats": limiter.stats()}
+
+@router.get("/deletions")
+def get_deletion_jobs(
+    state: Optional[str] = None,
+    limit: int = 20,
+    current_user: str = Depends(get_current_admin)
+):
+    jobs = Admin.get_deletion_jobs(state, limit)
+    return {"message": "Deletion jobs retrieved successfully!", "jobs": jobs}
+
+@router.get("/deletions/{job_id}")
+def get_deletion_job(
+    job_id: str,
+    current_user: str = Depends(get_current_admin)
+):
+    try:
+        job = Admin.get_deletion_job(job_id)
+        return {"message": "Deletion job retrieved successfully!", "job": job}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+@router.post("/deletions/{job_id}/retry")
+def retry_deletion_job(
+    job_id: str,
+    current_user: str = Depends(get_current_admin)
+):
+    try:
+        Admin.retry_deletion_job(job_id)
+        return {"message": "Deletion job queued for retry!"}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+@router.get("/metrics")
+async def get_metrics(
+    current_user: str = Depends(get_current_admin)
+):
+    # Rendered on the event loop so socket and broadcast counters aren't read mid-update
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+@router.get("/cache")
+def get_cache_stats(
+    current_user: str = Depends(get_current_admin)
+):
+    stats = Admin.get_cache_stats()
+    return {"message": "Cache stats retrieved successfully!", "stats": stats}
+
 @router.put("/config")
 def put_config(
     updates: dict = Body(...),
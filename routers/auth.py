@@ -1,11 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional
-from mongo_test import Authentication
+from mongo_test import AsyncAuthentication, ServiceBusyError
+from ratelimit import RateLimit, rate_limit
 
 router = APIRouter()
 
+# Per client IP; both endpoints run argon2
+LOGIN_LIMIT = RateLimit("login", rate=10 / 60, burst=10)
+REGISTER_LIMIT = RateLimit("register", rate=5 / 3600, burst=5)
+
 class RegisterRequest(BaseModel):
     email: Optional[str] = None
     username: Optional[str] = None
@@ -18,18 +23,22 @@ class LoginRequest(BaseModel):
     email: str
     password: str
 
-@router.post("/register")
-def register(req: RegisterRequest):
+@router.post("/register", dependencies=[Depends(rate_limit(REGISTER_LIMIT))])
+async def register(req: RegisterRequest):
     try:
-        token = Authentication.register(req.email, req.username, req.password)
+        token = await AsyncAuthentication.register(req.email, req.username, req.password)
         return {"access_token": token}
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
+    except ServiceBusyError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
 
-@router.post("/login")
-def login(req: LoginRequest):
+@router.post("/login", dependencies=[Depends(rate_limit(LOGIN_LIMIT))])
+async def login(req: LoginRequest):
     try:
-        token = Authentication.login(req.email, req.password)
+        token = await AsyncAuthentication.login(req.email, req.password)
         return {"access_token": token}
     except ValueError as e:
-        return JSONResponse(status_code=400, content={"error": str(e)})
\ No newline at end of file
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except ServiceBusyError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
\ No newline at end of file
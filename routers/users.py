@@ -4,7 +4,7 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from jose import jwt, JWTError
 from pydantic import BaseModel
 from typing import Optional
-from mongo_test import Rooms, Users, Admin
+from mongo_test import AsyncRooms, AsyncUsers, Admin, ServiceBusyError
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
@@ -34,20 +34,22 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
 
 @router.get("")
-def get_user(current_user: str = Depends(get_current_user)):
+async def get_user(current_user: str = Depends(get_current_user)):
     try:
-        user = Users.get_user(current_user)
+        user = await AsyncUsers.get_user(current_user)
         return {"message": "User retrieved successfully", "user": user}
     except ValueError as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
     
 @router.put("/")
-def put_user(
+async def put_user(
     req: UpdateUserRequest,
     current_user: str = Depends(get_current_user)
 ):
     try:
-        Users.update_user(current_user, req.email, req.old_password, req.new_password, req.pfp)
+        await AsyncUsers.update_user(current_user, req.email, req.old_password, req.new_password, req.pfp)
         return {"message": "User updated successfully"}
     except ValueError as e:
-        return JSONResponse(status_code=400, content={"error": str(e)})
\ No newline at end of file
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except ServiceBusyError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
\ No newline at end of file
@@ -1,26 +1,131 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 import socketio
 import datetime
 from bson import ObjectId
 import asyncio
+import functools
 
 from routers import auth, users, rooms, admin
-from mongo_test import Users, Rooms, AI, Admin, get_ai_status
+from mongo_test import Users, Rooms, AI, Admin, AsyncUsers, AsyncRooms, get_ai_status_async, get_secret_key_async, get_socketio_manager_url, get_rate_limit_url, get_trusted_proxies, message_writer, ensure_indexes, Deletions, ai_scheduler, QueueFullError
 from jose import jwt, JWTError
 from asyncio import Lock
 from time import time
 import random
 from fastapi.staticfiles import StaticFiles  # Import StaticFiles
+import identity_cache
+from identity_cache import request_scope
+from pubsub import create_manager
+from ratelimit import RateLimit, RateLimitExceeded, limiter, limit_event, create_store, proxy_networks
+from fanout import RoomBroadcaster
+from metrics import registry, FAST_BUCKETS
+from time import perf_counter
+import logging
 
+log = logging.getLogger(__name__)
+
+# Same limit as the chat panel's input
+MAX_MESSAGE_LENGTH = 1500
+
+# Invalidations only reach the worker that made the write, so every
+# SESSION_REVALIDATE_INTERVAL seconds all local sessions are checked again:
+# users locked or deleted through another worker are disconnected, and
+# sockets that lost access to a room leave it.
+SESSION_REVALIDATE_INTERVAL = 15
+
+# Room messages are broadcast on "message" as a list. Set BROADCAST_WINDOW
+# (seconds) above zero to coalesce each room's messages into one list per
+# window. Sockets with SOCKET_MAX_QUEUE packets still unsent are skipped,
+# and disconnected after SLOW_CONSUMER_STRIKES skips.
+BROADCAST_WINDOW = 0
+BROADCAST_MAX_BATCH = 50
+SOCKET_MAX_QUEUE = 100
+SLOW_CONSUMER_STRIKES = 3
+
+# Socket event buckets: per user for joins and messages, per room for messages
+JOIN_LIMIT = RateLimit("join", rate=2, burst=5)
+MESSAGE_USER_LIMIT = RateLimit("message_user", rate=1, burst=5)
+MESSAGE_ROOM_LIMIT = RateLimit("message_room", rate=20, burst=50)
+
+# Per-room emit counters are exported for the METRICS_TOP_ROOMS busiest
+# rooms only, to keep the number of series bounded.
+METRICS_TOP_ROOMS = 20
+
+# AI replies being streamed, by socket id, so they stop on disconnect
+ai_replies = {}
+
+# Adds X-Identity-Queries / X-Identity-Hits headers to every response
+DEBUG_QUERY_COUNTS = False
+
+# Broadcasts go through a pub/sub manager (redis://, amqp://, loopback://)
+# when socketio_manager_url is configured, so rooms span every worker.
 sio = socketio.AsyncServer(
     async_mode="asgi",
+    client_manager=create_manager(get_socketio_manager_url()),
     cors_allowed_origins="*",
     cors_credentials=True,
 )
 socket_app = socketio.ASGIApp(sio, socketio_path="/ws/socket.io")
+broadcaster = RoomBroadcaster(
+    sio,
+    window=BROADCAST_WINDOW,
+    max_batch=BROADCAST_MAX_BATCH,
+    max_queue=SOCKET_MAX_QUEUE,
+    max_strikes=SLOW_CONSUMER_STRIKES,
+)
 
 app = FastAPI()
 
+HTTP_REQUEST_SECONDS = registry.histogram("http_request_seconds", "HTTP request duration by route.", ["method", "route", "status"], FAST_BUCKETS)
+registry.callback("socketio_connected_sockets", "Sockets connected to this worker.",
+                  lambda: [((), sum(len(sids) for sids in user_sids.values()))])
+registry.callback("socketio_room_messages_total", "Messages published per room (busiest rooms).",
+                  lambda: [((room,), n) for room, n in broadcaster.room_messages.most_common(METRICS_TOP_ROOMS)],
+                  labels=["room"], type="counter")
+registry.callback("socketio_room_emits_total", "Room emits per room (busiest rooms).",
+                  lambda: [((room,), n) for room, n in broadcaster.room_sends.most_common(METRICS_TOP_ROOMS)],
+                  labels=["room"], type="counter")
+registry.callback("socketio_skipped_total", "Room emits skipped for slow consumers.",
+                  lambda: [((), broadcaster.skipped)], type="counter")
+registry.callback("socketio_messages_total", "Messages published to rooms.",
+                  lambda: [((), broadcaster.messages)], type="counter")
+registry.callback("socketio_sends_total", "Room emits, one per batch of messages.",
+                  lambda: [((), broadcaster.sends)], type="counter")
+registry.callback("socketio_pending_rooms", "Rooms with messages waiting for their broadcast window.",
+                  lambda: [((), broadcaster.stats()["pending_rooms"])])
+registry.callback("socketio_slow_disconnects_total", "Sockets disconnected as slow consumers.",
+                  lambda: [((), broadcaster.disconnected)], type="counter")
+registry.histogram("socketio_emit_seconds", "Duration of room emits.", buckets=FAST_BUCKETS).attach(broadcaster.send_times)
+
+@app.middleware("http")
+async def route_metrics(request: Request, call_next):
+    start = perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        perf_counter() - start,
+        request.method,
+        route.path if route is not None else "unmatched",
+        str(response.status_code),
+    )
+    return response
+
+@app.middleware("http")
+async def identity_scope(request: Request, call_next):
+    with request_scope() as scope:
+        response = await call_next(request)
+    if DEBUG_QUERY_COUNTS:
+        response.headers["X-Identity-Queries"] = str(scope.queries)
+        response.headers["X-Identity-Hits"] = str(scope.hits)
+    return response
+
+def scoped(handler):
+    # Socket events get the same load-once identity cache as HTTP requests
+    @functools.wraps(handler)
+    async def wrapper(*args):
+        with request_scope():
+            return await handler(*args)
+    return wrapper
+
 # Include API routers
 app.include_router(auth.router, prefix="/api/auth")
 app.include_router(users.router, prefix="/api/users")
@@ -31,9 +136,29 @@ app.mount("/ws", socket_app)
 # Mount the 'out' folder to serve the Next.js app
 app.mount("/", StaticFiles(directory="out", html=True), name="static")
 
-def get_current_user(token: str):
+@app.on_event("startup")
+async def startup():
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    identity_cache.subscribe(on_identity_change)
+    limiter.store = create_store(get_rate_limit_url())
+    limiter.trusted_proxies = proxy_networks(get_trusted_proxies())
+    ensure_indexes()
+    asyncio.create_task(revalidate_sessions())
+    Admin.start_config_refresher()
+    Deletions.start_worker()
+    AI.start_stats_flusher()
+    message_writer.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await message_writer.stop()
+    await asyncio.to_thread(AI.flush_stats)
+
+async def get_current_user(token: str):
+    secret_key = await get_secret_key_async()
     try:
-        payload = jwt.decode(token, Admin.get_config().get("secret_key"), algorithms=["HS256"])
+        payload = jwt.decode(token, secret_key, algorithms=["HS256"])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise ValueError("Invalid token")
@@ -41,30 +166,226 @@ def get_current_user(token: str):
     except JWTError:
         raise ValueError("Invalid token")
 
+##################################################
+# Socket sessions
+#
+# Identity is resolved once at connect and kept in the Socket.IO session;
+# events read it from there. Writes in core.py invalidate identity_cache,
+# which calls back here to refresh or revoke the affected sessions of this
+# worker; revalidate_sessions() catches up with writes made elsewhere.
+
+event_loop = None
+user_sids = {}
+
+def session_from_user(user):
+    return {
+        "user_id": user["_id"],
+        "username": user["username"],
+        "pfp": user["profile_picture"],
+        "is_admin": user.get("is_admin", False),
+        "ai_room": user.get("ai_room"),
+        "rooms": set(),
+    }
+
+def on_identity_change(kind, id, removed=None):
+    # May be called from a worker thread (sync routes), so hop onto the loop
+    if event_loop is None:
+        return
+    if kind == "user" and id in user_sids:
+        asyncio.run_coroutine_threadsafe(refresh_user_sessions(id), event_loop)
+    elif kind == "room" and removed == identity_cache.EVERYONE:
+        asyncio.run_coroutine_threadsafe(refresh_room_sessions(id), event_loop)
+    elif kind == "room" and removed in user_sids:
+        asyncio.run_coroutine_threadsafe(refresh_room_access(id, removed), event_loop)
+
+async def refresh_user_sessions(user_id):
+    try:
+        user = await AsyncUsers.get_user(user_id)
+    except ValueError:
+        user = None
+    await apply_user(user_id, user)
+
+async def apply_user(user_id, user):
+    # `user` is None when it no longer exists
+    for sid in list(user_sids.get(user_id, ())):
+        if user is None or user["status"] == "locked":
+            await sio.emit('error', {'error': "Your session has been revoked!"}, to=sid)
+            await sio.disconnect(sid)
+            continue
+        async with sio.session(sid) as session:
+            session.update(session_from_user(user), rooms=session["rooms"])
+
+async def check_room_access(sid, room_id):
+    session = await sio.get_session(sid)
+    if room_id not in session["rooms"]:
+        return
+    try:
+        allowed = await AsyncUsers.is_user_in_room(session["user_id"], room_id) \
+            and not await AsyncUsers.is_user_banned(session["user_id"], room_id)
+    except ValueError:
+        allowed = False
+    if not allowed:
+        await sio.leave_room(sid, room_id)
+        async with sio.session(sid) as session:
+            session["rooms"].discard(room_id)
+
+async def refresh_room_access(room_id, user_id):
+    for sid in list(user_sids.get(user_id, ())):
+        await check_room_access(sid, room_id)
+
+async def refresh_room_sessions(room_id):
+    for sid, _ in list(sio.manager.get_participants("/", room_id)):
+        await check_room_access(sid, room_id)
+
+async def revalidate_sessions():
+    while True:
+        await asyncio.sleep(SESSION_REVALIDATE_INTERVAL)
+        if not user_sids:
+            continue
+        try:
+            with request_scope():
+                users = await AsyncUsers.load_users(list(user_sids))
+                for user_id in list(user_sids):
+                    await apply_user(user_id, users.get(user_id))
+                    for sid in list(user_sids.get(user_id, ())):
+                        try:
+                            rooms = list((await sio.get_session(sid))["rooms"])
+                        except KeyError:
+                            # Disconnected in the meantime
+                            continue
+                        for room_id in rooms:
+                            await check_room_access(sid, room_id)
+        except Exception:
+            log.exception("Session revalidation failed")
+
+def session_room(session, data):
+    # The chat panel addresses the user's own AI room as "ai"
+    room_id = data.get("room_uuid")
+    if room_id == "ai":
+        room_id = session["ai_room"]
+    if not room_id or not ObjectId.is_valid(room_id):
+        raise ValueError("Room not found!")
+    return room_id
+
+async def session_user(sid, data):
+    session = await sio.get_session(sid)
+    return session["user_id"]
+
+async def rate_limited(sid, e):
+    await sio.emit('error', {'error': str(e), 'retry_after': e.retry_after}, to=sid)
+
 @sio.event
+@scoped
 async def connect(sid, environ, auth):
     try:
-        raise NotImplementedError("Connection logic has been removed from the public version.")
+        token = (auth or {}).get("token")
+        if not token:
+            raise ValueError("Invalid token")
+        user = await AsyncUsers.get_user(await get_current_user(token))
+        if user["status"] == "locked":
+            raise ValueError("Your account is locked!")
+        await sio.save_session(sid, session_from_user(user))
+        user_sids.setdefault(user["_id"], set()).add(sid)
     except ValueError as e:
         await sio.emit('error', {'error': str(e)}, to=sid)
-        return
+        return False
 
 @sio.event
+@scoped
 async def disconnect(sid):
-    raise NotImplementedError("Disconnecting logic has been removed from the public version.")
+    broadcaster.forget(sid)
+    task = ai_replies.pop(sid, None)
+    if task is not None:
+        task.cancel()
+    session = await sio.get_session(sid)
+    sids = user_sids.get(session.get("user_id"), set())
+    sids.discard(sid)
+    if not sids:
+        user_sids.pop(session.get("user_id"), None)
 
 @sio.event
+@scoped
+@limit_event(JOIN_LIMIT, key=session_user, on_reject=rate_limited)
 async def join(sid, data):
     try:
-        raise NotImplementedError("Joining logic has been removed from the public version.")
+        session = await sio.get_session(sid)
+        room_id = session_room(session, data)
+        if not await AsyncUsers.is_user_in_room(session["user_id"], room_id):
+            raise ValueError("You are not a member of this room!")
+        if await AsyncUsers.is_user_banned(session["user_id"], room_id):
+            raise ValueError("You are banned from this room!")
+        for room in sio.rooms(sid):
+            if room != sid:
+                await sio.leave_room(sid, room)
+        await sio.enter_room(sid, room_id)
+        async with sio.session(sid) as session:
+            session["rooms"] = {room_id}
     except ValueError as e:
         await sio.emit('error', {'error': str(e)}, to=sid)
 
 @sio.event
+@scoped
+@limit_event(MESSAGE_USER_LIMIT, key=session_user, on_reject=rate_limited)
 async def message(sid, data):
     try:
-
-        raise NotImplementedError("Messaging logic has been removed from the public version.")
-
+        session = await sio.get_session(sid)
+        room_id = session_room(session, data)
+        text = (data.get("message") or "").strip()
+        if room_id not in session["rooms"]:
+            raise ValueError("Join the room before sending messages!")
+        # Charged only once membership is known, so outsiders can't drain it
+        await limiter.hit(MESSAGE_ROOM_LIMIT, room_id)
+        if not text or len(text) > MAX_MESSAGE_LENGTH:
+            raise ValueError(f"Message must be between 1 and {MAX_MESSAGE_LENGTH} characters!")
+        msg = await AsyncRooms.add_message(room_id, text, pfp=session["pfp"], user=session["username"], is_ai=room_id == session["ai_room"])
+        await broadcaster.publish(room_id, msg)
+        if data.get("is_ai"):
+            await ask_ai(sid, session, room_id, msg)
+    except RateLimitExceeded as e:
+        await rate_limited(sid, e)
     except ValueError as e:
         await sio.emit('error', {'error': str(e)}, to=sid)
+
+async def ask_ai(sid, session, room_id, prompt):
+    if not await get_ai_status_async():
+        raise ValueError("This feature is currently disabled by an admin!")
+    if session["ai_room"] != room_id:
+        raise ValueError("You don't have access to the AI in this room!")
+    task = ai_replies.get(sid)
+    if task is not None and not task.done():
+        raise ValueError("Please wait for the AI to finish its answer!")
+    task = asyncio.create_task(stream_ai_reply(sid, session["user_id"], room_id, prompt))
+    ai_replies[sid] = task
+    task.add_done_callback(lambda t: ai_replies.pop(sid, None) if ai_replies.get(sid) is t else None)
+
+async def stream_ai_reply(sid, user_id, room_id, prompt):
+    """
+    Emit the AI reply to `prompt` (the stored message) as 'ai_token' events
+    while it is generated, then store it once and broadcast it like any other
+    message. Cached replies are sent at once; otherwise it waits for a slot
+    in ai_scheduler first. Cancelled, without storing anything, when the
+    socket disconnects. Errors are reported to the requester.
+    """
+    stream_id = str(ObjectId())
+    chunks = []
+    with request_scope():
+        try:
+            reply = await AI.cached_reply(room_id, prompt)
+            if reply is not None:
+                chunks.append(reply)
+                await sio.emit('ai_token', {'room_uuid': room_id, 'stream_id': stream_id, 'token': reply}, room=room_id)
+            else:
+                async with ai_scheduler.slot(user_id):
+                    async for chunk in AI.stream_llm(room_id, prompt):
+                        chunks.append(chunk)
+                        await sio.emit('ai_token', {'room_uuid': room_id, 'stream_id': stream_id, 'token': chunk}, room=room_id)
+            msg = await AsyncRooms.add_message(room_id, "".join(chunks), user="AI", is_ai=True)
+            await broadcaster.publish(room_id, {**msg, "stream_id": stream_id})
+        except (ValueError, QueueFullError) as e:
+            await sio.emit('error', {'error': str(e)}, to=sid)
+        except asyncio.TimeoutError:
+            await sio.emit('error', {'error': "The AI took too long to answer, please try again!"}, to=sid)
+        except Exception:
+            # Nothing awaits this task, so report here rather than lose it
+            log.exception("AI reply failed in room %s", room_id)
+            await sio.emit('error', {'error': "The AI failed to answer, please try again!"}, to=sid)
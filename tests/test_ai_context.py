@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+import asyncio
+import pytest
+from ai_context import ConversationWindow, estimate_tokens
+
+T0 = datetime(2025, 1, 1)
+
+
+def test_window_counts_tokens():
+    window = ConversationWindow("old news")
+    window.append("user", "a" * 40, (T0, 1))
+    window.append("assistant", "b" * 20)
+    assert window.tokens == estimate_tokens("old news") + 10 + 5
+    assert window.cursor == (T0, 1)
+    assert window.has_history
+
+
+def test_overflow_pops_oldest_turns_down_to_target():
+    window = ConversationWindow()
+    for i in range(5):
+        window.append("user", str(i) * 40, (T0, i))
+    assert window.overflow(budget=50, target=20) == []
+    dropped = window.overflow(budget=40, target=20)
+    assert [turn[1][0] for turn in dropped] == ["0", "1", "2"]
+    assert [turn[1][0] for turn in window.turns] == ["3", "4"]
+    assert window.turn_tokens == 20
+
+
+def test_overflow_keeps_the_newest_turn():
+    window = ConversationWindow()
+    window.append("user", "x" * 400)
+    assert window.overflow(budget=10, target=5) == []
+    window.append("user", "y" * 400)
+    assert len(window.overflow(budget=10, target=5)) == 1
+    assert window.turns[0][1] == "y" * 400
+
+
+def test_summary_replaces_dropped_turns():
+    window = ConversationWindow("")
+    window.append("user", "hello " * 20)
+    window.append("assistant", "hi " * 20)
+    window.append("user", "what did I say?")
+    window.overflow(budget=20, target=10)
+    window.set_summary("The user greeted the assistant.")
+    assert window.summary_tokens == estimate_tokens("The user greeted the assistant.")
+    messages = window.messages("Be nice.")
+    assert messages[0] == {"role": "system", "content": "Be nice."}
+    assert messages[1]["content"].endswith("The user greeted the assistant.")
+    assert messages[-1] == {"role": "user", "content": "what did I say?"}
+
+
+def matches(doc, query):
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict):
+            if not all(op == "$gt" and doc[field] > value for op, value in condition.items()):
+                return False
+        elif doc[field] != condition:
+            return False
+    return True
+
+
+class FakeMessages:
+    def __init__(self, docs):
+        self.docs = docs
+        self.updates = []
+
+    def find(self, query):
+        return FakeCursor([d for d in self.docs if matches(d, query)])
+
+    async def update_one(self, query, update, upsert=False):
+        self.updates.append((query, update))
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, spec):
+        return self
+
+    def __aiter__(self):
+        async def docs():
+            for doc in sorted(self.docs, key=lambda d: (d["timestamp"], d["_id"])):
+                yield doc
+        return docs()
+
+
+@pytest.fixture
+def core():
+    return pytest.importorskip("core")
+
+
+@pytest.fixture
+def store(core, monkeypatch):
+    collection = FakeMessages([])
+    monkeypatch.setattr(core, "async_collection", lambda c: collection)
+    monkeypatch.setattr(core, "messages_collection", None, raising=False)
+    monkeypatch.setattr(core, "ai_context_collection", lambda: None)
+    return collection
+
+
+def message(i, timestamp, room_id="r", user="ann"):
+    return {"_id": i, "room_id": room_id, "user": user, "message": f"m{i}", "timestamp": timestamp}
+
+
+def test_messages_after_cursor_include_same_timestamp_ties(core):
+    docs = [message(1, T0), message(2, T0), message(3, T0 + timedelta(seconds=1)), message(4, T0, room_id="other")]
+    after = [d["_id"] for d in docs if matches(d, core.messages_after_query("r", (T0, 1)))]
+    assert after == [2, 3]
+    assert core.messages_after_query("r", None) == {"room_id": "r"}
+
+
+def test_sync_catches_up_from_cursor_and_appends_unstored_prompt(core, store):
+    store.docs = [message(1, T0), message(2, T0), message(3, T0 + timedelta(seconds=1), user="AI")]
+    window = ConversationWindow(cursor=(T0, 1))
+    prompt_id = "65a000000000000000000000"
+    prompt = {"_id": prompt_id, "message": "next", "timestamp": (T0 + timedelta(seconds=2)).isoformat()}
+    asyncio.run(core.AIContexts.sync("r", window, prompt))
+    assert [(role, content) for role, content, _, _ in window.turns] == [
+        ("user", "m2"), ("assistant", "m3"), ("user", "next")
+    ]
+    assert str(window.cursor[1]) == prompt_id
+    asyncio.run(core.AIContexts.sync("r", window, prompt))
+    assert len(window.turns) == 3
+
+
+def test_compact_summarizes_oldest_turns_and_saves_cursor(core, store, monkeypatch):
+    summarized = []
+
+    async def summarize(summary, turns, max_tokens):
+        summarized.append([content for _, content, _, _ in turns])
+        return "earlier talk"
+
+    monkeypatch.setattr(core.AI, "summarize", summarize)
+    window = ConversationWindow()
+    for i in range(4):
+        window.append("user", "w" * 200, (T0 + timedelta(seconds=i), i))
+    asyncio.run(core.AIContexts.compact("r", window, budget=160))
+    assert summarized == [["w" * 200, "w" * 200]]
+    assert window.summary == "earlier talk" and len(window.turns) == 2
+    query, update = store.updates[-1]
+    assert query == {"_id": "r"}
+    assert update["$set"]["cursor_id"] == 1 and update["$set"]["summary"] == "earlier talk"
+    asyncio.run(core.AIContexts.compact("r", window, budget=1000))
+    assert len(summarized) == 1
@@ -0,0 +1,111 @@
+import pytest
+from ai_stats import AIStatsBuffer, bucket_key, latency_summary
+from histogram import bucket_percentile
+
+pymongo = pytest.importorskip("pymongo")
+
+
+def apply_inc(doc, inc):
+    # What MongoDB does with the $inc update built by drain()
+    for path, n in inc.items():
+        *parents, field = path.split(".")
+        target = doc
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[field] = target.get(field, 0) + n
+    return doc
+
+
+def test_observe_fills_count_sum_and_bucket():
+    stats = AIStatsBuffer(buckets=(0.1, 1))
+    stats.observe("response_time", 0.05)
+    stats.observe("response_time", 0.5)
+    stats.observe("response_time", 3)
+    stats.count("total_requests", 3)
+    doc = apply_inc({}, stats.drain())
+    section = doc["response_time"]
+    assert section["count"] == 3 and section["sum"] == pytest.approx(3.55)
+    assert section["buckets"] == {bucket_key(0.1): 1, bucket_key(1): 1, "inf": 1}
+    assert doc["total_requests"] == 3
+    assert stats.drain() == {}
+
+
+def test_restore_keeps_samples_counted_while_a_flush_failed():
+    stats = AIStatsBuffer()
+    stats.count("total_requests", 2)
+    inc = stats.drain()
+    stats.count("total_requests")
+    stats.restore(inc)
+    assert stats.drain() == {"total_requests": 3}
+
+
+class FlakyStats:
+    def __init__(self, stats, failures):
+        self.stats = stats
+        self.failures = failures
+        self.doc = {}
+
+    def update_one(self, query, update):
+        # A request finishing mid-flush must not be lost either
+        self.stats.count("total_requests")
+        if self.failures:
+            self.failures -= 1
+            raise pymongo.errors.AutoReconnect("down")
+        apply_inc(self.doc, update["$inc"])
+
+
+def test_flush_restores_on_failure_without_double_counting(monkeypatch):
+    core = pytest.importorskip("core")
+    stats = AIStatsBuffer()
+    collection = FlakyStats(stats, failures=1)
+    monkeypatch.setattr(core, "ai_stats", stats)
+    monkeypatch.setattr(core, "stats_collection", collection, raising=False)
+    monkeypatch.setattr(core, "STAT_DOC_ID", "65a000000000000000000000", raising=False)
+    stats.count("total_requests", 5)
+    stats.observe("response_time", 0.2)
+    core.AI.flush_stats()
+    assert collection.doc == {}
+    core.AI.flush_stats()
+    assert collection.doc["total_requests"] == 6
+    assert collection.doc["response_time"]["count"] == 1
+    core.AI.flush_stats()
+    assert collection.doc["total_requests"] == 7
+    assert collection.doc["response_time"]["count"] == 1
+    assert stats.drain() == {"total_requests": 1}
+
+
+def test_bucket_percentile_interpolates_inside_the_bucket():
+    buckets = (1, 2, 4)
+    assert bucket_percentile(buckets, [0, 0, 0, 0], 0.5) == 0.0
+    assert bucket_percentile(buckets, [10, 0, 0, 0], 0.5) == pytest.approx(0.5)
+    assert bucket_percentile(buckets, [0, 10, 10, 0], 0.5) == pytest.approx(2)
+    assert bucket_percentile(buckets, [0, 10, 10, 0], 0.75) == pytest.approx(3)
+    # Values above the last bound are reported at that bound
+    assert bucket_percentile(buckets, [0, 0, 0, 4], 0.99) == 4
+
+
+def test_latency_summary_from_stored_histogram():
+    stats = AIStatsBuffer(buckets=(1, 2, 4))
+    for seconds in (0.5, 1.5, 1.5, 3):
+        stats.observe("response_time", seconds)
+    section = apply_inc({}, stats.drain())["response_time"]
+    summary = latency_summary(section, buckets=(1, 2, 4))
+    assert summary["count"] == 4
+    assert summary["average"] == pytest.approx(1.625)
+    assert summary["stddev"] == pytest.approx(0.8927, abs=1e-4)
+    assert summary["p50"] == pytest.approx(1.5)
+    assert summary["p99"] == pytest.approx(3.92)
+    assert latency_summary({})["p95"] == 0.0
+
+
+def test_derive_ai_stats_adds_averages_and_response_rate():
+    core = pytest.importorskip("core")
+    stats = AIStatsBuffer()
+    stats.count("total_requests", 4)
+    stats.count("total_ai_responses", 3)
+    stats.observe("response_time", 2)
+    derived = core.derive_ai_stats(apply_inc({}, stats.drain()))
+    assert derived["ai_response_rate"] == 75
+    assert derived["average_response_time"] == 2
+    assert "average_first_token_time" not in derived
+    assert derived["first_token_time"]["count"] == 0
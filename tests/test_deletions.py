@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+import pytest
+
+core = pytest.importorskip("core")
+
+
+@pytest.fixture
+def updates(monkeypatch):
+    updates = []
+    monkeypatch.setattr(core.Deletions, "update", lambda job, fields, inc=None: updates.append(fields))
+    return updates
+
+
+def failing_job(monkeypatch, attempts):
+    def boom():
+        raise RuntimeError("boom")
+    monkeypatch.setattr(core.Deletions, "room_steps", lambda job: [("messages", boom)])
+    return {"_id": "job", "kind": "room", "target_id": "room", "attempts": attempts}
+
+
+def test_failed_job_is_retried_with_backoff(monkeypatch, updates):
+    before = datetime.now()
+    core.Deletions.run(failing_job(monkeypatch, 3))
+    last = updates[-1]
+    assert (last["state"], last["error"]) == ("pending", "boom")
+    delay = last["lease_until"] - before
+    assert timedelta(seconds=core.DELETION_RETRY_DELAY * 4) <= delay < timedelta(seconds=core.DELETION_RETRY_DELAY * 4 + 5)
+
+
+def test_job_fails_after_max_attempts(monkeypatch, updates):
+    core.Deletions.run(failing_job(monkeypatch, core.DELETION_MAX_ATTEMPTS))
+    assert updates[-1] == {"state": "failed", "error": "boom", "lease_until": None}
+
+
+def test_claimable_jobs_skip_backoff():
+    now = datetime.now()
+    query = core.claimable_deletion_jobs(now)
+    assert query["state"] == {"$in": ["pending", "running"]}
+    assert {"lease_until": {"$lt": now}} in query["$or"]
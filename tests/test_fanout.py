@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+import asyncio
+from fanout import RoomBroadcaster
+
+
+class FakeServer:
+    def __init__(self, queues):
+        self.queues = queues
+        self.emitted = []
+        self.disconnected = []
+        self.manager = SimpleNamespace(get_participants=lambda namespace, room: [(sid, sid) for sid in queues])
+        self.eio = SimpleNamespace(sockets={
+            sid: SimpleNamespace(queue=SimpleNamespace(qsize=lambda n=n: n)) for sid, n in queues.items()
+        })
+
+    async def emit(self, event, data, room=None, skip_sid=None):
+        self.emitted.append((event, data, skip_sid))
+
+    async def disconnect(self, sid):
+        self.disconnected.append(sid)
+
+
+def test_single_messages_go_out_as_lists():
+    sio = FakeServer({"a": 0})
+    asyncio.run(RoomBroadcaster(sio).publish("room", {"message": "hi"}))
+    assert sio.emitted == [("message", [{"message": "hi"}], None)]
+
+
+def test_messages_within_the_window_share_one_emit():
+    sio = FakeServer({"a": 0})
+    broadcaster = RoomBroadcaster(sio, window=0.01, max_batch=10)
+
+    async def scenario():
+        for i in range(3):
+            await broadcaster.publish("room", i)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert sio.emitted == [("message", [0, 1, 2], None)]
+    assert broadcaster.stats()["messages_per_send"] == 3
+
+
+def test_slow_consumers_are_skipped_then_disconnected():
+    sio = FakeServer({"fast": 0, "slow": 500})
+    broadcaster = RoomBroadcaster(sio, max_queue=100, max_strikes=2)
+
+    async def scenario():
+        for i in range(2):
+            await broadcaster.publish("room", i)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert [skip for _, _, skip in sio.emitted] == [["slow"], ["slow"]]
+    assert sio.disconnected == ["slow"]
+    assert broadcaster.stats()["skipped"] == 2
+
+
+def test_room_counts_keep_the_busiest_rooms():
+    sio = FakeServer({})
+    broadcaster = RoomBroadcaster(sio, max_rooms=2)
+
+    async def scenario():
+        for room in ("busy", "busy", "quiet", "new"):
+            await broadcaster.publish(room, "hi")
+
+    asyncio.run(scenario())
+    assert broadcaster.room_messages == {"busy": 2, "new": 1}
+    assert broadcaster.room_sends == {"busy": 2, "new": 1}
+    assert broadcaster.messages == 4
@@ -0,0 +1,63 @@
+from threading import Event
+import asyncio
+import pytest
+from hashing import HashPool, ServiceBusyError
+
+
+def blocker():
+    started, release = Event(), Event()
+
+    def work():
+        started.set()
+        release.wait(5)
+        return "done"
+    return work, started, release
+
+
+def test_run_returns_result_and_counts():
+    pool = HashPool(max_workers=2, max_queue=2)
+    assert pool.run(lambda x: x * 2, 21) == 42
+    stats = pool.stats()
+    assert stats["completed"] == 1
+    assert stats["running"] == 0
+    assert stats["queued"] == 0
+
+
+def test_rejects_when_queue_is_full():
+    pool = HashPool(max_workers=1, max_queue=1)
+    work, started, release = blocker()
+    running = pool.submit(work)
+    started.wait(5)
+    queued = pool.submit(lambda: None)
+    with pytest.raises(ServiceBusyError):
+        pool.submit(lambda: None)
+    assert pool.stats()["rejected"] == 1
+    release.set()
+    assert running.result(5) == "done"
+    queued.result(5)
+
+
+def test_cancelled_waiter_releases_its_slot():
+    pool = HashPool(max_workers=1, max_queue=2)
+    work, started, release = blocker()
+
+    async def scenario():
+        running = pool.submit(work)
+        await asyncio.to_thread(started.wait, 5)
+        waiter = asyncio.create_task(pool.run_async(lambda: "late"))
+        await asyncio.sleep(0.01)
+        assert pool.stats()["queued"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        await asyncio.wrap_future(running)
+
+    asyncio.run(scenario())
+    stats = pool.stats()
+    assert stats["queued"] == 0
+    assert stats["running"] == 0
+    # Every slot is free again: workers plus the whole queue can be taken
+    futures = [pool.submit(lambda: None) for _ in range(3)]
+    for future in futures:
+        future.result(5)
@@ -0,0 +1,44 @@
+import pytest
+import identity_cache
+from identity_cache import doc_size, request_scope
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    saved = dict(identity_cache.shared)
+    identity_cache.configure("room", max_bytes=1024 * 1024, ttl=30)
+    yield
+    identity_cache.shared.update(saved)
+
+
+def room(n):
+    return {"_id": "r1", "room_name": "general", "members": [f"user{i}" for i in range(n)]}
+
+
+def test_hits_share_nested_values_but_not_the_top_level():
+    loads = []
+    first = identity_cache.load("room", "r1", lambda: loads.append(1) or room(1000))
+    second = identity_cache.load("room", "r1", lambda: loads.append(1) or room(1000))
+    assert loads == [1]
+    assert first["members"] is second["members"]
+    first["room_name"] = "changed"
+    assert second["room_name"] == "general"
+    with pytest.raises(AttributeError):
+        first["members"].append("intruder")
+
+
+def test_scope_hits_are_counted():
+    with request_scope() as scope:
+        identity_cache.load("room", "r1", lambda: room(3))
+        identity_cache.load("room", "r1", lambda: room(3))
+    assert (scope.queries, scope.hits) == (1, 1)
+
+
+def test_cache_is_bounded_by_document_size():
+    big = doc_size(identity_cache.freeze(room(1000)))
+    identity_cache.configure("room", max_bytes=big * 2, ttl=30)
+    for i in range(5):
+        identity_cache.load("room", f"r{i}", lambda: room(1000))
+    stats = identity_cache.stats()["room"]
+    assert stats["size"] == 2
+    assert stats["weight"] <= big * 2
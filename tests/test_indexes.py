@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+import os
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+
+from pymongo.errors import OperationFailure, PyMongoError
+import indexes
+
+
+class FakeCollection:
+    def __init__(self, name="messages", existing=(), conflicts=(), plans=None):
+        self.name = name
+        self.existing = [{"name": "_id_"}] + [{"name": n} for n in existing]
+        self.conflicts = conflicts
+        self.created = []
+        self.commands = []
+        plans = plans or {}
+        self.database = SimpleNamespace(command=lambda name, body, verbosity: self.explain(body, plans))
+
+    def list_indexes(self):
+        return iter(self.existing)
+
+    def create_index(self, keys, name, **options):
+        if name in self.conflicts:
+            raise OperationFailure("conflict", code=85)
+        self.created.append((name, options))
+
+    def explain(self, body, plans):
+        self.commands.append(body)
+        return {"queryPlanner": {"winningPlan": plans[repr(body.get("filter", body.get("pipeline")))]}}
+
+
+def test_ensure_creates_missing_and_skips_conflicts():
+    collection = FakeCollection(existing=["room_id_1"], conflicts=["user_1"])
+    skipped = indexes.ensure(collection, [
+        ([("room_id", 1)], {}),
+        ([("user", 1)], {}),
+        ([("message", "text")], {"name": "search"}),
+        ([("timestamp", -1), ("_id", -1)], {"unique": True}),
+    ])
+    assert skipped == ["user_1"]
+    assert collection.created == [("search", {}), ("timestamp_-1__id_-1", {"unique": True})]
+
+
+def test_ensure_raises_other_failures():
+    collection = FakeCollection()
+
+    def create_index(keys, name, **options):
+        raise OperationFailure("unauthorized", code=13)
+
+    collection.create_index = create_index
+    with pytest.raises(OperationFailure):
+        indexes.ensure(collection, [([("a", 1)], {})])
+
+
+def test_winning_plans_are_found_at_any_depth():
+    explain = {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"stage": "FETCH"}}}}],
+               "shards": {"s0": {"winningPlan": {"stage": "IXSCAN"}}}}
+    assert sorted(p["stage"] for p in indexes.winning_plans(explain)) == ["FETCH", "IXSCAN"]
+
+
+def test_verify_reports_collection_scans():
+    indexed = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}
+    scan = {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}
+    collection = FakeCollection(plans={repr({"room_id": "x"}): indexed, repr([{"$match": {"user": "x"}}]): scan})
+    failures = indexes.verify([
+        ("by room", collection, {"find": {"room_id": "x"}, "limit": 5}),
+        ("by user", collection, {"aggregate": [{"$match": {"user": "x"}}]}),
+    ])
+    assert failures == ["by user"]
+    assert collection.commands[0] == {"find": "messages", "filter": {"room_id": "x"}, "limit": 5}
+    assert collection.commands[1] == {"aggregate": "messages", "pipeline": [{"$match": {"user": "x"}}], "cursor": {}}
+
+
+# A local mongod for the query-plan check; the test is skipped without one
+MONGO_TEST_URI = os.environ.get("MONGO_TEST_URI", "mongodb://localhost:27017")
+
+
+@pytest.fixture
+def live_core(monkeypatch):
+    core = pytest.importorskip("core")
+    client = pymongo.MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"no mongod at {MONGO_TEST_URI}")
+    db = client["live_chat_test_indexes"]
+    client.drop_database(db.name)
+    for name, collection in (("user_collection", "users"), ("room_collection", "rooms"),
+                             ("messages_collection", "messages")):
+        monkeypatch.setattr(core, name, db[collection], raising=False)
+    yield core
+    client.drop_database(db.name)
+    client.close()
+
+
+@pytest.mark.parametrize("memberships", [False, True])
+def test_query_shapes_use_indexes_on_mongod(live_core, monkeypatch, memberships):
+    monkeypatch.setattr(live_core, "MEMBERSHIP_COLLECTION", memberships)
+    live_core.ensure_indexes()
+    assert live_core.verify_query_plans() == []
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+from llm import FakeStreamingModel, create_model
+
+
+def collect(model, messages, max_tokens=100):
+    async def scenario():
+        return [chunk async for chunk in model.stream(messages, 1.0, max_tokens)]
+    return asyncio.run(scenario())
+
+
+def test_fake_model_echoes_word_by_word():
+    model = FakeStreamingModel(first_token_delay=0, token_delay=0)
+    chunks = collect(model, [{"role": "user", "content": "hi there"}])
+    assert chunks == ["You", " said:", " hi", " there"]
+
+
+def test_fake_model_respects_max_tokens():
+    model = create_model("fake://one two three four")
+    model.first_token_delay = model.token_delay = 0
+    assert "".join(collect(model, [], max_tokens=2)) == "one two"
+
+
+def test_create_model_dispatch():
+    assert create_model(None) is None
+    assert create_model("fake://").reply is None
+    with pytest.raises(ValueError):
+        create_model("ollama://llama3")
+
+
+def test_openai_models_take_the_configured_key():
+    pytest.importorskip("openai")
+    model = create_model("openai+http://localhost:8001/v1#local", api_key="sk-test")
+    assert model.model == "local"
+    assert model.client.api_key == "sk-test"
+    assert str(model.client.base_url).startswith("http://localhost:8001/v1")
+
+
+def test_openai_model_without_a_key_is_not_configured(monkeypatch):
+    pytest.importorskip("openai")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    with pytest.raises(ValueError):
+        create_model("openai://gpt-4o-mini")
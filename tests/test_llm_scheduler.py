@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+from llm_scheduler import LLMScheduler, QueueFullError
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+async def job(scheduler, user, order, hold=0.01):
+    async with scheduler.slot(user):
+        order.append(user)
+        await asyncio.sleep(hold)
+
+
+def test_concurrency_is_capped():
+    scheduler = LLMScheduler(max_concurrency=2, max_per_user=10)
+    peak = []
+
+    async def tracked(user):
+        async with scheduler.slot(user):
+            peak.append(scheduler.stats()["active"])
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        await asyncio.gather(*(tracked(f"u{i}") for i in range(6)))
+
+    run(scenario)
+    assert max(peak) == 2
+    assert scheduler.stats()["active"] == 0
+
+
+def test_users_are_served_round_robin():
+    scheduler = LLMScheduler(max_concurrency=1, max_per_user=3)
+    order = []
+
+    async def scenario():
+        blocker = asyncio.create_task(job(scheduler, "first", order, hold=0.05))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(job(scheduler, user, order)) for user in ["a", "a", "a", "b", "c"]]
+        await asyncio.gather(blocker, *tasks)
+
+    run(scenario)
+    assert order == ["first", "a", "b", "c", "a", "a"]
+
+
+def test_bursts_are_rejected_per_user_and_overall():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=3, max_per_user=2)
+    order = []
+
+    async def scenario():
+        blocker = asyncio.create_task(job(scheduler, "first", order, hold=0.05))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(job(scheduler, "a", order)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await job(scheduler, "a", order)
+        waiting.append(asyncio.create_task(job(scheduler, "b", order)))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await job(scheduler, "c", order)
+        await asyncio.gather(blocker, *waiting)
+
+    run(scenario)
+    assert scheduler.stats()["rejected"] == 2
+    assert sorted(order) == ["a", "a", "b", "first"]
+
+
+def test_queue_timeout_gives_up_without_leaking_the_slot():
+    scheduler = LLMScheduler(max_concurrency=1, queue_timeout=0.02)
+    order = []
+
+    async def scenario():
+        blocker = asyncio.create_task(job(scheduler, "first", order, hold=0.1))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await job(scheduler, "late", order)
+        await blocker
+        await job(scheduler, "next", order)
+
+    run(scenario)
+    stats = scheduler.stats()
+    assert order == ["first", "next"]
+    assert (stats["timed_out"], stats["active"], stats["queued"]) == (1, 0, 0)
+
+
+def test_service_timeout_releases_the_slot():
+    scheduler = LLMScheduler(max_concurrency=1, timeout=0.02)
+    order = []
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await job(scheduler, "slow", order, hold=1)
+        await job(scheduler, "next", order)
+
+    run(scenario)
+    assert order == ["slow", "next"]
+    assert scheduler.stats()["timed_out"] == 1
+
+
+def test_cancelled_waiters_leave_the_queue():
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = []
+
+    async def scenario():
+        blocker = asyncio.create_task(job(scheduler, "first", order, hold=0.05))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(job(scheduler, "gone", order))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await blocker
+
+    run(scenario)
+    stats = scheduler.stats()
+    assert order == ["first"]
+    assert (stats["cancelled"], stats["queued"], stats["active"]) == (1, 0, 0)
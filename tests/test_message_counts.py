@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+import pytest
+
+core = pytest.importorskip("core")
+
+
+class FakeRooms:
+    def __init__(self, rooms):
+        self.rooms = rooms
+
+    def find(self, query, projection):
+        return [dict(room) for room in self.rooms.values()]
+
+    def find_one(self, query, projection):
+        room = self.rooms.get(query["_id"])
+        return dict(room) if room else None
+
+    def update_one(self, query, update):
+        room = self.rooms.get(query["_id"])
+        expected = query["message_count"]
+        if expected == {"$exists": False}:
+            matched = room is not None and "message_count" not in room
+        else:
+            matched = room is not None and room.get("message_count") == expected
+        if matched:
+            room.update(update["$set"])
+        return SimpleNamespace(matched_count=int(matched))
+
+
+class FakeMessages:
+    def __init__(self, counts, on_count=None):
+        self.counts = counts
+        self.on_count = on_count
+
+    def count_documents(self, query):
+        count = self.counts[query["room_id"]]
+        if self.on_count:
+            self.on_count(query["room_id"])
+        return count
+
+
+def test_backfill_recounts_rooms_whose_counter_moved(monkeypatch):
+    rooms = FakeRooms({"a": {"_id": "a"}, "b": {"_id": "b", "message_count": 3}})
+    counts = {"a": 2, "b": 4}
+    moved = []
+
+    def concurrent_message(room_id):
+        # A message for b is stored and counted between the count and the $set
+        if room_id == "b" and not moved:
+            moved.append(room_id)
+            counts["b"] += 1
+            rooms.rooms["b"]["message_count"] += 1
+
+    monkeypatch.setattr(core, "room_collection", rooms, raising=False)
+    monkeypatch.setattr(core, "messages_collection", FakeMessages(counts, concurrent_message), raising=False)
+    assert core.Rooms.backfill_message_counts() == 2
+    assert rooms.rooms["a"]["message_count"] == 2
+    assert rooms.rooms["b"]["message_count"] == 5
@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+
+pytest.importorskip("pymongo")
+
+from metrics import Registry, instrument
+
+
+def test_render_counter_and_callback():
+    registry = Registry()
+    sends = registry.counter("sends_total", "Sends.", ["room"])
+    sends.inc("a")
+    sends.inc("a", n=2)
+    sends.inc('say "hi"\n')
+    registry.callback("queue_depth", "Queued.", lambda: [((), 4)])
+    assert registry.render().splitlines() == [
+        "# HELP sends_total Sends.",
+        "# TYPE sends_total counter",
+        'sends_total{room="a"} 3',
+        'sends_total{room="say \\"hi\\"\\n"} 1',
+        "# HELP queue_depth Queued.",
+        "# TYPE queue_depth gauge",
+        "queue_depth 4",
+    ]
+
+
+def test_render_histogram_buckets_are_cumulative():
+    registry = Registry()
+    seconds = registry.histogram("request_seconds", "Requests.", ["route"], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        seconds.observe(value, "/a")
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'request_seconds_bucket{route="/a",le="0.1"} 1',
+        'request_seconds_bucket{route="/a",le="1.0"} 3',
+        'request_seconds_bucket{route="/a",le="+Inf"} 4',
+        'request_seconds_sum{route="/a"} 4.05',
+        'request_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_families_are_registered_once():
+    registry = Registry()
+    registry.counter("x_total", "X.")
+    with pytest.raises(ValueError):
+        registry.histogram("x_total", "X.")
+
+
+class Service:
+
+    @staticmethod
+    def add(a, b):
+        return a + b
+
+    @staticmethod
+    def fail():
+        raise ValueError("no")
+
+    @staticmethod
+    async def fetch(value):
+        await asyncio.sleep(0)
+        return value
+
+    @staticmethod
+    async def stream():
+        yield 1
+
+
+def test_instrument_times_methods_only_once_called():
+    registry = Registry()
+    family = registry.histogram("method_seconds", "Methods.", ["method"])
+    instrument(Service, family)
+    assert "method_seconds_count" not in registry.render()
+    assert Service.add(1, 2) == 3
+    assert asyncio.run(Service.fetch("v")) == "v"
+    with pytest.raises(ValueError):
+        Service.fail()
+    assert Service.add.__name__ == "add"
+    counts = [line for line in registry.render().splitlines() if line.startswith("method_seconds_count")]
+    assert sorted(counts) == [
+        'method_seconds_count{method="Service.add"} 1',
+        'method_seconds_count{method="Service.fail"} 1',
+        'method_seconds_count{method="Service.fetch"} 1',
+    ]
+    # Async generators keep their own timing
+    assert asyncio.run(anext(Service.stream())) == 1
+    assert ("Service.stream",) not in family._children
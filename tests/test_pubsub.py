@@ -0,0 +1,51 @@
+import asyncio
+import pickle
+import pytest
+
+socketio = pytest.importorskip("socketio")
+
+from pubsub import AsyncLoopbackManager, LoopbackBroker, create_manager
+
+
+def test_broker_delivers_to_every_subscriber():
+    async def scenario():
+        broker = LoopbackBroker()
+        first, second = broker.subscribe("c"), broker.subscribe("c")
+        other = broker.subscribe("other")
+        await broker.publish("c", b"hello")
+        broker.unsubscribe("c", second)
+        await broker.publish("c", b"again")
+        return first, second, other
+
+    first, second, other = asyncio.run(scenario())
+    assert [first.get_nowait(), first.get_nowait()] == [b"hello", b"again"]
+    assert second.get_nowait() == b"hello" and second.empty()
+    assert other.empty()
+
+
+def test_loopback_managers_share_a_channel():
+    async def scenario():
+        broker = LoopbackBroker()
+        sender = AsyncLoopbackManager(channel="nodes", broker=broker)
+        receiver = AsyncLoopbackManager(channel="nodes", broker=broker)
+        listen = receiver._listen()
+        received = asyncio.ensure_future(listen.__anext__())
+        await asyncio.sleep(0)
+        await sender._publish({"method": "emit", "event": "message"})
+        data = await asyncio.wait_for(received, 1)
+        await listen.aclose()
+        return data, broker
+
+    data, broker = asyncio.run(scenario())
+    assert pickle.loads(data) == {"method": "emit", "event": "message"}
+    assert not broker.channels["nodes"]
+
+
+def test_create_manager():
+    assert create_manager(None) is None
+    manager = create_manager("loopback://chat")
+    assert isinstance(manager, AsyncLoopbackManager)
+    assert manager.channel == "chat"
+    assert create_manager("loopback://").channel == "socketio"
+    with pytest.raises(ValueError):
+        create_manager("kafka://broker:9092")
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+import asyncio
+import pytest
+
+pytest.importorskip("fastapi")
+
+from starlette.requests import Request
+from ratelimit import MemoryStore, RateLimit, RateLimiter, RateLimitExceeded, client_ip, proxy_networks
+
+LOGIN = RateLimit("login", rate=10 / 60, burst=10)
+REGISTER = RateLimit("register", rate=5 / 3600, burst=5)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("ratelimit.time", SimpleNamespace(monotonic=lambda: now[0], time=lambda: now[0]))
+    return now
+
+
+def hit(limiter, limit, key):
+    asyncio.run(limiter.hit(limit, key))
+
+
+def test_bucket_refills_over_time(clock):
+    limiter = RateLimiter(MemoryStore())
+    for _ in range(10):
+        hit(limiter, LOGIN, "1.2.3.4")
+    with pytest.raises(RateLimitExceeded) as e:
+        hit(limiter, LOGIN, "1.2.3.4")
+    assert e.value.retry_after == pytest.approx(6)
+    clock[0] += 6
+    hit(limiter, LOGIN, "1.2.3.4")
+    hit(limiter, LOGIN, "5.6.7.8")
+
+
+def test_slow_limit_does_not_hold_back_sweeping_of_others(clock):
+    store = MemoryStore()
+    limiter = RateLimiter(store)
+
+    async def scenario():
+        # A register bucket that takes an hour to refill comes first
+        await limiter.hit(REGISTER, "10.0.0.1")
+        for i in range(10000):
+            await limiter.hit(LOGIN, f"10.1.{i // 256}.{i % 256}")
+        assert len(store) == 10001
+        clock[0] += 61
+        await limiter.hit(LOGIN, "10.2.0.1")
+
+    asyncio.run(scenario())
+    assert len(store) == 2
+
+
+def request(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers():
+    assert client_ip(request("203.0.113.9", "1.1.1.1")) == "203.0.113.9"
+    assert client_ip(request("203.0.113.9", "1.1.1.1"), proxy_networks(["10.0.0.0/8"])) == "203.0.113.9"
+
+
+def test_forwarded_for_is_read_from_the_right_behind_trusted_proxies():
+    proxies = proxy_networks(["10.0.0.0/8", "192.0.2.1"])
+    # The client prepended a fake hop; the proxies appended the real one
+    assert client_ip(request("10.0.0.2", "1.1.1.1, 198.51.100.7, 192.0.2.1"), proxies) == "198.51.100.7"
+    assert client_ip(request("10.0.0.2"), proxies) == "10.0.0.2"
+    assert client_ip(request("10.0.0.2", "10.0.0.3"), proxies) == "10.0.0.3"
+
+
+def test_invalid_proxy_config():
+    with pytest.raises(ValueError):
+        proxy_networks(["not-an-ip"])
@@ -0,0 +1,118 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from response_cache import ResponseCache, cosine, normalize_prompt, signature, trigram_vector
+
+SCOPE = ("You are helpful.", 1.0, 1024)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("response_cache.time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_normalization_and_similarity():
+    assert normalize_prompt("  What's YOUR name?! ") == "what's your name"
+    a = trigram_vector(normalize_prompt("what is your name"))
+    b = trigram_vector(normalize_prompt("whats your name"))
+    c = trigram_vector(normalize_prompt("tell me a joke"))
+    assert cosine(a, b) >= 0.8
+    assert cosine(a, c) < 0.5
+
+
+def test_exact_and_similar_hits():
+    cache = ResponseCache()
+    cache.set("Hello there!", SCOPE, "Hi!")
+    assert cache.get("hello there", SCOPE) == "Hi!"
+    cache.set("what is your name", SCOPE, "I'm the assistant.")
+    assert cache.get("whats your name?", SCOPE) == "I'm the assistant."
+    assert cache.get("what is the time", SCOPE) is None
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["similar_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_scopes_do_not_share_replies():
+    cache = ResponseCache()
+    cache.set("hello", SCOPE, "Hi!")
+    assert cache.get("hello", ("Be terse.", 1.0, 1024)) is None
+
+
+def test_entries_expire(clock):
+    cache = ResponseCache(ttl=10)
+    cache.set("hello", SCOPE, "Hi!")
+    clock[0] += 11
+    assert cache.get("hello", SCOPE) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted_with_its_index():
+    cache = ResponseCache(maxsize=2)
+    cache.set("good morning", SCOPE, "1")
+    cache.set("good night", SCOPE, "2")
+    assert cache.get("good morning", SCOPE) == "1"
+    cache.set("see you", SCOPE, "3")
+    assert cache.get("good night", SCOPE) is None
+    assert cache.stats()["size"] == 2
+    assert (SCOPE, ("good", "night")) not in cache._signatures
+    cache.clear()
+    assert cache.stats()["size"] == 0 and not cache._signatures
+
+
+def test_numbers_and_operators_are_part_of_the_key():
+    assert normalize_prompt("What is 2+2?") == "what is 2 + 2"
+    assert normalize_prompt("what is 2+2") != normalize_prompt("what is 2-2")
+    assert normalize_prompt("pi is 3.14") == "pi is 3.14"
+    assert signature(normalize_prompt("what is your name")) == signature(normalize_prompt("whats your name"))
+
+
+@pytest.mark.parametrize("prompt", [
+    "what is 2-2", "what is 2+3", "what is 2*2", "what is 2 + 2 + 2", "what is 22", "what is 2+2 in binary",
+])
+def test_near_miss_prompts_do_not_reuse_replies(prompt):
+    cache = ResponseCache()
+    cache.set("what is 2+2", SCOPE, "4")
+    assert cache.get(prompt, SCOPE) is None
+    assert cache.get("What is 2 + 2?", SCOPE) == "4"
+
+
+def test_operand_order_matters():
+    cache = ResponseCache()
+    cache.set("what is 3-2", SCOPE, "1")
+    assert cache.get("what is 2-3", SCOPE) is None
+
+
+def test_different_content_words_do_not_match():
+    cache = ResponseCache()
+    cache.set("what is the capital of france", SCOPE, "Paris")
+    assert cache.get("what is the capital of spain", SCOPE) is None
+    assert cache.get("whats the capital of france", SCOPE) == "Paris"
+
+
+def test_cached_reply_skips_rooms_with_history(monkeypatch):
+    core = pytest.importorskip("core")
+    from ai_context import ConversationWindow
+    windows = {}
+
+    async def get(room_id):
+        return windows[room_id]
+
+    async def sync(room_id, window, prompt):
+        window.append("user", prompt["message"])
+
+    async def settings():
+        return SCOPE
+
+    monkeypatch.setattr(core, "AI_RESPONSE_CACHE", True)
+    monkeypatch.setattr(core, "ai_response_cache", ResponseCache())
+    monkeypatch.setattr(core.AIContexts, "get", get)
+    monkeypatch.setattr(core.AIContexts, "sync", sync)
+    monkeypatch.setattr(core.AI, "generation_settings", settings)
+    core.ai_response_cache.set("hello", SCOPE, "Hi!")
+    windows["new"] = ConversationWindow()
+    windows["busy"] = ConversationWindow()
+    windows["busy"].append("user", "my name is Ann")
+    prompt = {"message": "hello"}
+    assert asyncio.run(core.AI.cached_reply("new", prompt)) == "Hi!"
+    assert asyncio.run(core.AI.cached_reply("busy", prompt)) is None
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+import asyncio
+import pytest
+from write_behind import BatchWriter, RATE_WINDOW
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_batches_and_acks():
+    written = []
+
+    async def flush(docs):
+        written.append(list(docs))
+
+    async def scenario():
+        writer = BatchWriter(flush, max_batch=3, flush_interval=0.01)
+        writer.start()
+        await asyncio.gather(*(writer.submit(i, wait=True) for i in range(7)))
+        await writer.stop()
+        return writer.stats()
+
+    stats = run(scenario)
+    assert sorted(d for batch in written for d in batch) == list(range(7))
+    assert max(len(batch) for batch in written) <= 3
+    assert stats["persisted"] == 7
+    assert stats["dropped"] == 0
+
+
+def test_recent_batches_are_pruned_without_stats_calls(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("write_behind.time", SimpleNamespace(monotonic=lambda: clock[0]))
+
+    async def flush(docs):
+        pass
+
+    async def scenario():
+        writer = BatchWriter(flush, max_batch=1, flush_interval=0)
+        writer.start()
+        for i in range(5000):
+            clock[0] += 0.1
+            await writer.submit(i, wait=True)
+        await writer.stop()
+        return writer
+
+    writer = run(scenario)
+    assert len(writer._recent) <= RATE_WINDOW / 0.1 + 1
+    assert writer.persisted == 5000
+
+
+def test_failed_flush_is_retried():
+    attempts = []
+
+    async def flush(docs):
+        attempts.append(list(docs))
+        if len(attempts) < 3:
+            raise RuntimeError("primary stepped down")
+
+    async def scenario():
+        writer = BatchWriter(flush, flush_interval=0, max_retries=3, retry_delay=0.001)
+        writer.start()
+        await writer.submit("m", wait=True)
+        await writer.stop()
+        return writer.stats()
+
+    stats = run(scenario)
+    assert len(attempts) == 3
+    assert (stats["persisted"], stats["retries"], stats["dropped"]) == (1, 2, 0)
+
+
+def test_batch_is_dropped_and_counted_after_retries():
+    async def flush(docs):
+        raise RuntimeError("down")
+
+    async def scenario():
+        writer = BatchWriter(flush, flush_interval=0, max_retries=2, retry_delay=0.001)
+        writer.start()
+        with pytest.raises(RuntimeError):
+            await writer.submit("acked", wait=True)
+        await writer.submit("broadcast")
+        await writer.stop()
+        return writer.stats()
+
+    stats = run(scenario)
+    assert stats["dropped"] == 2
+    assert stats["errors"] == 6
+    assert stats["persisted"] == 0
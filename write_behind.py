@@ -0,0 +1,140 @@
+from collections import deque
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Throughput in stats() is measured over this many trailing seconds
+RATE_WINDOW = 10
+
+
+class BatchWriter:
+    """
+    Write-behind buffer: documents are queued and handed to `flush` in
+    batches of up to `max_batch`, or whatever arrived within
+    `flush_interval` seconds. The queue holds at most `max_queue` documents;
+    once full, `submit` waits for room, which pushes back on producers.
+    A failed flush is retried up to `max_retries` times, waiting
+    `retry_delay` seconds and doubling that after each attempt; a batch that
+    still fails is dropped and counted.
+    """
+
+    def __init__(self, flush, max_batch: int = 500, flush_interval: float = 0.05, max_queue: int = 10000,
+                 max_retries: int = 3, retry_delay: float = 0.5):
+        self.flush = flush
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = None
+        self._task = None
+        self._started_at = None
+        self._recent = deque()
+        self.persisted = 0
+        self.batches = 0
+        self.errors = 0
+        self.retries = 0
+        self.dropped = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._started_at = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, doc, wait: bool = False):
+        future = asyncio.get_running_loop().create_future() if wait else None
+        await self._queue.put((doc, future))
+        if future is not None:
+            await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(batch)
+
+    async def _write(self, batch):
+        try:
+            await self._flush_with_retries([doc for doc, _ in batch])
+            self.persisted += len(batch)
+            self.batches += 1
+            now = time.monotonic()
+            self._recent.append((now, len(batch)))
+            self._prune(now)
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_result(None)
+        except Exception as e:
+            self.dropped += len(batch)
+            log.error("Dropped a batch of %d documents after %d attempts: %s", len(batch), self.max_retries + 1, e)
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush_with_retries(self, docs):
+        # `flush` must be safe to repeat for documents it already wrote
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.flush(docs)
+            except Exception as e:
+                self.errors += 1
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                log.warning("Flush of %d documents failed, retrying in %.2fs: %s", len(docs), delay, e)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def _prune(self, now):
+        while self._recent and now - self._recent[0][0] > RATE_WINDOW:
+            self._recent.popleft()
+
+    def stats(self):
+        now = time.monotonic()
+        self._prune(now)
+        uptime = now - self._started_at if self._started_at else 0
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "persisted": self.persisted,
+            "batches": self.batches,
+            "errors": self.errors,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "average_batch_size": self.persisted / self.batches if self.batches else 0.0,
+            "messages_per_second": sum(n for _, n in self._recent) / RATE_WINDOW,
+            "lifetime_messages_per_second": self.persisted / uptime if uptime else 0.0,
+        }